@@ -0,0 +1,276 @@
+"""
+An in-process fake of the SNow Table API, serving the requests the handlers make over HTTP on localhost.
+"""
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+TABLE_PATH = '/api/now/table/'
+BATCH_PATH = '/api/now/v1/batch'
+REFERENCE_FIELDS = ('assignment_group',)
+
+
+class FakeServiceNow:
+    """
+    Fake SNow instance, holding the `change_request` and `sys_user_group` tables in memory.
+
+    Any group name exists, with a GUID derived from the name. The requests are answered after `latency` seconds, and
+    a random `error_rate` of them fail with a 500 error, and `throttle_rate` of them with a 429 error and a
+    `Retry-After` of `retry_after` seconds. The randomness is seeded, so that the runs are reproducible. The requests
+    of the Batch API are served one after the other, the faults being injected in the batch as a whole.
+
+    Usable as a context manager::
+
+        with FakeServiceNow(latency=0.05) as server:
+            settings.SNOW_HOST = server.host
+    """
+
+    def __init__(self, latency=0, error_rate=0, throttle_rate=0, retry_after=0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.change_requests = {}
+        # The number of requests received, per method
+        self.requests = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def host(self):
+        return '%s:%d' % self._server.server_address[:2]
+
+    def start(self):
+        handler = type('Handler', (_RequestHandler,), {'fake': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_fault(self):
+        """
+        Draw the fault to inject in a response, if any: `500`, `429` or `None`.
+        """
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.error_rate:
+            return 500
+        if draw < self.error_rate + self.throttle_rate:
+            return 429
+        return None
+
+    def count_request(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    @staticmethod
+    def get_group(name):
+        return {'sys_id': uuid.uuid5(uuid.NAMESPACE_DNS, name).hex, 'name': name}
+
+    def create_change_request(self, payload):
+        """
+        Create a change request, or return `None` if its sys_id is taken.
+        """
+        with self._lock:
+            if payload.get('sys_id') in self.change_requests:
+                return None
+            record = {
+                'sys_id': payload.get('sys_id') or uuid.uuid4().hex,
+                'number': 'CHG%07d' % (len(self.change_requests) + 1),
+                'state': '1',
+                'sys_created_on': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                'closed_at': '',
+            }
+            record.update((key, value) for key, value in payload.items() if key != 'sys_id')
+            record['sys_updated_on'] = record['sys_created_on']
+            self.change_requests[record['sys_id']] = record
+        return record
+
+    def update_change_request(self, sys_id, payload):
+        with self._lock:
+            record = self.change_requests.get(sys_id)
+            if record is not None:
+                record.update(payload)
+                record['sys_updated_on'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+                if record['state'] in ('3', '4') and not record['closed_at']:
+                    record['closed_at'] = record['sys_updated_on']
+        return record
+
+    def query_change_requests(self, query):
+        """
+        Get the change requests matching an encoded query of `=` and `IN` terms, which may be joined by `^OR`.
+        """
+        with self._lock:
+            records = list(self.change_requests.values())
+
+        groups = [
+            [term for term in group.split('^') if term and not term.startswith('ORDERBY')]
+            for group in query.split('^OR')
+        ]
+        return [
+            record for record in records
+            if any(all(self._matches(record, term) for term in group) for group in groups)
+        ]
+
+    @staticmethod
+    def _matches(record, term):
+        if 'IN' in term and '=' not in term:
+            name, values = term.split('IN', 1)
+            return record.get(name, '') in values.split(',')
+        name, _, value = term.partition('=')
+        return record.get(name, '') == value
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, which Nagle's algorithm would delay on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):  # NOQA: N802
+        self._handle('GET')
+
+    def do_POST(self):  # NOQA: N802
+        self._handle('POST')
+
+    def do_PATCH(self):  # NOQA: N802
+        self._handle('PATCH')
+
+    def _handle(self, method):
+        fake = self.fake
+        fake.count_request(method)
+        url = urlsplit(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        fault = fake.get_fault()
+        if fault == 429:
+            return self._respond(429, {'error': {'message': 'Too many requests'}}, {
+                'Retry-After': str(fake.retry_after)
+            })
+        if fault == 500:
+            return self._respond(500, {'error': {'message': 'Internal error'}})
+
+        if url.path == BATCH_PATH and method == 'POST':
+            return self._respond(200, self._batch(payload), raw=True)
+
+        status, result, project = self._dispatch(method, url.path, params, payload)
+        return self._respond(status, result, project=params if project else None)
+
+    def _dispatch(self, method, path, params, payload):
+        """
+        Serve a Table API request, returning its status, its result, and whether the result is to be projected.
+        """
+        fake = self.fake
+        if not path.startswith(TABLE_PATH):
+            return 400, {'error': {'message': 'Not a Table API path'}}, False
+        table, _, sys_id = path[len(TABLE_PATH):].partition('/')
+
+        if table == 'sys_user_group' and method == 'GET':
+            query = params.get('sysparm_query', '')
+            if query.startswith('nameIN'):
+                names = query[len('nameIN'):].split(',')
+            else:
+                names = [query.partition('=')[2]]
+            return 200, [fake.get_group(name) for name in names if name], False
+
+        if table != 'change_request':
+            return 400, {'error': {'message': 'Unknown table %s' % table}}, False
+
+        if method == 'POST':
+            record = fake.create_change_request(payload)
+            if record is None:
+                return 403, {'error': {'message': 'Operation Failed', 'detail': 'Error during insert'}}, False
+            return 201, record, True
+        if method == 'PATCH':
+            record = fake.update_change_request(sys_id, payload)
+            if record is None:
+                return 404, {'error': {'message': 'No Record found'}}, False
+            return 200, record, True
+
+        records = fake.query_change_requests(params.get('sysparm_query', ''))
+        records = records[:int(params.get('sysparm_limit') or 10000)]
+        return 200, records, True
+
+    def _batch(self, payload):
+        """
+        Serve the requests of a Batch API request, one after the other.
+        """
+        serviced = []
+        for request in payload.get('rest_requests', []):
+            url = urlsplit(request['url'])
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            body = json.loads(base64.b64decode(request.get('body') or '') or b'{}')
+            status, result, project = self._dispatch(request['method'], url.path, params, body)
+            if project:
+                result = self._project(result, params)
+            if status < 400:
+                result = {'result': result}
+            serviced.append({
+                'id': request['id'],
+                'status_code': status,
+                'status_text': HTTPStatus(status).phrase,
+                'headers': [{'name': 'Content-Type', 'value': 'application/json'}],
+                'body': base64.b64encode(json.dumps(result).encode('utf-8')).decode('ascii'),
+                'execution_time': 0,
+            })
+        return {
+            'batch_request_id': payload.get('batch_request_id'),
+            'serviced_requests': serviced,
+            'unserviced_requests': [],
+        }
+
+    def _respond(self, status, result, headers=None, project=None, raw=False):
+        if project is not None:
+            result = self._project(result, project)
+        if status < 400 and not raw:
+            result = {'result': result}
+        body = json.dumps(result).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _project(self, result, params):
+        if isinstance(result, list):
+            return [self._project(record, params) for record in result]
+
+        fields = [field for field in params.get('sysparm_fields', '').split(',') if field]
+        record = {field: result.get(field, '') for field in fields} if fields else dict(result)
+        if params.get('sysparm_exclude_reference_link') != 'true':
+            for field in REFERENCE_FIELDS:
+                if field in record:
+                    record[field] = {'link': 'https://fake/%s' % record[field], 'value': record[field]}
+        return record
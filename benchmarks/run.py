@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Benchmark the change request handlers against a fake SNow instance served on localhost.
+
+Measures the throughput, the latency percentiles, the HTTP round trips, the retries and the ORM queries of each
+scenario, and prints them as JSON::
+
+    python -m benchmarks.run --iterations 200 --latency 0.02 --throttle-rate 0.05 --output results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import django
+from django.conf import settings
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ('create', 'update', 'close', 'bulk_create', 'bulk_close', 'batch_create', 'batch_close', 'get')
+
+
+def configure(host, **options):
+    settings.configure(
+        SECRET_KEY='benchmarks',
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        INSTALLED_APPS=['django_snow'],
+        USE_TZ=True,
+        SNOW_INSTANCE='benchmarks',
+        SNOW_API_USER='benchmarks',
+        SNOW_API_PASS='benchmarks',
+        SNOW_ASSIGNMENT_GROUP='Benchmarks',
+        SNOW_HOST=host,
+        SNOW_USE_SSL=False,
+        **options
+    )
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+IMPORT_SCRIPT = """
+import time
+import django
+from django.conf import settings
+settings.configure(INSTALLED_APPS=['django_snow'])
+django.setup()
+start = time.perf_counter()
+import django_snow.helpers
+print(time.perf_counter() - start)
+"""
+
+
+def measure_import_time():
+    """
+    Measure how long importing `django_snow.helpers` takes in a fresh process, in seconds.
+    """
+    return float(subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], cwd=ROOT))
+
+
+def percentile(durations, rank):
+    """
+    Get the `rank` percentile of the durations, with the nearest-rank method.
+    """
+    if not durations:
+        return None
+    durations = sorted(durations)
+    index = max(0, min(len(durations) - 1, int(round(rank / 100.0 * len(durations) + 0.5)) - 1))
+    return durations[index]
+
+
+class Benchmark:
+    """
+    Runs the scenarios with a fresh handler each, measuring every operation of the scenario.
+    """
+
+    def __init__(self, iterations, bulk_size, workers):
+        self.iterations = iterations
+        self.bulk_size = bulk_size
+        self.workers = workers
+
+    def run(self, scenario):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        from django_snow.helpers import ChangeRequestHandler
+        from django_snow.models import ChangeRequest
+
+        handler = ChangeRequestHandler()
+        setup = getattr(self, 'setup_%s' % scenario, None)
+        state = setup(handler) if setup else None
+        handler.round_trips.clear()
+        handler.retries.clear()
+
+        operation = getattr(self, 'run_%s' % scenario)
+        durations = []
+        errors = 0
+        items = 0
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for index in range(self.iterations):
+                operation_start = time.perf_counter()
+                try:
+                    items += operation(handler, state, index)
+                except Exception:
+                    errors += 1
+                durations.append(time.perf_counter() - operation_start)
+            elapsed = time.perf_counter() - start
+
+        ChangeRequest.objects.all().delete()
+
+        return {
+            'scenario': scenario,
+            'iterations': self.iterations,
+            'items': items,
+            'errors': errors,
+            'elapsed_seconds': elapsed,
+            'items_per_second': items / elapsed if elapsed else None,
+            'latency_seconds': {
+                'mean': sum(durations) / len(durations) if durations else None,
+                'p50': percentile(durations, 50),
+                'p99': percentile(durations, 99),
+                'max': max(durations) if durations else None,
+            },
+            'round_trips': sum(handler.round_trips.values()),
+            'retries': sum(handler.retries.values()),
+            'queries': len(queries),
+            'queries_per_item': len(queries) / float(items) if items else None,
+        }
+
+    def _create(self, handler, count):
+        specs = [{'title': 'Benchmark %d' % index, 'description': 'Benchmark'} for index in range(count)]
+        return [result.change_request for result in handler.create_change_requests(specs) if result.error is None]
+
+    def run_create(self, handler, state, index):
+        handler.create_change_request('Benchmark %d' % index, 'Benchmark')
+        return 1
+
+    def setup_update(self, handler):
+        return self._create(handler, self.iterations)
+
+    def run_update(self, handler, change_requests, index):
+        handler.update_change_request(change_requests[index], {'description': 'Updated %d' % index})
+        return 1
+
+    def setup_close(self, handler):
+        return self._create(handler, self.iterations)
+
+    def run_close(self, handler, change_requests, index):
+        handler.close_change_request(change_requests[index])
+        return 1
+
+    def run_bulk_create(self, handler, state, index):
+        specs = [{'title': 'Benchmark %d' % item, 'description': 'Benchmark'} for item in range(self.bulk_size)]
+        results = handler.create_change_requests(specs, max_workers=self.workers)
+        return sum(1 for result in results if result.error is None)
+
+    def setup_bulk_close(self, handler):
+        return self._create(handler, self.iterations * self.bulk_size)
+
+    def run_bulk_close(self, handler, change_requests, index):
+        chunk = change_requests[index * self.bulk_size:(index + 1) * self.bulk_size]
+        results = handler.close_change_requests(chunk, max_workers=self.workers)
+        return sum(1 for result in results if result.error is None)
+
+    def run_batch_create(self, handler, state, index):
+        from django_snow.helpers.batch import ChangeRequestBatch
+
+        batch = ChangeRequestBatch(handler)
+        for item in range(self.bulk_size):
+            batch.create_change_request('Benchmark %d' % item, 'Benchmark')
+        return sum(1 for result in batch.execute() if result.error is None)
+
+    def setup_batch_close(self, handler):
+        return self._create(handler, self.iterations * self.bulk_size)
+
+    def run_batch_close(self, handler, change_requests, index):
+        from django_snow.helpers.batch import ChangeRequestBatch
+
+        batch = ChangeRequestBatch(handler)
+        for change_request in change_requests[index * self.bulk_size:(index + 1) * self.bulk_size]:
+            batch.close_change_request(change_request)
+        return sum(1 for result in batch.execute() if result.error is None)
+
+    def setup_get(self, handler):
+        return [change_request.number for change_request in self._create(handler, self.bulk_size)]
+
+    def run_get(self, handler, numbers, index):
+        # A max age of 0 forces every change request to be fetched from SNow.
+        return len(handler.get_change_requests(numbers, max_age=0))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100, help='The number of operations per scenario')
+    parser.add_argument('--latency', type=float, default=0, help='The latency of the fake SNow, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='The share of requests failing with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='The share of requests failing with a 429')
+    parser.add_argument('--retry-after', type=float, default=0, help='The Retry-After of the 429s, in seconds')
+    parser.add_argument('--bulk-size', type=int, default=50, help='The change requests per bulk operation')
+    parser.add_argument('--workers', type=int, default=8, help='The concurrent requests of the bulk operations')
+    parser.add_argument('--seed', type=int, default=0, help='The seed of the injected faults')
+    parser.add_argument(
+        '--scenarios', default=','.join(SCENARIOS),
+        help='The comma-separated scenarios, among %s' % ', '.join(SCENARIOS),
+    )
+    parser.add_argument('--output', help='The file to write the JSON results to, defaults to stdout')
+    args = parser.parse_args(argv)
+
+    scenarios = [scenario for scenario in args.scenarios.split(',') if scenario]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+    sys.path.insert(0, ROOT)
+    from benchmarks.fake_snow import FakeServiceNow
+
+    logging.disable(logging.CRITICAL)
+    server = FakeServiceNow(
+        latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after, seed=args.seed,
+    )
+    with server:
+        configure(server.host, SNOW_RETRY_BACKOFF=0.01, SNOW_RETRY_MAX_BACKOFF=0.1, SNOW_POOL_MAXSIZE=args.workers)
+        benchmark = Benchmark(args.iterations, args.bulk_size, args.workers)
+        results = [benchmark.run(scenario) for scenario in scenarios]
+
+    with open(os.path.join(ROOT, 'VERSION')) as f:
+        version = f.read().strip()
+    report = {
+        'version': version,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'options': vars(args),
+        'import_seconds': measure_import_time(),
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
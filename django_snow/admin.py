@@ -0,0 +1,183 @@
+import uuid
+
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .helpers import ChangeRequestHandler
+from .models import ChangeRequest
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which does not count all the rows of large tables.
+
+    The count of an unfiltered table is the estimate kept by the database, on PostgreSQL and MySQL, if it is over
+    `max_count`. Otherwise, the rows are counted up to `max_count`, which caps the count.
+    """
+
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self._estimate_count(queryset)
+            if estimate is not None and estimate > self.max_count:
+                return estimate
+        return queryset[:self.max_count].count()
+
+    @staticmethod
+    def _estimate_count(queryset):
+        """
+        Get the estimated number of rows of the table of the queryset, or `None` if the database does not estimate it.
+        """
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples FROM pg_class WHERE oid = %s::regclass'
+            params = [connection.ops.quote_name(table)]
+        elif connection.vendor == 'mysql':
+            sql = (
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+            )
+            params = [table]
+        else:
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        # PostgreSQL estimates the tables which were never vacuumed nor analyzed to -1 rows, or 0 before version 14
+        if row is None or row[0] is None or row[0] <= 0:
+            return None
+        return int(row[0])
+
+
+class AssignmentGroupListFilter(admin.SimpleListFilter):
+    """
+    Filters the change requests by assignment group, served by the index on the group and the state.
+
+    The groups listed are those of the open change requests, looked up through the partial index of the open change
+    requests. The change requests of any other group are filtered by passing its GUID.
+    """
+
+    title = 'assignment group'
+    parameter_name = 'assignment_group_guid'
+    max_groups = 100
+
+    def lookups(self, request, model_admin):
+        groups = (
+            ChangeRequest.objects.open().order_by('assignment_group_guid')
+            .values_list('assignment_group_guid', flat=True).distinct()[:self.max_groups]
+        )
+        return [(group.hex, str(group)) for group in groups if group is not None]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            return queryset.filter(assignment_group_guid=uuid.UUID(self.value()))
+        except ValueError:
+            return queryset.none()
+
+
+@admin.register(ChangeRequest)
+class ChangeRequestAdmin(admin.ModelAdmin):
+    """
+    Read-only admin of the change requests, which stays fast on tables of millions of them.
+
+    The change list is not counted in full (see :class:`EstimatedCountPaginator`), its filters are served by indexes,
+    as is its ordering unless filtered by group, and the search is restricted to the number prefixes and the GUIDs.
+    The change requests are only changed through SNow, by the actions.
+    """
+
+    list_display = ('number', 'title', 'state', 'assignment_group_guid', 'created_time', 'closed_time')
+    list_filter = ('state', AssignmentGroupListFilter)
+    search_fields = ('number',)
+    ordering = ('-created_time',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['refresh_from_snow', 'close_in_snow']
+
+    # The maximum number of change requests an action applies to
+    max_action_size = 1000
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        try:
+            guid = uuid.UUID(search_term)
+        except ValueError:
+            pass
+        else:
+            return queryset.filter(Q(pk=guid) | Q(assignment_group_guid=guid)), False
+
+        # The range lets the index on the number serve the prefix whatever the collation of the column, which a LIKE
+        # cannot always.
+        prefix = search_term.upper()
+        upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return queryset.filter(number__gte=prefix, number__lt=upper_bound, number__startswith=prefix), False
+
+    def get_handler(self):
+        """
+        Get the handler the actions make the requests to SNow with.
+        """
+        return ChangeRequestHandler()
+
+    def _get_selection(self, request, queryset):
+        """
+        Get the selected change requests, or `None` if too many of them are selected.
+        """
+        change_requests = list(queryset[:self.max_action_size + 1])
+        if len(change_requests) > self.max_action_size:
+            self.message_user(
+                request, 'Select at most %d change requests at once.' % self.max_action_size, messages.ERROR
+            )
+            return None
+        return change_requests
+
+    def refresh_from_snow(self, request, queryset):
+        change_requests = self._get_selection(request, queryset.only('sys_id', 'number'))
+        if change_requests is None:
+            return
+
+        refreshed = self.get_handler().get_change_requests(
+            [change_request.sys_id for change_request in change_requests], max_age=0
+        )
+        self.message_user(request, 'Refreshed %d change requests from SNow.' % len(refreshed), messages.SUCCESS)
+        missing = len(change_requests) - len(refreshed)
+        if missing:
+            self.message_user(request, '%d change requests are not in SNow.' % missing, messages.WARNING)
+
+    refresh_from_snow.short_description = 'Refresh the selected change requests from SNow'
+    refresh_from_snow.allowed_permissions = ('view',)
+
+    def close_in_snow(self, request, queryset):
+        change_requests = self._get_selection(request, queryset.open())
+        if change_requests is None:
+            return
+
+        results = self.get_handler().close_change_requests(change_requests)
+        closed = sum(1 for result in results if result.error is None)
+        if closed:
+            self.message_user(request, 'Closed %d change requests in SNow.' % closed, messages.SUCCESS)
+        for result in results:
+            if result.error is not None:
+                self.message_user(request, 'Could not close %s: %s' % (result.item, result.error), messages.ERROR)
+
+    close_in_snow.short_description = 'Close the selected change requests in SNow'
+    close_in_snow.allowed_permissions = ('change',)
@@ -1,9 +1,29 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+logger = logging.getLogger('django_snow')
 
 
 class ServiceNow(AppConfig):
-    name = 'service-now'
+    name = 'django_snow'
     verbose_name = 'ServiceNow'
 
     def ready(self):
-        pass
+        group_names = getattr(settings, 'SNOW_PREFETCH_ASSIGNMENT_GROUPS', None)
+        if group_names:
+            self.prefetch_group_guids(group_names)
+
+    @staticmethod
+    def prefetch_group_guids(group_names):
+        """
+        Warm the SNow Group Name - GUID cache. Failures are logged, and must not prevent the project from starting.
+        """
+        from .helpers import ChangeRequestHandler
+
+        try:
+            ChangeRequestHandler().prefetch_group_guids(group_names)
+        except Exception:
+            logger.exception('Could not prefetch the SNow groups')
@@ -1,6 +1,7 @@
-from .snow_request_handler import ChangeRequestHandler
+from .snow_request_handler import ChangeRequestHandler, ChangeRequestResult
 
 
 __all__ = [
-    'ChangeRequestHandler'
+    'ChangeRequestHandler',
+    'ChangeRequestResult',
 ]
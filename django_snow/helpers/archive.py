@@ -0,0 +1,92 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import ArchivedChangeRequest, ChangeRequest, ChangeRequestOperation
+
+
+logger = logging.getLogger('django_snow')
+
+
+class ChangeRequestArchiver:
+    """
+    Moves the change requests closed for a while out of the `ChangeRequest` table, to `ArchivedChangeRequest` or
+    nowhere at all.
+
+    The change requests are walked in `closed_time` then `sys_id` order, one chunk at a time, with keyset pagination
+    served by the index on `closed_time`. Each chunk is moved in its own short transaction, and the archiver pauses
+    between the chunks, so that it can run against a live table without holding long locks nor hogging the database.
+    The change requests with operations still queued for SNow are skipped.
+    """
+
+    def __init__(self, days, chunk_size=1000, pause=0, delete=False):
+        """
+        :param days: The number of days after which the closed change requests are archived
+        :type days: int
+        :param chunk_size: The number of change requests moved per transaction
+        :type chunk_size: int
+        :param pause: The number of seconds to pause for between the chunks
+        :type pause: float
+        :param delete: Whether to delete the change requests, rather than to move them to `ArchivedChangeRequest`
+        :type delete: bool
+        """
+        self.days = days
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.delete = delete
+
+    def archive(self):
+        """Archive the change requests closed more than `days` days ago.
+
+        :return: The number of change requests archived
+        :rtype: int
+        """
+        cutoff = timezone.now() - timedelta(days=self.days)
+        queued = ChangeRequestOperation.objects.filter(
+            status__in=[ChangeRequestOperation.STATUS_PENDING, ChangeRequestOperation.STATUS_PROCESSING]
+        )
+        change_requests = (
+            ChangeRequest.objects
+            .filter(closed_time__lt=cutoff, state__in=ChangeRequest.CLOSED_STATES)
+            .exclude(sys_id__in=queued.values('change_request_id'))
+            .order_by('closed_time', 'sys_id')
+        )
+
+        archived = 0
+        after = None
+        while True:
+            chunk = change_requests
+            if after is not None:
+                chunk = chunk.filter(
+                    Q(closed_time__gt=after[0]) | Q(closed_time=after[0], sys_id__gt=after[1])
+                )
+
+            start = time.perf_counter()
+            with transaction.atomic():
+                rows = list(chunk.select_for_update().values(*ArchivedChangeRequest.COPIED_FIELDS)[:self.chunk_size])
+                if not rows:
+                    break
+                self._move(rows)
+            archived += len(rows)
+            after = (rows[-1]['closed_time'], rows[-1]['sys_id'])
+            logger.debug('Archived %d change requests in %.3f seconds', len(rows), time.perf_counter() - start)
+
+            if len(rows) < self.chunk_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+
+        return archived
+
+    def _move(self, rows):
+        if not self.delete:
+            # The change requests archived before, then fetched from SNow again, keep their first archived copy
+            ArchivedChangeRequest.objects.bulk_create(
+                [ArchivedChangeRequest(**row) for row in rows], ignore_conflicts=True
+            )
+        # The operations of the change requests are deleted along with them, which only needs their sys_id
+        ChangeRequest.objects.filter(sys_id__in=[row['sys_id'] for row in rows]).only('sys_id').delete()
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import time
+from functools import partial
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import ChangeRequest
+from .exceptions import ChangeRequestException
+from .snow_request_handler import BaseChangeRequestHandler
+
+
+logger = logging.getLogger('django_snow')
+
+
+class AsyncChangeRequestHandler(BaseChangeRequestHandler):
+    """
+    SNow Change Request Handler for asyncio applications.
+
+    The requests to SNow are sent with a pooled :class:`httpx.AsyncClient`, sized by `SNOW_POOL_MAXSIZE` and with
+    the `SNOW_TIMEOUT` timeout, and retried as per the `SNOW_RETRY_*` settings. The :class:`ChangeRequest` models
+    are saved with
+    :func:`asgiref.sync.sync_to_async`. The handler should be closed once done with, either with :meth:`aclose` or
+    by using it as an async context manager::
+
+        async with AsyncChangeRequestHandler() as co_handler:
+            change_request = await co_handler.create_change_request('Title', 'Description')
+    """
+
+    def __init__(self, client=None):
+        """
+        :param client: (optional) The client to send the requests with, e.g. to share its connection pool between
+            handlers. It is not closed by the handler.
+        :type client: :class:`httpx.AsyncClient`
+        """
+        super().__init__()
+        self._client = client
+        self._owns_client = client is None
+        self._group_guid_locks = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        Close the connections of the handler's client, unless it was given one.
+        """
+        if self._owns_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def create_change_request(self, title, description, assignment_group=None, payload=None):
+        """
+        Create a change request with the given payload.
+        """
+        payload = self._prepare_create_payload(title, description, payload)
+        if 'assignment_group' not in payload:
+            payload['assignment_group'] = await self.get_snow_group_guid(
+                assignment_group or self.snow_assignment_group
+            )
+
+        sys_id = self._add_sys_id(payload)
+
+        async def find_created():
+            # The failed attempt may have created the change request anyway, e.g. on a gateway timeout.
+            params = dict(self._get_response_params(), sysparm_query='sys_id=%s' % sys_id, sysparm_limit=1)
+            response = await self._send_once('create', 'GET', self.CHANGE_REQUEST_TABLE_PATH, params=params)
+            records = response.json()['result']
+            return records[0] if records else None
+
+        result = await self._send(
+            'create', 'POST', self.CHANGE_REQUEST_TABLE_PATH, recover=find_created if sys_id else None,
+            json=payload, params=self._get_response_params()
+        )
+
+        change_request = self._build_change_request(result)
+        await sync_to_async(change_request.save)(force_insert=True)
+
+        return change_request
+
+    async def close_change_request(self, change_request):
+        """Mark the change request as completed."""
+
+        payload = {'state': ChangeRequest.TICKET_STATE_COMPLETE}
+        if change_request.state != ChangeRequest.TICKET_STATE_COMPLETE:
+            change_request.closed_time = timezone.now()
+        await self.update_change_request(change_request, payload)
+
+    async def close_change_request_with_error(self, change_request, payload):
+        """Mark the change request as completed with error.
+
+        See :meth:`ChangeRequestHandler.close_change_request_with_error`.
+        """
+        payload['state'] = ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS
+        if change_request.state != ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS:
+            change_request.closed_time = timezone.now()
+        await self.update_change_request(change_request, payload)
+
+    async def update_change_request(self, change_request, payload):
+        """Update the change request with the data from the payload.
+
+        See :meth:`ChangeRequestHandler.update_change_request`.
+        """
+        payload = self._get_changed_payload(change_request, payload)
+        if not payload:
+            return None
+
+        path = '%s/%s' % (self.CHANGE_REQUEST_TABLE_PATH, change_request.sys_id.hex)
+        result = await self._send('update', 'PATCH', path, json=payload, params=self._get_response_params())
+
+        self._apply_result(change_request, result)
+        await sync_to_async(self._save_changes)(change_request)
+
+        return result
+
+    async def get_snow_group_guid(self, group_name):
+        """
+        Get the SNow Group's GUID from the Group Name
+        """
+        guid = self.group_guid_cache.get(group_name)
+        if guid is not None:
+            self.metrics.observe_group_cache(hits=1, misses=0)
+            return guid
+
+        # Concurrent lookups of the same group by the handler's tasks are collapsed into one.
+        lock = self._group_guid_locks.setdefault(group_name, asyncio.Lock())
+        async with lock:
+            guid = self.group_guid_cache.get(group_name)
+            self.metrics.observe_group_cache(hits=int(guid is not None), misses=int(guid is None))
+            if guid is None:
+                response = await self._send_with_retries(
+                    'group_lookup', 'GET', self.USER_GROUP_TABLE_PATH, params={'sysparm_query': 'name=%s' % group_name}
+                )
+                records = response.json()['result']
+                if len(records) != 1:
+                    raise ChangeRequestException(
+                        'Expected a single SNow group named %s, found %d' % (group_name, len(records))
+                    )
+
+                guid = records[0]['sys_id']
+                self.group_guid_cache.set(group_name, guid)
+
+        return guid
+
+    async def _before_async_request(self, operation):
+        """
+        Account for a round trip to SNow about to be made, as :meth:`_before_request` does, and let it through the
+        circuit breaker. Returns whether the request probes the half-open circuit.
+        """
+        probe = False
+        if self.circuit_breaker is not None:
+            # The circuit breaker may be shared through a cache, which must not be waited for in the event loop.
+            probe = await sync_to_async(self._before_circuit_breaker, thread_sensitive=False)()
+        if self.rate_limiter is not None:
+            # Waiting for the rate limiter blocks, so it must not happen in the event loop.
+            await sync_to_async(self.rate_limiter.acquire, thread_sensitive=False)()
+        self._count_round_trip(operation)
+        return probe
+
+    async def _after_async_request(self, probe, exception=None):
+        """
+        Report the outcome of a request to the circuit breaker, even if the request was cancelled, e.g. by
+        `asyncio.wait_for`. A cancelled probe counts as failed, and the other cancelled requests are not counted.
+        """
+        if self.circuit_breaker is None:
+            return
+        if isinstance(exception, asyncio.CancelledError):
+            if probe:
+                # Reported synchronously, as awaiting could be interrupted by another cancellation
+                self.circuit_breaker.after_request(probe, True)
+            return
+        await sync_to_async(self._after_circuit_breaker, thread_sensitive=False)(probe, exception)
+
+    async def _send(self, operation, method, path, recover=None, **kwargs):
+        """
+        Make a request to SNow on behalf of the given handler operation, retrying it as per the retry policy, and
+        return its result.
+
+        :param recover: (optional) An async callable called before each retry, returning the result of the failed
+            attempt if it can tell it, or `None` to make the request again
+        """
+        attempts = []
+
+        async def attempt():
+            if attempts and recover is not None:
+                result = await recover()
+                if result is not None:
+                    return result
+            attempts.append(None)
+            response = await self._send_once(operation, method, path, **kwargs)
+            body = response.json()
+            return body.get('result', body)
+
+        try:
+            result = await self.retry_policy.acall(attempt, before_retry=partial(self._before_retry, operation))
+        except httpx.HTTPStatusError as e:
+            logger.error('Could not %s change request due to %s', operation, e.response.text)
+            raise ChangeRequestException('Could not %s change request due to %s' % (operation, e.response.text))
+
+        self._check_result(result, operation)
+
+        return result
+
+    async def _send_with_retries(self, operation, method, path, **kwargs):
+        """
+        Make a request to SNow on behalf of the given handler operation, retrying it as per the retry policy, and
+        return its successful response, or raise its :class:`httpx.HTTPStatusError`.
+        """
+        return await self.retry_policy.acall(
+            partial(self._send_once, operation, method, path, **kwargs),
+            before_retry=partial(self._before_retry, operation)
+        )
+
+    async def _send_once(self, operation, method, path, **kwargs):
+        probe = await self._before_async_request(operation)
+        start = time.perf_counter()
+        try:
+            response = await self._get_client().request(method, path, **kwargs)
+            self._observe_response(operation, start, response)
+            response.raise_for_status()
+        except BaseException as e:
+            if isinstance(e, httpx.TransportError):
+                self._observe_error(operation, start, e)
+            await self._after_async_request(probe, e)
+            raise
+        await self._after_async_request(probe)
+        return response
+
+    @staticmethod
+    def _is_outage(exception):
+        if isinstance(exception, httpx.TransportError):
+            return True
+        return BaseChangeRequestHandler._is_outage(exception)
+
+    def _observe_response(self, operation, start, response):
+        if not self.metrics.enabled:
+            return
+
+        duration = time.perf_counter() - start
+        self.metrics.observe_request(
+            operation, str(response.status_code), duration, len(response.request.content), len(response.content)
+        )
+
+    def _observe_error(self, operation, start, exception):
+        if self.metrics.enabled:
+            self.metrics.observe_request(operation, type(exception).__name__, time.perf_counter() - start)
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self._get_base_url(),
+                auth=(self.snow_api_user, self.snow_api_pass),
+                headers={'Accept': 'application/json'},
+                limits=httpx.Limits(max_connections=getattr(settings, 'SNOW_POOL_MAXSIZE', 10)),
+                timeout=self._get_timeout(),
+            )
+        return self._client
+
+    def _get_base_url(self):
+        host = getattr(settings, 'SNOW_HOST', None)
+        if host:
+            scheme = 'https' if getattr(settings, 'SNOW_USE_SSL', True) else 'http'
+            return '%s://%s/api/now' % (scheme, host)
+        return 'https://%s.service-now.com/api/now' % self.snow_instance
+
+    @staticmethod
+    def _get_timeout():
+        timeout = getattr(settings, 'SNOW_TIMEOUT', None) or 60
+        if isinstance(timeout, (tuple, list)):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
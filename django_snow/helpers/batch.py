@@ -0,0 +1,276 @@
+import base64
+import json
+import logging
+import uuid
+from collections import namedtuple
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import ChangeRequest
+from .exceptions import ChangeRequestException
+from .snow_request_handler import ChangeRequestHandler, ChangeRequestResult
+
+
+logger = logging.getLogger('django_snow')
+
+
+# An operation of a batch. `change_request` is `None` for creations, whose `arguments` are those of
+# `create_change_request`.
+BatchOperation = namedtuple('BatchOperation', ['operation', 'change_request', 'arguments'])
+
+
+class ChangeRequestBatch:
+    """
+    Sends many change request operations to SNow at once, through the Batch API.
+
+    The operations are queued with the methods of :class:`ChangeRequestHandler`, then sent by :meth:`execute`, up to
+    `batch_size` of them per HTTP request. The created change requests are saved with a single `bulk_create`, and the
+    updated ones with a single `bulk_update`. The operations fail or succeed independently::
+
+        batch = ChangeRequestBatch()
+        for change_request in change_requests:
+            batch.close_change_request(change_request)
+        errors = [result for result in batch.execute() if result.error is not None]
+    """
+
+    BATCH_PATH = '/api/now/v1/batch'
+    # pysnow's timeout, which `SNOW_TIMEOUT` overrides
+    TIMEOUT = 60
+
+    OPERATION_CREATE = 'create'
+    OPERATION_UPDATE = 'update'
+
+    def __init__(self, handler=None, batch_size=None):
+        """
+        :param handler: (optional) The handler making the requests to SNow
+        :type handler: :class:`ChangeRequestHandler`
+        :param batch_size: The maximum number of operations per request to SNow, defaults to `SNOW_BATCH_SIZE`
+        :type batch_size: int
+        """
+        self.handler = handler or ChangeRequestHandler()
+        self.batch_size = batch_size or getattr(settings, 'SNOW_BATCH_SIZE', 50)
+        self.operations = []
+
+    def create_change_request(self, title, description, assignment_group=None, payload=None):
+        """
+        Queue the creation of a change request with the given payload.
+        """
+        return self._queue(self.OPERATION_CREATE, None, {
+            'title': title,
+            'description': description,
+            'assignment_group': assignment_group,
+            'payload': payload,
+        })
+
+    def close_change_request(self, change_request):
+        """Queue the completion of the change request."""
+
+        return self._queue(self.OPERATION_UPDATE, change_request, {'state': ChangeRequest.TICKET_STATE_COMPLETE})
+
+    def close_change_request_with_error(self, change_request, payload):
+        """
+        Queue the completion with error of the change request.
+        """
+        payload = dict(payload, state=ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS)
+        return self._queue(self.OPERATION_UPDATE, change_request, payload)
+
+    def update_change_request(self, change_request, payload):
+        """
+        Queue the update of the change request with the data from the payload.
+        """
+        return self._queue(self.OPERATION_UPDATE, change_request, dict(payload))
+
+    def _queue(self, operation, change_request, arguments):
+        operation = BatchOperation(operation, change_request, arguments)
+        self.operations.append(operation)
+        return operation
+
+    def execute(self):
+        """Send the queued operations to SNow, and save their outcome.
+
+        The updates which would not change anything are not sent. The change requests closed by the operations get
+        their `closed_time` set.
+
+        :return: One :class:`ChangeRequestResult` per operation, in the order they were queued. The item of the
+            results is the :class:`BatchOperation`.
+        :rtype: list
+        """
+        operations, self.operations = self.operations, []
+        if not operations:
+            return []
+
+        handler = self.handler
+        creations = [operation for operation in operations if operation.operation == self.OPERATION_CREATE]
+        handler.prefetch_group_guids(
+            operation.arguments['assignment_group'] or handler.snow_assignment_group
+            for operation in creations if 'assignment_group' not in (operation.arguments['payload'] or {})
+        )
+
+        results = [None] * len(operations)
+        requests = []
+        for index, operation in enumerate(operations):
+            try:
+                request = self._build_request(index, operation)
+            except ChangeRequestException as e:
+                results[index] = ChangeRequestResult(operation, None, e)
+                continue
+            if request is None:
+                results[index] = ChangeRequestResult(operation, operation.change_request, None)
+            else:
+                requests.append(request)
+
+        records = {}
+        for offset in range(0, len(requests), self.batch_size):
+            records.update(self._send_batch(requests[offset:offset + self.batch_size]))
+
+        created, updated = [], []
+        for request in requests:
+            index = int(request['id'])
+            operation = operations[index]
+            record = records[request['id']]
+            if isinstance(record, ChangeRequestException):
+                results[index] = ChangeRequestResult(operation, None, record)
+                continue
+
+            if operation.change_request is None:
+                change_request = handler._build_change_request(record)
+                created.append(change_request)
+            else:
+                change_request = operation.change_request
+                previous_state = change_request.state
+                handler._apply_result(change_request, record)
+                if change_request.state != previous_state and change_request.state in ChangeRequest.CLOSED_STATES:
+                    change_request.closed_time = timezone.now()
+                updated.append(change_request)
+            results[index] = ChangeRequestResult(operation, change_request, None)
+
+        with transaction.atomic():
+            ChangeRequest.objects.bulk_create(created)
+            ChangeRequest.objects.bulk_update(updated, handler.UPDATE_FIELDS)
+        for change_request in created + updated:
+            change_request._snapshot()
+
+        return results
+
+    def _build_request(self, index, operation):
+        """
+        Build the request of the operation within a batch, or `None` if there is nothing to send.
+        """
+        handler = self.handler
+        url = '/api/now%s' % handler.CHANGE_REQUEST_TABLE_PATH
+        if operation.change_request is None:
+            arguments = operation.arguments
+            payload = handler._get_create_payload(
+                arguments['title'], arguments['description'], arguments['assignment_group'],
+                dict(arguments['payload'] or {})
+            )
+            # A sys_id generated locally lets a retried batch find the change requests a failed attempt created.
+            payload.setdefault('sys_id', uuid.uuid4().hex)
+            method = 'POST'
+        else:
+            payload = handler._get_changed_payload(operation.change_request, operation.arguments)
+            if not payload:
+                return None
+            url = '%s/%s' % (url, operation.change_request.sys_id.hex)
+            method = 'PATCH'
+
+        params = handler._get_response_params()
+        if params:
+            url = '%s?%s' % (url, urlencode(params))
+
+        return {
+            'id': str(index),
+            'method': method,
+            'url': url,
+            'headers': [
+                {'name': 'Content-Type', 'value': 'application/json'},
+                {'name': 'Accept', 'value': 'application/json'},
+            ],
+            'body': base64.b64encode(json.dumps(payload).encode('utf-8')).decode('ascii'),
+        }
+
+    def _send_batch(self, requests):
+        """
+        Send the requests in a single batch, returning the record, or the :class:`ChangeRequestException`, of each
+        of them by id.
+        """
+        from requests.exceptions import RequestException
+
+        handler = self.handler
+        client = handler._get_client()
+        body = {'batch_request_id': uuid.uuid4().hex, 'rest_requests': requests}
+        attempts = []
+
+        def send():
+            attempts.append(None)
+            response = client.session.post(client.base_url + self.BATCH_PATH, json=body, timeout=self.TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+
+        try:
+            result = handler._send('batch', send, body)
+        except ChangeRequestException as e:
+            # E.g. the circuit breaker is open. The operations of the other batches are still saved.
+            logger.error('Could not send the batch of change requests due to %s', e)
+            return {request['id']: e for request in requests}
+        except RequestException as e:
+            reason = e.response.text if e.response is not None else e
+            logger.error('Could not send the batch of change requests due to %s', reason)
+            error = ChangeRequestException('Could not send the batch of change requests due to %s' % reason)
+            return {request['id']: error for request in requests}
+
+        responses = {response['id']: response for response in result.get('serviced_requests', [])}
+        records = {}
+        for request in requests:
+            action = 'create' if request['method'] == 'POST' else 'update'
+            response = responses.get(request['id'])
+            if response is None:
+                records[request['id']] = ChangeRequestException('SNow did not service the %s request' % action)
+            else:
+                records[request['id']] = self._get_record(response, action)
+
+        if len(attempts) > 1:
+            self._recover_creations(requests, records)
+
+        return records
+
+    def _get_record(self, response, action):
+        body = json.loads(base64.b64decode(response.get('body') or '').decode('utf-8') or '{}')
+        if response['status_code'] >= 400:
+            error = body.get('error', {}).get('message') or response.get('status_text') or response['status_code']
+            logger.error('Could not %s change request due to %s', action, error)
+            return ChangeRequestException('Could not %s change request due to %s' % (action, error))
+
+        record = body.get('result', body)
+        try:
+            self.handler._check_result(record, action)
+        except ChangeRequestException as e:
+            return e
+        return record
+
+    def _recover_creations(self, requests, records):
+        """
+        Fetch the change requests which failed to be created by a retried batch, as a previous attempt of the batch
+        may have created them.
+        """
+        sys_ids = {}
+        for request in requests:
+            if request['method'] == 'POST' and isinstance(records[request['id']], ChangeRequestException):
+                sys_ids[json.loads(base64.b64decode(request['body']).decode('utf-8'))['sys_id']] = request['id']
+        if not sys_ids:
+            return
+
+        from requests.exceptions import RequestException
+
+        handler = self.handler
+        query = 'sys_idIN%s' % ','.join(sys_ids)
+        try:
+            existing = handler._get_records(query, handler.snow_response_fields, len(sys_ids), operation='batch')
+        except (ChangeRequestException, RequestException) as e:
+            logger.warning('Could not look up the change requests created by a retried batch due to %s', e)
+            return
+        for record in existing:
+            records[sys_ids[record['sys_id']]] = record
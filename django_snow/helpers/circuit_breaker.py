@@ -0,0 +1,180 @@
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .exceptions import CircuitOpenException
+
+
+logger = logging.getLogger('django_snow')
+
+_lock = threading.Lock()
+_circuit_breakers = {}
+
+
+class CircuitBreaker:
+    """
+    In-process circuit breaker, failing the requests fast while SNow is unavailable.
+
+    The circuit opens once `threshold` requests failed within a window of `window` seconds. The requests are then
+    refused for `cooldown` seconds, after which a single request is let through to probe SNow (the circuit is
+    half-open). The circuit closes if the probe succeeds, and opens again for `cooldown` seconds otherwise. A probe
+    whose outcome is not reported within `cooldown` seconds is abandoned, and another request probes SNow.
+    """
+
+    def __init__(self, threshold, cooldown=30, window=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.window = window
+        self._lock = threading.Lock()
+        self._window = None
+        self._failures = 0
+        self._opened = None
+        # When the pending probe is abandoned, if any
+        self._probe_deadline = None
+
+    def before_request(self):
+        """Let a request through, unless the circuit is open.
+
+        :return: Whether the request probes the half-open circuit, in which case its outcome must be reported
+        :rtype: bool
+        :raises CircuitOpenException: If the circuit is open
+        """
+        with self._lock:
+            if self._opened is None:
+                return False
+
+            now = time.time()
+            retry_after = self._opened + self.cooldown - now
+            if retry_after > 0:
+                raise CircuitOpenException(retry_after)
+            if self._probe_deadline is not None and self._probe_deadline > now:
+                raise CircuitOpenException(self._probe_deadline - now)
+            self._probe_deadline = now + self.cooldown
+            return True
+
+    def after_request(self, probe, failed):
+        """Report the outcome of a request let through.
+
+        :param probe: Whether the request probed the half-open circuit, as returned by :meth:`before_request`
+        :type probe: bool
+        :param failed: Whether the request failed because SNow is unavailable
+        :type failed: bool
+        """
+        if not probe and not failed:
+            return
+
+        with self._lock:
+            now = time.time()
+            if probe:
+                self._probe_deadline = None
+                self._opened = now if failed else None
+                self._failures = 0
+                if not failed:
+                    logger.info('Closing the SNow circuit breaker, as SNow is available again')
+                return
+
+            window = int(now // self.window)
+            if window != self._window:
+                self._window = window
+                self._failures = 0
+            self._failures += 1
+            if self._failures >= self.threshold and self._opened is None:
+                self._opened = now
+                logger.warning(
+                    'Opening the SNow circuit breaker for %d seconds, after %d failed requests',
+                    self.cooldown, self._failures
+                )
+
+
+class CacheCircuitBreaker:
+    """
+    Circuit breaker shared by all the processes using the same Django cache, behaving as :class:`CircuitBreaker`.
+
+    The failures are counted with an atomic `incr` of the cache, which must thus support atomic increments across
+    processes, like the memcached and redis backends do. A single process at a time probes the half-open circuit.
+    """
+
+    KEY_PREFIX = 'django_snow:circuit_breaker:'
+
+    def __init__(self, threshold, cooldown=30, window=60, cache_alias='default', name=''):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.window = window
+        self.cache_alias = cache_alias
+        self.name = name
+
+    def _get_key(self, suffix):
+        return '%s%s:%s' % (self.KEY_PREFIX, self.name, suffix)
+
+    def before_request(self):
+        cache = caches[self.cache_alias]
+        opened = cache.get(self._get_key('opened'))
+        if opened is None:
+            return False
+
+        retry_after = opened + self.cooldown - time.time()
+        if retry_after > 0:
+            raise CircuitOpenException(retry_after)
+        # The probe is abandoned if it is not reported within the cooldown, e.g. if its process died.
+        if not cache.add(self._get_key('probe'), 1, timeout=int(math.ceil(self.cooldown))):
+            raise CircuitOpenException(0)
+        return True
+
+    def after_request(self, probe, failed):
+        if not probe and not failed:
+            return
+
+        cache = caches[self.cache_alias]
+        if probe:
+            if failed:
+                cache.set(self._get_key('opened'), time.time(), timeout=None)
+                cache.delete(self._get_key('probe'))
+            else:
+                cache.delete_many([self._get_key('opened'), self._get_key('probe')])
+                logger.info('Closing the SNow circuit breaker, as SNow is available again')
+            return
+
+        key = self._get_key('failures:%d' % (time.time() // self.window))
+        cache.add(key, 0, timeout=int(math.ceil(self.window)) + 1)
+        try:
+            failures = cache.incr(key)
+        except ValueError:
+            # The window expired between add() and incr()
+            return
+
+        if failures >= self.threshold and cache.add(self._get_key('opened'), time.time(), timeout=None):
+            logger.warning(
+                'Opening the SNow circuit breaker for %d seconds, after %d failed requests', self.cooldown, failures
+            )
+
+
+def get_circuit_breaker(name):
+    """Get the process-wide circuit breaker of the requests to `name`, e.g. the SNow instance.
+
+    The circuit opens once `SNOW_CIRCUIT_BREAKER_THRESHOLD` requests failed within `SNOW_CIRCUIT_BREAKER_WINDOW`
+    seconds, and is probed again after `SNOW_CIRCUIT_BREAKER_COOLDOWN` seconds. If `SNOW_CIRCUIT_BREAKER_CACHE` names
+    one of the Django `CACHES`, the circuit is shared by all the processes using it. Returns `None` if there is no
+    circuit breaker.
+    """
+    threshold = getattr(settings, 'SNOW_CIRCUIT_BREAKER_THRESHOLD', None)
+    if not threshold:
+        return None
+
+    cooldown = getattr(settings, 'SNOW_CIRCUIT_BREAKER_COOLDOWN', 30)
+    window = getattr(settings, 'SNOW_CIRCUIT_BREAKER_WINDOW', 60)
+    cache_alias = getattr(settings, 'SNOW_CIRCUIT_BREAKER_CACHE', None)
+    key = (name, threshold, cooldown, window, cache_alias)
+    with _lock:
+        circuit_breaker = _circuit_breakers.get(key)
+        if circuit_breaker is None:
+            if cache_alias:
+                circuit_breaker = CacheCircuitBreaker(threshold, cooldown, window, cache_alias, name)
+            else:
+                circuit_breaker = CircuitBreaker(threshold, cooldown, window)
+            _circuit_breakers[key] = circuit_breaker
+
+    return circuit_breaker
@@ -0,0 +1,111 @@
+import os
+import threading
+
+import pysnow
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+
+_lock = threading.Lock()
+_clients = {}
+_pid = None
+# The status of the last response received by each thread, for the metrics
+_responses = threading.local()
+
+
+class SnowHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter applying `SNOW_TIMEOUT` to every request, whatever timeout pysnow passes along.
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_client(instance, user, password):
+    """Get the process-wide :class:`pysnow.Client` of the SNow instance and credentials.
+
+    The clients share their connections across the handlers of the process. The pool of connections is tuned with
+    the following settings:
+        * `SNOW_POOL_MAXSIZE` - The maximum number of connections kept open, defaults to `10`
+        * `SNOW_POOL_BLOCK` - Whether to wait for a connection to be free rather than open an extra one once the
+          pool is full, defaults to `False`
+        * `SNOW_POOL_KEEPALIVE` - Whether to keep the connections open between requests, defaults to `True`
+        * `SNOW_TIMEOUT` - The timeout of the requests in seconds, or a `(connect, read)` tuple. Defaults to
+          pysnow's.
+
+    The clients talk to `<instance>.service-now.com`, unless `SNOW_HOST` sets another host (and port), in which case
+    `SNOW_USE_SSL` tells whether to use HTTPS.
+
+    The clients are not shared with forked processes, as their connections would then be used concurrently.
+    """
+    global _pid
+
+    key = (instance, user, password, getattr(settings, 'SNOW_HOST', None), getattr(settings, 'SNOW_USE_SSL', True))
+    with _lock:
+        if _pid != os.getpid():
+            # Drop, but do not close, the connections inherited from the parent process.
+            _clients.clear()
+            _pid = os.getpid()
+
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = _build_client(instance, user, password)
+
+    return client
+
+
+def pop_status_code():
+    """
+    Get the HTTP status of the last response the current thread received from SNow, or `None` if it received none
+    since the last call.
+    """
+    status_code = getattr(_responses, 'status_code', None)
+    _responses.status_code = None
+    return status_code
+
+
+def _record_status_code(response, *args, **kwargs):
+    _responses.status_code = response.status_code
+
+
+def clear_clients():
+    """
+    Close the connections of all the clients of the process, and forget them.
+    """
+    with _lock:
+        clients = list(_clients.values()) if _pid == os.getpid() else []
+        _clients.clear()
+
+    for client in clients:
+        client.session.close()
+
+
+def _build_client(instance, user, password):
+    session = requests.Session()
+    session.auth = (user, password)
+    session.hooks['response'].append(_record_status_code)
+
+    adapter = SnowHTTPAdapter(
+        timeout=getattr(settings, 'SNOW_TIMEOUT', None),
+        pool_connections=1,
+        pool_maxsize=getattr(settings, 'SNOW_POOL_MAXSIZE', 10),
+        pool_block=getattr(settings, 'SNOW_POOL_BLOCK', False),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not getattr(settings, 'SNOW_POOL_KEEPALIVE', True):
+        session.headers['Connection'] = 'close'
+
+    host = getattr(settings, 'SNOW_HOST', None)
+    if host:
+        return pysnow.Client(host=host, use_ssl=getattr(settings, 'SNOW_USE_SSL', True), session=session)
+    return pysnow.Client(instance=instance, session=session)
@@ -0,0 +1,210 @@
+import atexit
+import logging
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db import connections
+
+from ..models import ChangeRequest
+from .exceptions import ChangeRequestException
+from .snow_request_handler import ChangeRequestHandler, ChangeRequestResult
+
+
+logger = logging.getLogger('django_snow')
+
+# The handlers, whose pending updates are sent when the process exits
+_handlers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_handlers():
+    for handler in list(_handlers):
+        try:
+            results = handler.flush()
+        except Exception:
+            logger.exception('Could not send the updates of the change requests')
+            continue
+        for result in results:
+            if result.error is not None:
+                logger.error('Dropping the updates %s of a change request due to %s', result.item, result.error)
+
+
+class _PendingUpdate:
+    """
+    The updates of a change request waiting to be sent, merged into a single payload.
+    """
+
+    def __init__(self, change_request, window):
+        self.change_request = change_request
+        self.payload = {}
+        self.queued = time.monotonic()
+        # The updates of a change request are never held longer than the window, whatever the later updates
+        self.deadline = self.queued + window
+
+
+class CoalescingChangeRequestHandler(ChangeRequestHandler):
+    """
+    SNow Change Request Handler merging the successive updates of a change request.
+
+    The updates of a change request are held for up to `window` seconds from the first of them, and those made
+    meanwhile are merged into a single update to SNow and a single save, the latest value of a key winning. Each
+    change request has its own deadline, so that the updates of one change request never delay those of another.
+    Closing a change request sends its pending updates straight away, along with the new state. The pending updates
+    of all the change requests can be sent at any time with :meth:`flush`, which using the handler as a context
+    manager does on exit::
+
+        with CoalescingChangeRequestHandler() as handler:
+            handler.update_change_request(change_request, {'description': 'Deploying'})
+            handler.update_change_request(change_request, {'description': 'Deployed'})
+            handler.close_change_request(change_request)
+
+    Until they are sent, the updates are neither applied to the change request nor saved. The updates sent after
+    the window expired, in a background thread, or when the process exits, which fail are logged and dropped.
+    """
+
+    def __init__(self, window=None):
+        """
+        :param window: The number of seconds the updates of a change request are held for, defaults to
+            `SNOW_COALESCE_WINDOW`. `0` sends them straight away.
+        :type window: float
+        """
+        super().__init__()
+        self.window = window if window is not None else getattr(settings, 'SNOW_COALESCE_WINDOW', 1.0)
+        self._lock = threading.Lock()
+        # Held while sending, so that the updates of a change request are sent in order
+        self._flush_lock = threading.RLock()
+        # The pending updates, by sys_id
+        self._pending = {}
+        self._timer = None
+        _handlers.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def update_change_request(self, change_request, payload):
+        """Queue the update of the change request with the data from the payload.
+
+        The update is sent straight away if it closes the change request, or once the window of the change request
+        expired.
+
+        :return: The updated record returned by SNow if the update was sent, `None` otherwise
+        :rtype: dict
+        """
+        if self.window <= 0:
+            return super().update_change_request(change_request, payload)
+
+        sys_id = change_request.sys_id
+        with self._lock:
+            pending = self._pending.get(sys_id)
+            if pending is None:
+                pending = self._pending[sys_id] = _PendingUpdate(change_request, self.window)
+            pending.change_request = change_request
+            pending.payload.update(payload)
+
+            due = pending.payload.get('state') in ChangeRequest.CLOSED_STATES
+            if not due:
+                self._schedule()
+
+        if not due:
+            return None
+
+        with self._flush_lock:
+            pending = self._pop(sys_id)
+            # Unless the updates were sent meanwhile by another thread
+            return self._send_pending(pending) if pending is not None else None
+
+    def close_change_requests(self, change_requests, with_errors=False, payload=None, max_workers=None):
+        """
+        Complete, with errors or not, many change requests, after sending their pending updates.
+        """
+        change_requests = list(change_requests)
+        for change_request in change_requests:
+            self._flush(change_request.sys_id)
+        return super().close_change_requests(
+            change_requests, with_errors, payload, max_workers
+        )
+
+    def flush(self):
+        """Send the pending updates of all the change requests.
+
+        :return: One :class:`ChangeRequestResult` per change request, whose item is the merged payload
+        :rtype: list
+        """
+        with self._flush_lock:
+            with self._lock:
+                sys_ids = list(self._pending)
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            return [result for result in map(self._flush, sys_ids) if result is not None]
+
+    def _flush(self, sys_id):
+        """
+        Send the pending updates of a change request, returning their :class:`ChangeRequestResult`, or `None` if
+        there were none.
+        """
+        with self._flush_lock:
+            pending = self._pop(sys_id)
+            if pending is None:
+                return None
+
+            try:
+                self._send_pending(pending)
+            except ChangeRequestException as e:
+                return ChangeRequestResult(pending.payload, None, e)
+            return ChangeRequestResult(pending.payload, pending.change_request, None)
+
+    def _pop(self, sys_id):
+        with self._lock:
+            return self._pending.pop(sys_id, None)
+
+    def _send_pending(self, pending):
+        """
+        Send the pending updates of a change request, returning the updated record. Must be called holding the flush
+        lock.
+        """
+        record = super().update_change_request(pending.change_request, pending.payload)
+        logger.debug(
+            'Sent the updates of the change request %s queued %.3f seconds ago',
+            pending.change_request, time.monotonic() - pending.queued
+        )
+        return record
+
+    def _schedule(self):
+        """
+        Start the timer sending the pending updates whose window expired, at the earliest of their deadlines, unless
+        it is already started. Must be called holding the lock.
+        """
+        if self._timer is not None or not self._pending:
+            return
+        # The deadlines follow the order the change requests were queued in
+        deadline = next(iter(self._pending.values())).deadline
+        self._timer = threading.Timer(max(0, deadline - time.monotonic()), self._flush_later)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_later(self):
+        try:
+            with self._flush_lock:
+                with self._lock:
+                    self._timer = None
+                    now = time.monotonic()
+                    sys_ids = [sys_id for sys_id, pending in self._pending.items() if pending.deadline <= now]
+                for sys_id in sys_ids:
+                    result = self._flush(sys_id)
+                    if result is not None and result.error is not None:
+                        logger.error(
+                            'Dropping the updates %s of a change request due to %s', result.item, result.error
+                        )
+        except Exception:
+            logger.exception('Could not send the updates of the change requests')
+        finally:
+            with self._lock:
+                self._schedule()
+            # The timer's thread has its own database connections
+            connections.close_all()
@@ -1,5 +1,19 @@
+import math
+
+
 class ChangeRequestException(Exception):
     """
     Errors occurred during Change Request CRUD operations
     """
     pass
+
+
+class CircuitOpenException(ChangeRequestException):
+    """
+    Raised instead of sending a request to SNow while the circuit breaker is open, i.e. while SNow is unavailable
+    """
+
+    def __init__(self, retry_after):
+        # The number of seconds after which SNow will be tried again
+        self.retry_after = retry_after
+        super().__init__('SNow is unavailable, not retrying it for %d seconds' % math.ceil(retry_after))
@@ -0,0 +1,145 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class GroupGuidCache:
+    """
+    Thread-safe cache of SNow Group Name - GUID mappings.
+
+    Entries expire after `SNOW_GROUP_GUID_CACHE_TTL` seconds (`None` disables the expiry), so that renamed groups
+    are eventually refreshed. By default the entries are kept in an in-process LRU holding at most
+    `SNOW_GROUP_GUID_CACHE_MAXSIZE` groups. If `SNOW_GROUP_GUID_CACHE` names one of the Django `CACHES`, the entries
+    are stored there instead, and are thus shared across processes and nodes.
+
+    Concurrent misses for the same group are collapsed into a single lookup.
+    """
+
+    KEY_PREFIX = 'django_snow:group_guid:'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+        self._entries = OrderedDict()
+        # The groups stored in the Django cache by this process, so that they can be cleared.
+        self._shared_group_names = set()
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'SNOW_GROUP_GUID_CACHE_TTL', 24 * 60 * 60)
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'SNOW_GROUP_GUID_CACHE_MAXSIZE', 1024)
+
+    @property
+    def backend(self):
+        """The Django cache the entries are stored in, or `None` for the in-process cache."""
+        alias = getattr(settings, 'SNOW_GROUP_GUID_CACHE', None)
+        return caches[alias] if alias else None
+
+    def get(self, group_name):
+        """
+        Get the cached GUID of the group, or `None` if it is not cached.
+        """
+        backend = self.backend
+        if backend is not None:
+            return backend.get(self._make_key(group_name))
+
+        with self._lock:
+            entry = self._entries.get(group_name)
+            if entry is None:
+                return None
+
+            guid, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[group_name]
+                return None
+
+            self._entries.move_to_end(group_name)
+            return guid
+
+    def get_many(self, group_names):
+        """
+        Get the cached GUIDs of the groups, as a dict of the cached groups' names to their GUIDs.
+        """
+        backend = self.backend
+        if backend is None:
+            guids = ((group_name, self.get(group_name)) for group_name in group_names)
+            return {group_name: guid for group_name, guid in guids if guid is not None}
+
+        keys = {self._make_key(group_name): group_name for group_name in group_names}
+        return {keys[key]: guid for key, guid in backend.get_many(list(keys)).items()}
+
+    def set(self, group_name, guid):
+        """
+        Cache the GUID of the group.
+        """
+        backend = self.backend
+        if backend is not None:
+            backend.set(self._make_key(group_name), guid, timeout=self.ttl)
+            with self._lock:
+                self._shared_group_names.add(group_name)
+            return
+
+        ttl = self.ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[group_name] = (guid, expires_at)
+            self._entries.move_to_end(group_name)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, group_name, loader):
+        """Get the GUID of the group, calling `loader` on a cache miss.
+
+        Only one thread of the process calls `loader` for a given group at a time. The other threads missing the
+        same group wait for it and use its result.
+
+        :param group_name: The name of the group
+        :type group_name: str
+        :param loader: A callable returning the GUID of the group from its name
+        :type loader: callable
+        """
+        guid = self.get(group_name)
+        if guid is not None:
+            return guid
+
+        with self._lock:
+            loading_lock = self._loading_locks.setdefault(group_name, threading.Lock())
+
+        with loading_lock:
+            try:
+                guid = self.get(group_name)
+                if guid is None:
+                    guid = loader(group_name)
+                    self.set(group_name, guid)
+            finally:
+                with self._lock:
+                    if self._loading_locks.get(group_name) is loading_lock:
+                        del self._loading_locks[group_name]
+
+        return guid
+
+    def clear(self):
+        """
+        Clear the cache.
+
+        When the entries are stored in a Django cache, only the groups cached through this process are removed.
+        """
+        with self._lock:
+            group_names = list(self._shared_group_names)
+            self._shared_group_names.clear()
+            self._entries.clear()
+
+        backend = self.backend
+        if backend is not None and group_names:
+            backend.delete_many([self._make_key(group_name) for group_name in group_names])
+
+    def _make_key(self, group_name):
+        # Group names may contain characters which are not valid in cache keys (e.g. spaces with memcached).
+        return self.KEY_PREFIX + hashlib.sha256(group_name.encode('utf-8')).hexdigest()
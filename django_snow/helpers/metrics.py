@@ -0,0 +1,164 @@
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+class NullMetrics:
+    """
+    The default metrics backend, discarding the metrics. It is the interface of the other backends.
+
+    The handlers skip measuring the payload sizes when the backend is not `enabled`, so that the metrics cost close to
+    nothing when disabled.
+    """
+
+    enabled = False
+
+    def observe_request(self, operation, status, duration, request_size=None, response_size=None):
+        """Record a round trip to SNow.
+
+        :param operation: The handler operation, e.g. `create`
+        :type operation: str
+        :param status: The HTTP status of the response, e.g. `201`, or the name of the exception raised if SNow did
+            not respond, e.g. `ConnectTimeout`
+        :type status: str
+        :param duration: The duration of the round trip, in seconds
+        :type duration: float
+        :param request_size: (optional) The size of the JSON payload sent, in bytes
+        :type request_size: int
+        :param response_size: (optional) The size of the JSON result received, in bytes
+        :type response_size: int
+        """
+
+    def observe_retry(self, operation):
+        """
+        Record a request to SNow about to be retried.
+        """
+
+    def observe_group_cache(self, hits, misses):
+        """
+        Record the lookups of assignment groups served, or not, by the GUID cache.
+        """
+
+
+class PrometheusMetrics(NullMetrics):
+    """
+    Metrics backend exporting the metrics with `prometheus_client`, which must be installed.
+    """
+
+    enabled = True
+
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+    def __init__(self, registry=None, namespace='django_snow'):
+        """
+        :param registry: (optional) The registry of the metrics, defaults to the global one
+        :type registry: :class:`prometheus_client.CollectorRegistry`
+        :param namespace: The prefix of the names of the metrics
+        :type namespace: str
+        """
+        import prometheus_client
+
+        registry = registry or prometheus_client.REGISTRY
+        self.request_duration = prometheus_client.Histogram(
+            'request_duration_seconds', 'Duration of the round trips to SNow',
+            ['operation', 'status'], namespace=namespace, registry=registry
+        )
+        self.request_size = prometheus_client.Histogram(
+            'request_size_bytes', 'Size of the JSON payloads sent to SNow',
+            ['operation'], namespace=namespace, registry=registry, buckets=self.SIZE_BUCKETS
+        )
+        self.response_size = prometheus_client.Histogram(
+            'response_size_bytes', 'Size of the JSON results received from SNow',
+            ['operation'], namespace=namespace, registry=registry, buckets=self.SIZE_BUCKETS
+        )
+        self.retries = prometheus_client.Counter(
+            'retries', 'Requests to SNow retried', ['operation'], namespace=namespace, registry=registry
+        )
+        self.group_cache = prometheus_client.Counter(
+            'group_cache_lookups', 'Lookups of the assignment group GUID cache', ['result'],
+            namespace=namespace, registry=registry
+        )
+
+    def observe_request(self, operation, status, duration, request_size=None, response_size=None):
+        self.request_duration.labels(operation, status).observe(duration)
+        if request_size is not None:
+            self.request_size.labels(operation).observe(request_size)
+        if response_size is not None:
+            self.response_size.labels(operation).observe(response_size)
+
+    def observe_retry(self, operation):
+        self.retries.labels(operation).inc()
+
+    def observe_group_cache(self, hits, misses):
+        if hits:
+            self.group_cache.labels('hit').inc(hits)
+        if misses:
+            self.group_cache.labels('miss').inc(misses)
+
+
+class StatsdMetrics(NullMetrics):
+    """
+    Metrics backend sending the metrics to StatsD, with the client of the `statsd` package unless given another one.
+    """
+
+    enabled = True
+
+    def __init__(self, client=None, host='localhost', port=8125, prefix='django_snow'):
+        """
+        :param client: (optional) The client to send the metrics with, e.g. a shared :class:`statsd.StatsClient`
+        :param host: The host of the StatsD server, if no client is given
+        :type host: str
+        :param port: The port of the StatsD server, if no client is given
+        :type port: int
+        :param prefix: The prefix of the names of the metrics, if no client is given
+        :type prefix: str
+        """
+        if client is None:
+            import statsd
+            client = statsd.StatsClient(host, port, prefix=prefix)
+        self.client = client
+
+    def observe_request(self, operation, status, duration, request_size=None, response_size=None):
+        self.client.timing('request.%s' % operation, duration * 1000)
+        self.client.incr('response.%s.%s' % (operation, status))
+        if request_size is not None:
+            self.client.timing('request_size.%s' % operation, request_size)
+        if response_size is not None:
+            self.client.timing('response_size.%s' % operation, response_size)
+
+    def observe_retry(self, operation):
+        self.client.incr('retry.%s' % operation)
+
+    def observe_group_cache(self, hits, misses):
+        if hits:
+            self.client.incr('group_cache.hit', hits)
+        if misses:
+            self.client.incr('group_cache.miss', misses)
+
+
+def get_metrics():
+    """Get the process-wide metrics backend.
+
+    The backend is the class at the dotted path `SNOW_METRICS`, instantiated with the keyword arguments of
+    `SNOW_METRICS_OPTIONS`. The metrics are discarded by default.
+    """
+    path = getattr(settings, 'SNOW_METRICS', None)
+    if not path:
+        return _null_metrics
+
+    options = getattr(settings, 'SNOW_METRICS_OPTIONS', None) or {}
+    key = (path, tuple(sorted(options.items())))
+    with _lock:
+        metrics = _metrics.get(key)
+        if metrics is None:
+            metrics = _metrics[key] = import_string(path)(**options)
+
+    return metrics
+
+
+_null_metrics = NullMetrics()
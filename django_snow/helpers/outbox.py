@@ -0,0 +1,333 @@
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from ..models import ChangeRequest, ChangeRequestOperation
+from .exceptions import ChangeRequestException, CircuitOpenException
+from .snow_request_handler import ChangeRequestHandler, ChangeRequestResult
+
+
+logger = logging.getLogger('django_snow')
+
+
+class OutboxChangeRequestHandler(ChangeRequestHandler):
+    """
+    SNow Change Request Handler queuing the operations instead of sending them to SNow straight away.
+
+    The operations are saved as :class:`ChangeRequestOperation` rows, in the caller's transaction if any, and are
+    sent to SNow later on by the `snow_outbox` management command (see :class:`OutboxProcessor`). The created change
+    requests are returned straight away, in the `TICKET_STATE_PENDING` state, with a sys_id generated locally which
+    is used for creating them in SNow.
+    """
+
+    def create_change_request(self, title, description, assignment_group=None, payload=None):
+        """
+        Queue the creation of a change request with the given payload.
+        """
+        payload = self._prepare_create_payload(title, description, payload)
+        assignment_group = assignment_group or self.snow_assignment_group
+
+        # The group is looked up when the operation is processed, unless it is already cached. Until then, the change
+        # request is saved with a nil GUID.
+        assignment_group_guid = payload.get('assignment_group') or self.group_guid_cache.get(assignment_group)
+
+        change_request = ChangeRequest(
+            sys_id=uuid.uuid4(),
+            number='',
+            title=title,
+            description=description,
+            assignment_group_guid=assignment_group_guid or uuid.UUID(int=0),
+            state=ChangeRequest.TICKET_STATE_PENDING
+        )
+
+        with transaction.atomic():
+            change_request.save(force_insert=True)
+            self._queue(change_request, ChangeRequestOperation.OPERATION_CREATE, {
+                'payload': payload,
+                'assignment_group': assignment_group,
+            })
+
+        return change_request
+
+    def close_change_request(self, change_request):
+        """Queue the completion of the change request."""
+
+        return self._queue(change_request, ChangeRequestOperation.OPERATION_CLOSE, {})
+
+    def close_change_request_with_error(self, change_request, payload):
+        """
+        Queue the completion with error of the change request.
+        """
+        return self._queue(change_request, ChangeRequestOperation.OPERATION_CLOSE_WITH_ERROR, {'payload': payload})
+
+    def close_change_requests(self, change_requests, with_errors=False, payload=None, max_workers=None):
+        """
+        Queue the completion, with errors or not, of many change requests. The payload, if any, is applied first.
+        """
+        results = []
+        with transaction.atomic():
+            for change_request in change_requests:
+                if with_errors:
+                    self.close_change_request_with_error(change_request, dict(payload or {}))
+                else:
+                    if payload:
+                        self.update_change_request(change_request, dict(payload))
+                    self.close_change_request(change_request)
+                results.append(ChangeRequestResult(change_request, change_request, None))
+
+        return results
+
+    def update_change_request(self, change_request, payload):
+        """
+        Queue the update of the change request with the data from the payload.
+        """
+        return self._queue(change_request, ChangeRequestOperation.OPERATION_UPDATE, {'payload': payload})
+
+    @staticmethod
+    def _queue(change_request, operation, arguments):
+        return ChangeRequestOperation.objects.create(
+            change_request=change_request,
+            operation=operation,
+            payload=json.dumps(arguments)
+        )
+
+
+class OutboxProcessor:
+    """
+    Sends the queued :class:`ChangeRequestOperation` to SNow.
+
+    The operations are claimed in batches. The operations of different change requests are sent concurrently, while
+    those of a given change request are sent one after the other, in the order they were queued. Only the requests
+    to SNow are made by the worker threads; the database is updated in bulk by the calling thread.
+
+    The failed operations are attempted again after an exponential backoff, so that the queue rides out the outages
+    of SNow rather than using up the attempts of its operations. The operations queued after them for the same change
+    request wait meanwhile. The operations claimed more than `lease_timeout` seconds ago, by a worker which died, are
+    claimed again, and count as attempted.
+    """
+
+    def __init__(self, handler=None, batch_size=100, max_workers=None, max_attempts=5, backoff=30, max_backoff=3600,
+                 lease_timeout=300):
+        """
+        :param handler: (optional) The handler sending the operations to SNow
+        :type handler: :class:`ChangeRequestHandler`
+        :param batch_size: The maximum number of operations claimed at once
+        :type batch_size: int
+        :param max_workers: The maximum number of concurrent requests to SNow, defaults to `SNOW_BULK_MAX_WORKERS`
+        :type max_workers: int
+        :param max_attempts: The number of attempts after which a failing operation is given up
+        :type max_attempts: int
+        :param backoff: The number of seconds after which an operation is attempted again after its first failure,
+            doubled by each further failure
+        :type backoff: float
+        :param max_backoff: The maximum number of seconds between two attempts of an operation
+        :type max_backoff: float
+        :param lease_timeout: The number of seconds after which the claim of an operation expires, which must be
+            longer than the processing of a batch
+        :type lease_timeout: float
+        """
+        self.handler = handler or ChangeRequestHandler()
+        self.batch_size = batch_size
+        self.max_workers = max_workers or self.handler.snow_bulk_max_workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease_timeout = lease_timeout
+
+    def process_batch(self):
+        """
+        Claim a batch of pending operations and send them to SNow. Returns the number of operations claimed.
+        """
+        operations = self.claim()
+        if not operations:
+            return 0
+
+        groups = OrderedDict()
+        for operation in operations:
+            groups.setdefault(operation.change_request_id, []).append(operation)
+
+        # Prefetch the groups of the change requests to be created. Failing to do so must not leave the operations
+        # claimed, and the creations look their group up again anyway.
+        try:
+            self.handler.prefetch_group_guids(
+                json.loads(operation.payload).get('assignment_group')
+                for operation in operations if operation.operation == ChangeRequestOperation.OPERATION_CREATE
+            )
+        except Exception as e:
+            logger.warning('Could not prefetch the SNow groups due to %s', e)
+
+        max_workers = min(self.max_workers, len(groups))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = list(executor.map(self._send_group, groups.values()))
+
+        self._save([outcome for group_outcomes in outcomes for outcome in group_outcomes])
+
+        return len(operations)
+
+    def claim(self):
+        """
+        Claim a batch of pending operations, which are not processed concurrently by other processes. The operations
+        of the change requests with an operation being processed, or backed off, are left pending.
+        """
+        now = timezone.now()
+        # The claims which were not saved within the lease, or which predate the leases
+        expired = ChangeRequestOperation.objects.filter(status=ChangeRequestOperation.STATUS_PROCESSING).filter(
+            Q(claimed_time__lt=now - timedelta(seconds=self.lease_timeout)) | Q(claimed_time__isnull=True)
+        )
+        reclaimed = expired.update(status=ChangeRequestOperation.STATUS_PENDING, attempts=F('attempts') + 1)
+        if reclaimed:
+            logger.warning('Claiming again %d operations whose claim expired', reclaimed)
+
+        blocking = ChangeRequestOperation.objects.filter(change_request=OuterRef('change_request')).filter(
+            Q(status=ChangeRequestOperation.STATUS_PROCESSING)
+            | Q(status=ChangeRequestOperation.STATUS_PENDING, next_attempt_time__gt=now)
+        )
+        queryset = ChangeRequestOperation.objects.annotate(
+            change_request_blocked=Exists(blocking)
+        ).filter(
+            status=ChangeRequestOperation.STATUS_PENDING, change_request_blocked=False
+        ).select_related('change_request').order_by('pk')
+
+        with transaction.atomic():
+            if connection.features.has_select_for_update_skip_locked:
+                # The change requests are locked as well, so that no other process claims the later operations of a
+                # change request whose earlier operations are being claimed, and are not marked processing yet.
+                of = ('self', 'change_request') if connection.features.has_select_for_update_of else ()
+                queryset = queryset.select_for_update(skip_locked=True, of=of)
+            operations = list(queryset[:self.batch_size])
+            ChangeRequestOperation.objects.filter(
+                pk__in=[operation.pk for operation in operations]
+            ).update(status=ChangeRequestOperation.STATUS_PROCESSING, claimed_time=now)
+
+        return operations
+
+    def _send_group(self, operations):
+        """
+        Send the operations of a change request to SNow, stopping at the first failure.
+        Returns the `(operation, result, error)` outcome of each operation, `None` for those not sent.
+        """
+        outcomes = []
+        for index, operation in enumerate(operations):
+            try:
+                result = self._send(operation)
+            except Exception as e:
+                # Whatever the error, the operation must not be left claimed.
+                if not isinstance(e, ChangeRequestException):
+                    logger.exception('Could not send %s to SNow', operation)
+                outcomes.append((operation, None, e))
+                outcomes.extend((skipped, None, None) for skipped in operations[index + 1:])
+                break
+
+            outcomes.append((operation, result, None))
+            if operation.operation == ChangeRequestOperation.OPERATION_CREATE:
+                # In case the instance did not let the sys_id be set on creation
+                for later in operations[index + 1:]:
+                    later.change_request.sys_id = uuid.UUID(str(result['sys_id']))
+
+        return outcomes
+
+    def _send(self, operation):
+        arguments = json.loads(operation.payload)
+        payload = arguments.get('payload') or {}
+        change_request = operation.change_request
+
+        if operation.operation == ChangeRequestOperation.OPERATION_CREATE:
+            if 'assignment_group' not in payload:
+                payload['assignment_group'] = self.handler.get_snow_group_guid(arguments['assignment_group'])
+            payload['sys_id'] = change_request.sys_id.hex
+            if operation.attempts:
+                # A previous attempt may have created the change request anyway, e.g. on a timeout
+                existing = self.handler._get_records(
+                    'sys_id=%s' % change_request.sys_id.hex, self.handler.snow_response_fields, 1, operation='create'
+                )
+                if existing:
+                    return existing[0]
+            return self.handler._create_remote(payload, sys_id=change_request.sys_id.hex)
+
+        if operation.operation == ChangeRequestOperation.OPERATION_CLOSE:
+            payload['state'] = ChangeRequest.TICKET_STATE_COMPLETE
+        elif operation.operation == ChangeRequestOperation.OPERATION_CLOSE_WITH_ERROR:
+            payload['state'] = ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS
+
+        return self.handler._update_remote(change_request, payload)
+
+    def _save(self, outcomes):
+        now = timezone.now()
+        # The up to date change requests, by their sys_id when queued
+        change_requests = OrderedDict()
+        done, skipped = [], []
+        # The operations refused while SNow is unavailable, by when SNow is tried again
+        refused = {}
+
+        with transaction.atomic():
+            for operation, result, error in outcomes:
+                if result is not None:
+                    change_request = change_requests.get(operation.change_request_id, operation.change_request)
+                    change_requests[operation.change_request_id] = self._apply(operation, change_request, result, now)
+                    done.append(operation.pk)
+                elif isinstance(error, CircuitOpenException):
+                    # Refused while SNow is unavailable, which does not count as an attempt
+                    next_attempt_time = now + timedelta(seconds=error.retry_after)
+                    refused.setdefault(next_attempt_time, []).append(operation.pk)
+                elif error is not None:
+                    self._fail(operation, error, now)
+                else:
+                    # Not sent, as a previous operation of the change request failed
+                    skipped.append(operation.pk)
+
+            ChangeRequest.objects.bulk_update(
+                list(change_requests.values()),
+                ['number', 'title', 'description', 'assignment_group_guid', 'state', 'closed_time', 'synced_time']
+            )
+            ChangeRequestOperation.objects.filter(pk__in=done).update(
+                status=ChangeRequestOperation.STATUS_DONE, processed_time=now, error=''
+            )
+            ChangeRequestOperation.objects.filter(pk__in=skipped).update(
+                status=ChangeRequestOperation.STATUS_PENDING
+            )
+            for next_attempt_time, pks in refused.items():
+                ChangeRequestOperation.objects.filter(pk__in=pks).update(
+                    status=ChangeRequestOperation.STATUS_PENDING, next_attempt_time=next_attempt_time
+                )
+
+    def _apply(self, operation, change_request, result, now):
+        if operation.operation == ChangeRequestOperation.OPERATION_CREATE:
+            created = self.handler._build_change_request(result)
+            if created.sys_id != operation.change_request_id:
+                # The instance did not let the sys_id be set on creation, so the change request is moved to the
+                # sys_id it was given.
+                created.created_time = change_request.created_time
+                created.save(force_insert=True)
+                ChangeRequestOperation.objects.filter(
+                    change_request_id=operation.change_request_id
+                ).update(change_request=created)
+                ChangeRequest.objects.filter(pk=operation.change_request_id).delete()
+                return created
+            change_request.number = created.number
+
+        self.handler._apply_result(change_request, result)
+        if operation.operation in (
+            ChangeRequestOperation.OPERATION_CLOSE, ChangeRequestOperation.OPERATION_CLOSE_WITH_ERROR
+        ):
+            change_request.closed_time = now
+
+        return change_request
+
+    def _fail(self, operation, error, now):
+        operation.attempts += 1
+        operation.error = str(error)
+        if operation.attempts >= self.max_attempts:
+            operation.status = ChangeRequestOperation.STATUS_FAILED
+            logger.error('Giving up on %s after %d attempts: %s', operation, operation.attempts, error)
+        else:
+            operation.status = ChangeRequestOperation.STATUS_PENDING
+            delay = min(self.max_backoff, self.backoff * 2 ** (operation.attempts - 1))
+            operation.next_attempt_time = now + timedelta(seconds=delay)
+        operation.save(update_fields=['attempts', 'error', 'status', 'next_attempt_time'])
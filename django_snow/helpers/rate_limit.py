@@ -0,0 +1,110 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+_lock = threading.Lock()
+_rate_limiters = {}
+
+
+class TokenBucket:
+    """
+    In-process token bucket, letting through `rate` requests per second on average and bursts of up to `burst`
+    requests.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(int(rate), 1)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        """
+        Take a token from the bucket, waiting for one to be available if needed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens are reserved even when the bucket is empty, so the waiting callers are served in order.
+            self._tokens -= 1
+            wait = -self._tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class CacheFixedWindowLimiter:
+    """
+    Fixed window rate limiter shared by all the processes using the same Django cache.
+
+    Time is divided in windows of `burst / rate` seconds, each letting through `burst` requests, which are counted
+    with an atomic `incr` of the cache. The cache backend must thus support atomic increments across processes, like
+    the memcached and redis backends do.
+
+    Unlike :class:`TokenBucket`, the windows do not spread the requests: up to `2 * burst` requests can go through
+    within `burst / rate` seconds, at the end of a window then the start of the next one. The average rate stays
+    bounded by `rate` over longer periods.
+    """
+
+    KEY_PREFIX = 'django_snow:rate_limit:'
+
+    def __init__(self, rate, burst=None, cache_alias='default', name=''):
+        self.rate = float(rate)
+        self.burst = burst or max(int(rate), 1)
+        self.window = self.burst / self.rate
+        self.cache_alias = cache_alias
+        self.name = name
+
+    def acquire(self):
+        """
+        Count a request in the current window, waiting for the next window if the current one is full.
+        """
+        cache = caches[self.cache_alias]
+        while True:
+            now = time.time()
+            window = int(now // self.window)
+            key = '%s%s:%d' % (self.KEY_PREFIX, self.name, window)
+
+            cache.add(key, 0, timeout=int(math.ceil(self.window)) + 1)
+            try:
+                count = cache.incr(key)
+            except ValueError:
+                # The window expired between add() and incr()
+                continue
+
+            if count <= self.burst:
+                return
+            time.sleep((window + 1) * self.window - now)
+
+
+def get_rate_limiter(name):
+    """Get the process-wide rate limiter of the requests made on behalf of `name`, e.g. the SNow API user.
+
+    The requests are limited to `SNOW_RATE_LIMIT` per second, in bursts of up to `SNOW_RATE_LIMIT_BURST` requests.
+    If `SNOW_RATE_LIMIT_CACHE` names one of the Django `CACHES`, the limit is shared by all the processes using it,
+    with bursts of up to twice `SNOW_RATE_LIMIT_BURST` requests (see :class:`CacheFixedWindowLimiter`).
+    Returns `None` if the requests are not rate limited.
+    """
+    rate = getattr(settings, 'SNOW_RATE_LIMIT', None)
+    if not rate:
+        return None
+
+    burst = getattr(settings, 'SNOW_RATE_LIMIT_BURST', None)
+    cache_alias = getattr(settings, 'SNOW_RATE_LIMIT_CACHE', None)
+    key = (name, rate, burst, cache_alias)
+    with _lock:
+        rate_limiter = _rate_limiters.get(key)
+        if rate_limiter is None:
+            if cache_alias:
+                rate_limiter = CacheFixedWindowLimiter(rate, burst, cache_alias, name)
+            else:
+                rate_limiter = TokenBucket(rate, burst)
+            _rate_limiters[key] = rate_limiter
+
+    return rate_limiter
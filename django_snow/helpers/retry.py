@@ -0,0 +1,135 @@
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+
+class RetryPolicy:
+    """
+    Policy for retrying the requests to SNow which failed for a transient reason.
+
+    The requests are retried when SNow rate-limits them or is temporarily unavailable (see `RETRY_STATUSES`), and on
+    connection errors and timeouts, whether they are made with requests or, by :meth:`acall`, with httpx. The delay
+    before each retry grows exponentially with the number of attempts, with full jitter, unless SNow tells how long
+    to wait with a `Retry-After` header. The delays never exceed `max_backoff` seconds.
+    """
+
+    RETRY_STATUSES = (429, 502, 503, 504)
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30, statuses=RETRY_STATUSES):
+        """
+        :param max_attempts: The maximum number of attempts of a request, `1` disables the retries
+        :type max_attempts: int
+        :param backoff: The base delay before a retry, in seconds. It doubles with every attempt.
+        :type backoff: float
+        :param max_backoff: The maximum delay before a retry, in seconds
+        :type max_backoff: float
+        :param statuses: The HTTP statuses of the responses to retry
+        :type statuses: iterable of int
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_attempts=getattr(settings, 'SNOW_RETRY_MAX_ATTEMPTS', 3),
+            backoff=getattr(settings, 'SNOW_RETRY_BACKOFF', 0.5),
+            max_backoff=getattr(settings, 'SNOW_RETRY_MAX_BACKOFF', 30),
+            statuses=getattr(settings, 'SNOW_RETRY_STATUSES', cls.RETRY_STATUSES),
+        )
+
+    def is_retryable(self, exception):
+        from requests.exceptions import ConnectionError, HTTPError, Timeout
+
+        if isinstance(exception, (ConnectionError, Timeout)):
+            return True
+        if isinstance(exception, HTTPError) and exception.response is not None:
+            return exception.response.status_code in self.statuses
+
+        # httpx is only installed with the async extra, and can only have raised the exception if it is imported
+        httpx = sys.modules.get('httpx')
+        if httpx is not None:
+            if isinstance(exception, (httpx.NetworkError, httpx.TimeoutException)):
+                return True
+            if isinstance(exception, httpx.HTTPStatusError):
+                return exception.response.status_code in self.statuses
+        return False
+
+    def get_delay(self, attempt, exception=None):
+        """
+        Get the number of seconds to wait before the given (failed) attempt is retried.
+        """
+        retry_after = self._get_retry_after(exception)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+
+        return random.uniform(0, min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+
+    def call(self, request, before_retry=None):
+        """Call `request` until it succeeds, fails for a reason which is not transient or runs out of attempts.
+
+        :param request: A callable making the request
+        :type request: callable
+        :param before_retry: (optional) A callable called with the number of the failed attempt, the exception it
+            raised and the delay before the next attempt, before waiting for it.
+        :type before_retry: callable
+        """
+        attempt = 1
+        while True:
+            try:
+                return request()
+            except Exception as e:
+                if attempt >= self.max_attempts or not self.is_retryable(e):
+                    raise
+
+                delay = self.get_delay(attempt, e)
+                if before_retry is not None:
+                    before_retry(attempt, e, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    async def acall(self, request, before_retry=None):
+        """
+        Await `request()` until it succeeds, fails for a reason which is not transient or runs out of attempts. See
+        :meth:`call`.
+        """
+        attempt = 1
+        while True:
+            try:
+                return await request()
+            except Exception as e:
+                if attempt >= self.max_attempts or not self.is_retryable(e):
+                    raise
+
+                delay = self.get_delay(attempt, e)
+                if before_retry is not None:
+                    before_retry(attempt, e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    @staticmethod
+    def _get_retry_after(exception):
+        response = getattr(exception, 'response', None)
+        value = response.headers.get('Retry-After') if response is not None else None
+        if not value:
+            return None
+
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0)
@@ -1,78 +1,467 @@
+import json
 import logging
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
 
-import pysnow
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from django.utils import timezone
-from requests.exceptions import HTTPError
 
 from ..models import ChangeRequest
+from .circuit_breaker import get_circuit_breaker
 from .exceptions import ChangeRequestException
+from .group_cache import GroupGuidCache
+from .metrics import get_metrics
+from .rate_limit import get_rate_limiter
+from .retry import RetryPolicy
 
 
 logger = logging.getLogger('django_snow')
 
 
-class ChangeRequestHandler:
+# The outcome of one item of a bulk operation. Exactly one of ``change_request`` and ``error`` is set.
+ChangeRequestResult = namedtuple('ChangeRequestResult', ['item', 'change_request', 'error'])
+
+
+class BaseChangeRequestHandler:
     """
-    SNow Change Request Handler.
+    The parts of the SNow Change Request Handlers which do not depend on how SNow is talked to.
     """
 
-    group_guid_dict = {}
+    # Shared by all the handlers of the process
+    group_guid_cache = GroupGuidCache()
 
     # Service Now table REST endpoints
     CHANGE_REQUEST_TABLE_PATH = '/table/change_request'
     USER_GROUP_TABLE_PATH = '/table/sys_user_group'
 
+    # The maximum number of groups, or change requests, looked up by a single query, keeping its URL reasonably short
+    GROUP_PREFETCH_CHUNK_SIZE = 100
+    LOOKUP_CHUNK_SIZE = 100
+
+    # The fields of the change requests read by the handlers, always requested from SNow
+    RESPONSE_FIELDS = ('sys_id', 'number', 'short_description', 'description', 'assignment_group', 'state')
+
+    # The fields of the ChangeRequest model set from the records returned by SNow on update
+    UPDATE_FIELDS = ['title', 'description', 'assignment_group_guid', 'state', 'closed_time', 'synced_time']
+
+    # The change request fields of the payloads sent to SNow which are mirrored by the ChangeRequest model
+    PAYLOAD_FIELDS = {
+        'short_description': 'title',
+        'description': 'description',
+        'assignment_group': 'assignment_group_guid',
+        'state': 'state',
+    }
+
     def __init__(self):
         self._client = None
+        self._round_trips_lock = threading.Lock()
+        # The number of HTTP round trips made to SNow, and of retried requests, per handler operation.
+        self.round_trips = Counter()
+        self.retries = Counter()
+        self.retry_policy = RetryPolicy.from_settings()
         self.snow_instance = settings.SNOW_INSTANCE
         self.snow_api_user = settings.SNOW_API_USER
         self.snow_api_pass = settings.SNOW_API_PASS
         self.snow_assignment_group = getattr(settings, 'SNOW_ASSIGNMENT_GROUP', None)
         self.snow_default_cr_type = getattr(settings, 'SNOW_DEFAULT_CHANGE_TYPE', 'standard')
+        self.snow_bulk_max_workers = getattr(settings, 'SNOW_BULK_MAX_WORKERS', 8)
+        self.rate_limiter = get_rate_limiter(self.snow_api_user)
+        self.circuit_breaker = get_circuit_breaker(self.snow_instance)
+        self.snow_response_fields = self._get_response_fields()
+        self.snow_exclude_reference_link = getattr(settings, 'SNOW_EXCLUDE_REFERENCE_LINK', True)
+        self.snow_change_request_max_age = getattr(settings, 'SNOW_CHANGE_REQUEST_MAX_AGE', 60)
+        self.metrics = get_metrics()
+
+    def _get_response_fields(self):
+        """
+        Get the fields of the change requests to be returned by SNow, or `None` for all of them.
+        """
+        fields = getattr(settings, 'SNOW_RESPONSE_FIELDS', self.RESPONSE_FIELDS)
+        if fields is None:
+            return None
+        return list(self.RESPONSE_FIELDS) + [field for field in fields if field not in self.RESPONSE_FIELDS]
 
-    def create_change_request(self, title, description, assignment_group=None, payload=None):
+    def _get_response_params(self):
         """
-        Create a change request with the given payload.
+        Get the query parameters projecting the change requests returned by SNow on creation and update.
         """
-        client = self._get_client()
-        change_requests = client.resource(api_path=self.CHANGE_REQUEST_TABLE_PATH)
+        params = {}
+        if self.snow_response_fields is not None:
+            params['sysparm_fields'] = ','.join(self.snow_response_fields)
+        if self.snow_exclude_reference_link:
+            params['sysparm_exclude_reference_link'] = 'true'
+        return params
+
+    def _count_round_trip(self, operation):
+        with self._round_trips_lock:
+            self.round_trips[operation] += 1
+
+    def _before_request(self, operation):
+        """
+        Account for a round trip to SNow about to be made, waiting for the rate limiter to let it through.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        self._count_round_trip(operation)
+
+    def _before_circuit_breaker(self):
+        """
+        Let a request through the circuit breaker, raising :class:`CircuitOpenException` if it is open. Returns
+        whether the request probes the half-open circuit.
+        """
+        if self.circuit_breaker is None:
+            return False
+        return self.circuit_breaker.before_request()
+
+    def _after_circuit_breaker(self, probe, exception=None):
+        """
+        Report the outcome of a request let through by the circuit breaker.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.after_request(probe, exception is not None and self._is_outage(exception))
+
+    @staticmethod
+    def _is_outage(exception):
+        """
+        Whether the request failed because SNow is unavailable: a server error, a connection error or a timeout.
+        """
+        response = getattr(exception, 'response', None)
+        status = getattr(response, 'status_code', None)
+        if status is not None:
+            return status >= 500
+        # The connection errors and timeouts of requests are OSErrors
+        return isinstance(exception, OSError)
+
+    def _before_retry(self, operation, attempt, exception, delay):
+        with self._round_trips_lock:
+            self.retries[operation] += 1
+        self.metrics.observe_retry(operation)
+        logger.warning(
+            'Retrying the SNow %s request in %.2f seconds, as attempt %d failed due to %s',
+            operation, delay, attempt, exception
+        )
+
+    def _observe_request(self, operation, status, start, payload=None, result=None):
+        """
+        Record a round trip to SNow started at `start` (see :func:`time.perf_counter`) with the metrics backend.
+        """
+        duration = time.perf_counter() - start
+        self.metrics.observe_request(operation, status, duration, self._get_size(payload), self._get_size(result))
+
+    @staticmethod
+    def _get_size(value):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return len(value.encode('utf-8'))
+        return len(json.dumps(value, default=str))
+
+    @staticmethod
+    def _get_status(exception=None, status_code=None):
+        """
+        Get the status of a round trip for the metrics: the HTTP status of its response if SNow responded, the name
+        of the exception raised otherwise, e.g. by a connection error or a timeout.
+
+        :param status_code: (optional) The HTTP status of the last response received, if known
+        """
+        response = getattr(exception, 'response', None)
+        if response is not None and getattr(response, 'status_code', None):
+            return str(response.status_code)
+        if exception is not None and (status_code is None or isinstance(exception, OSError)):
+            # The transport errors of requests are OSErrors, while the errors raised while parsing the response are not
+            return type(exception).__name__
+        return str(status_code) if status_code is not None else 'ok'
+
+    def _add_sys_id(self, payload):
+        """
+        Give the payload of a change request to be created a sys_id generated locally, so that the change request can
+        be looked up by it if the request has to be retried. Returns the sys_id, or `None` if the creation will not be
+        retried or the payload already has a sys_id, which is then not trusted to be unique.
+        """
+        if 'sys_id' in payload or self.retry_policy.max_attempts <= 1:
+            return None
+        payload['sys_id'] = uuid.uuid4().hex
+        return payload['sys_id']
+
+    def _prepare_create_payload(self, title, description, payload=None):
         payload = payload or {}
         payload['short_description'] = title
         payload['description'] = description
 
         if 'type' not in payload:
             payload['type'] = self.snow_default_cr_type
-        if 'assignment_group' not in payload:
-            payload['assignment_group'] = self.get_snow_group_guid(assignment_group or self.snow_assignment_group)
 
-        try:
-            result = change_requests.create(payload=payload)
-        except HTTPError as e:
-            logger.error('Could not create change request due to %s', e.response.text)
-            raise ChangeRequestException('Could not create change request due to %s.' % e.response.text)
+        return payload
 
+    def _get_changed_payload(self, change_request, payload):
+        """
+        Get the payload of an update, without the values the change request already has. The fields which are not
+        mirrored by the model are always sent.
+        """
+        changed = {}
+        for key, value in payload.items():
+            field_name = self.PAYLOAD_FIELDS.get(key)
+            if field_name is not None:
+                field = ChangeRequest._meta.get_field(field_name)
+                try:
+                    if field.to_python(value) == field.to_python(getattr(change_request, field_name)):
+                        continue
+                except ValidationError:
+                    pass
+            changed[key] = value
+
+        return changed
+
+    @staticmethod
+    def _save_changes(change_request):
+        """
+        Save the fields of the change request which changed, if it is known which did.
+        """
+        dirty_fields = change_request.get_dirty_fields()
+        if dirty_fields is None:
+            change_request.save()
+        elif dirty_fields:
+            change_request.save(update_fields=dirty_fields)
+
+    @staticmethod
+    def _check_result(result, action):
         # This piece of code is for legacy SNow instances. (probably Geneva and before it)
         if 'error' in result:
-            logger.error('Could not create change request due to %s', result['error'])
-            raise ChangeRequestException('Could not create change request due to %s' % result['error'])
-
-        change_request = ChangeRequest.objects.create(
-            sys_id=result['sys_id'],
+            logger.error('Could not %s change request due to %s', action, result['error'])
+            raise ChangeRequestException('Could not %s change request due to %s' % (action, result['error']))
+
+    @classmethod
+    def _build_change_request(cls, result):
+        return ChangeRequest(
+            # SNow returns the sys_id as a string, while the rest of the handler relies on a UUID
+            sys_id=uuid.UUID(str(result['sys_id'])),
             number=result['number'],
             title=result['short_description'],
             description=result['description'],
-            assignment_group_guid=result['assignment_group']['value'],
-            state=result['state']
+            assignment_group_guid=cls._get_group_guid(result['assignment_group']),
+            state=result['state'],
+            synced_time=timezone.now()
         )
 
+    @classmethod
+    def _apply_result(cls, change_request, result):
+        change_request.state = result['state']
+        change_request.title = result['short_description']
+        change_request.description = result['description']
+        change_request.assignment_group_guid = cls._get_group_guid(result['assignment_group'])
+        change_request.synced_time = timezone.now()
+
+    @staticmethod
+    def _get_reference_value(reference):
+        # References are returned as {'link': ..., 'value': ...}, or as their bare value when the links are excluded.
+        if isinstance(reference, dict):
+            return reference['value']
+        return reference
+
+    @classmethod
+    def _get_group_guid(cls, reference):
+        """
+        Get the GUID of the assignment group of a record, or `None` if it has none, which SNow returns as `''`.
+
+        :raises ValueError: if the reference is not a GUID
+        """
+        value = cls._get_reference_value(reference)
+        if not value:
+            return None
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+
+    @staticmethod
+    def _parse_datetime(value):
+        """
+        Parse a date and time returned by SNow ('YYYY-MM-DD HH:MM:SS', in UTC), or `None` if empty.
+        """
+        if not value:
+            return None
+
+        value = datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=dt_timezone.utc)
+        if not settings.USE_TZ:
+            value = timezone.make_naive(value)
+        return value
+
+    @staticmethod
+    def _parse_sys_id(value):
+        """
+        Get the sys_id given as a UUID or a string, or `None` if the value is not a sys_id (e.g. it is a number).
+        """
+        if isinstance(value, uuid.UUID):
+            return value
+        try:
+            return uuid.UUID(hex=value)
+        except (TypeError, ValueError):
+            return None
+
+    def clear_group_guid_cache(self):
+        """
+        Clear the SNow Group Name - GUID cache.
+        """
+        self.group_guid_cache.clear()
+
+
+class ChangeRequestHandler(BaseChangeRequestHandler):
+    """
+    SNow Change Request Handler.
+    """
+
+    def create_change_request(self, title, description, assignment_group=None, payload=None):
+        """
+        Create a change request with the given payload.
+        """
+        payload = self._get_create_payload(title, description, assignment_group, payload)
+        result = self._create_remote(payload)
+
+        change_request = self._build_change_request(result)
+        change_request.save(force_insert=True)
+
         return change_request
 
+    def create_change_requests(self, specs, max_workers=None):
+        """Create many change requests at once.
+
+        The requests to SNow are sent concurrently over a bounded thread pool and the successfully created change
+        requests are saved with a single ``bulk_create``.
+
+        Each spec is a dict of the keyword arguments of :meth:`create_change_request`:
+            * `title`
+            * `description`
+            * `assignment_group` (optional)
+            * `payload` (optional)
+
+        :param specs: The change requests to be created
+        :type specs: iterable of dict
+        :param max_workers: The maximum number of concurrent requests to SNow, defaults to `SNOW_BULK_MAX_WORKERS`
+        :type max_workers: int
+        :return: One :class:`ChangeRequestResult` per spec, in the same order as the specs
+        :rtype: list
+        """
+        specs = list(specs)
+        if not specs:
+            return []
+
+        # Resolve the payloads (and thus the group GUIDs) up front, so that the worker threads only talk to SNow.
+        try:
+            self.prefetch_group_guids(
+                spec.get('assignment_group') or self.snow_assignment_group
+                for spec in specs if 'assignment_group' not in (spec.get('payload') or {})
+            )
+        except Exception:
+            # The groups are then looked up one at a time, failing the change requests of those which are not found
+            logger.exception('Could not prefetch the SNow groups of the change requests')
+        payloads = []
+        for spec in specs:
+            try:
+                payloads.append(self._get_create_payload(
+                    spec['title'], spec['description'], spec.get('assignment_group'), spec.get('payload')
+                ))
+            except Exception as e:
+                payloads.append(self._get_bulk_error(e, 'create'))
+
+        futures = [None] * len(specs)
+        pending = [index for index, payload in enumerate(payloads) if isinstance(payload, dict)]
+        if pending:
+            self._get_client()
+            max_workers = min(max_workers or self.snow_bulk_max_workers, len(pending))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for index in pending:
+                    futures[index] = executor.submit(self._create_remote, payloads[index])
+
+        results = []
+        for spec, payload, future in zip(specs, payloads, futures):
+            if future is None:
+                results.append(ChangeRequestResult(spec, None, payload))
+                continue
+            try:
+                change_request = self._build_change_request(future.result())
+            except Exception as e:
+                results.append(ChangeRequestResult(spec, None, self._get_bulk_error(e, 'create')))
+            else:
+                results.append(ChangeRequestResult(spec, change_request, None))
+
+        ChangeRequest.objects.bulk_create([result.change_request for result in results if result.error is None])
+
+        return results
+
+    @staticmethod
+    def _get_bulk_error(exception, action):
+        """
+        Get the error of an item of a bulk operation as a :class:`ChangeRequestException`, whatever raised it, e.g. a
+        transport error or an unexpected response, so that it fails the item alone.
+        """
+        if isinstance(exception, ChangeRequestException):
+            return exception
+        logger.error('Could not %s change request due to %r', action, exception)
+        return ChangeRequestException('Could not %s change request due to %s' % (action, exception))
+
+    def _get_create_payload(self, title, description, assignment_group=None, payload=None):
+        payload = self._prepare_create_payload(title, description, payload)
+        if 'assignment_group' not in payload:
+            payload['assignment_group'] = self.get_snow_group_guid(assignment_group or self.snow_assignment_group)
+
+        return payload
+
+    def _create_remote(self, payload, sys_id=None):
+        """
+        Create a change request in SNow, looking it up by its sys_id before retrying the creation.
+
+        :param sys_id: (optional) The sys_id generated locally which the payload has, defaults to a new one
+        """
+        from requests.exceptions import HTTPError
+
+        change_requests = self._get_change_request_resource()
+        sys_id = sys_id or self._add_sys_id(payload)
+        attempts = []
+
+        def create():
+            if attempts and sys_id is not None:
+                # The failed attempt may have created the change request anyway, e.g. on a gateway timeout.
+                self._before_request('create')
+                existing = list(change_requests.get(
+                    query={'sys_id': sys_id},
+                    limit=1,
+                    fields=self.snow_response_fields or [],
+                    exclude_reference_link=self.snow_exclude_reference_link,
+                ).all())
+                if existing:
+                    return existing[0]
+
+            attempts.append(sys_id)
+            return self._get_record(change_requests.create(payload=payload))
+
+        try:
+            result = self._send('create', create, payload)
+        except HTTPError as e:
+            logger.error('Could not create change request due to %s', e.response.text)
+            raise ChangeRequestException('Could not create change request due to %s.' % e.response.text)
+
+        self._check_result(result, 'create')
+
+        return result
+
+    @staticmethod
+    def _get_record(result):
+        # Newer versions of pysnow return a lazy `Response` instead of a dict. It has to be materialized before the
+        # `'error' in result` check, which would otherwise never terminate.
+        if hasattr(result, 'one'):
+            return result.one()
+        return result
+
     def close_change_request(self, change_request):
         """Mark the change request as completed."""
 
         payload = {'state': ChangeRequest.TICKET_STATE_COMPLETE}
-        change_request.closed_time = timezone.now()
+        if change_request.state != ChangeRequest.TICKET_STATE_COMPLETE:
+            change_request.closed_time = timezone.now()
         self.update_change_request(change_request, payload)
 
     def close_change_request_with_error(self, change_request, payload):
@@ -88,9 +477,72 @@ class ChangeRequestHandler:
         :type payload: dict
         """
         payload['state'] = ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS
-        change_request.closed_time = timezone.now()
+        if change_request.state != ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS:
+            change_request.closed_time = timezone.now()
         self.update_change_request(change_request, payload)
 
+    def close_change_requests(self, change_requests, with_errors=False, payload=None, max_workers=None):
+        """Close many change requests at once.
+
+        The change requests are closed in SNow concurrently over a bounded thread pool, as by
+        :meth:`close_change_request`, or :meth:`close_change_request_with_error` if `with_errors`. The closed change
+        requests are saved with a single ``bulk_update``.
+
+        :param change_requests: The change requests to be closed
+        :type change_requests: iterable of :class:`django_snow.models.ChangeRequest`, e.g. a queryset
+        :param with_errors: Whether to mark the change requests as completed with errors
+        :type with_errors: bool
+        :param payload: (optional) A dict of data to be updated while closing the change requests
+        :type payload: dict
+        :param max_workers: The maximum number of concurrent requests to SNow, defaults to `SNOW_BULK_MAX_WORKERS`
+        :type max_workers: int
+        :return: One :class:`ChangeRequestResult` per change request, in the same order as the change requests
+        :rtype: list
+        """
+        change_requests = list(change_requests)
+        if with_errors:
+            state = ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS
+        else:
+            state = ChangeRequest.TICKET_STATE_COMPLETE
+        payloads = [
+            self._get_changed_payload(change_request, dict(payload or {}, state=state))
+            for change_request in change_requests
+        ]
+
+        futures = [None] * len(change_requests)
+        pending = [index for index, changed in enumerate(payloads) if changed]
+        if pending:
+            self._get_client()
+            max_workers = min(max_workers or self.snow_bulk_max_workers, len(pending))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for index in pending:
+                    futures[index] = executor.submit(self._update_remote, change_requests[index], payloads[index])
+
+        results = []
+        closed = []
+        for change_request, future in zip(change_requests, futures):
+            if future is None:
+                # Nothing to change
+                results.append(ChangeRequestResult(change_request, change_request, None))
+                continue
+            try:
+                result = future.result()
+                closed_time = change_request.closed_time if change_request.state == state else timezone.now()
+                self._apply_result(change_request, result)
+            except Exception as e:
+                results.append(ChangeRequestResult(change_request, None, self._get_bulk_error(e, 'update')))
+                continue
+
+            change_request.closed_time = closed_time
+            closed.append(change_request)
+            results.append(ChangeRequestResult(change_request, change_request, None))
+
+        ChangeRequest.objects.bulk_update(closed, self.UPDATE_FIELDS)
+        for change_request in closed:
+            change_request._snapshot()
+
+        return results
+
     def update_change_request(self, change_request, payload):
         """Update the change request with the data from the kwargs.
 
@@ -99,40 +551,307 @@ class ChangeRequestHandler:
             * `description`
             * `state`
 
+        Only the values which differ from those of the change request are sent to SNow, and SNow is not called at all
+        if there are none. Likewise, only the fields which changed are saved.
+
         :param change_request: The change request to be updated
         :type change_request: :class:`django_snow.models.ChangeRequest`
         :param payload: A dict of data to be updated while updating the change request
         :type payload: dict
+        :return: The updated record returned by SNow, or `None` if nothing was to be updated
+        :rtype: dict
         """
-        client = self._get_client()
+        payload = self._get_changed_payload(change_request, payload)
+        if not payload:
+            logger.debug('Not updating the change request %s, as nothing changed', change_request)
+            return None
+
+        result = self._update_remote(change_request, payload)
+
+        self._apply_result(change_request, result)
+        self._save_changes(change_request)
+
+        return result
 
-        # Get the record and update it
-        change_requests = client.resource(api_path=self.CHANGE_REQUEST_TABLE_PATH)
+    def _update_remote(self, change_request, payload):
+        from requests.exceptions import HTTPError
 
+        change_requests = self._get_change_request_resource()
+
+        # PATCH the record directly by its sys_id. `Resource.update` would first GET the record to resolve the query,
+        # costing a second round trip.
         try:
-            result = change_requests.update(query={'sys_id': change_request.sys_id.hex}, payload=payload)
+            data = json.dumps(payload)
+            result = self._send('update', lambda: self._get_record(change_requests.request(
+                'PATCH', path_append=change_request.sys_id.hex, data=data
+            )), data)
         except HTTPError as e:
             logger.error('Could not update change request due to %s', e.response.text)
             raise ChangeRequestException('Could not update change request due to %s' % e.response.text)
 
-        # This piece of code is for legacy SNow instances. (probably Geneva and before it)
-        if 'error' in result:
-            logger.error('Could not update change request due to %s', result['error'])
-            raise ChangeRequestException('Could not update change request due to %s' % result['error'])
-
-        change_request.state = result['state']
-        change_request.title = result['short_description']
-        change_request.description = result['description']
-        change_request.assignment_group_guid = result['assignment_group']['value']
-        change_request.save()
+        self._check_result(result, 'update')
 
         return result
 
+    def _send(self, operation, request, payload=None):
+        """Make a request to SNow on behalf of the given handler operation, retrying it as per the retry policy.
+
+        :param operation: The handler operation, e.g. `create`
+        :type operation: str
+        :param request: A callable making a single round trip to SNow, and returning its parsed result
+        :type request: callable
+        :param payload: (optional) The payload sent, only used to measure its size for the metrics
+        """
+        from .clients import pop_status_code
+
+        def attempt():
+            probe = self._before_circuit_breaker()
+            self._before_request(operation)
+            start = time.perf_counter() if self.metrics.enabled else None
+            if start is not None:
+                pop_status_code()
+            try:
+                result = request()
+            except Exception as e:
+                self._after_circuit_breaker(probe, e)
+                if start is not None:
+                    self._observe_request(operation, self._get_status(e, pop_status_code()), start, payload)
+                raise
+            self._after_circuit_breaker(probe)
+            if start is not None:
+                status = self._get_status(status_code=pop_status_code())
+                self._observe_request(operation, status, start, payload, result)
+            return result
+
+        return self.retry_policy.call(attempt, before_retry=partial(self._before_retry, operation))
+
+    def get_change_request(self, number_or_sys_id, max_age=None):
+        """Get a change request by its number or sys_id.
+
+        The change request is served from the database if it was synced with SNow less than `max_age` seconds ago.
+        Otherwise, it is fetched from SNow and saved.
+
+        :param number_or_sys_id: The number, e.g. `CHG0000001`, or the sys_id of the change request
+        :type number_or_sys_id: str or :class:`uuid.UUID`
+        :param max_age: (optional) The maximum age of the local change request in seconds, defaults to
+            `SNOW_CHANGE_REQUEST_MAX_AGE`. `0` always fetches it from SNow.
+        :type max_age: float
+        :raises ChangeRequest.DoesNotExist: if SNow has no such change request
+        :rtype: :class:`django_snow.models.ChangeRequest`
+        """
+        change_requests = self.get_change_requests([number_or_sys_id], max_age=max_age)
+        try:
+            return change_requests[number_or_sys_id]
+        except KeyError:
+            raise ChangeRequest.DoesNotExist('SNow has no change request %s' % number_or_sys_id)
+
+    def get_change_requests(self, numbers_or_sys_ids, max_age=None):
+        """Get many change requests by their numbers or sys_ids at once.
+
+        The change requests which were not synced with SNow in the last `max_age` seconds are fetched with a single
+        `sys_idIN` / `numberIN` query per `LOOKUP_CHUNK_SIZE` change requests, and saved in bulk.
+
+        :param numbers_or_sys_ids: The numbers and sys_ids of the change requests
+        :type numbers_or_sys_ids: iterable of str or :class:`uuid.UUID`
+        :param max_age: (optional) See :meth:`get_change_request`
+        :type max_age: float
+        :return: A dict of the given numbers and sys_ids to their change requests, without those SNow has not
+        :rtype: dict
+        """
+        identifiers = {identifier: self._parse_sys_id(identifier) for identifier in numbers_or_sys_ids}
+        sys_ids = {sys_id for sys_id in identifiers.values() if sys_id is not None}
+        numbers = {identifier for identifier, sys_id in identifiers.items() if sys_id is None}
+        if not identifiers:
+            return {}
+
+        if max_age is None:
+            max_age = self.snow_change_request_max_age
+        fresh_since = timezone.now() - timedelta(seconds=max_age)
+
+        by_sys_id = {
+            change_request.sys_id: change_request
+            for change_request in ChangeRequest.objects.filter(Q(pk__in=sys_ids) | Q(number__in=numbers))
+        }
+        fresh = {
+            change_request for change_request in by_sys_id.values()
+            if change_request.synced_time is not None and change_request.synced_time > fresh_since
+        }
+        stale_sys_ids = sorted(
+            sys_id for sys_id in sys_ids if sys_id not in by_sys_id or by_sys_id[sys_id] not in fresh
+        )
+        fresh_numbers = {change_request.number for change_request in fresh}
+        stale_numbers = sorted(numbers.difference(fresh_numbers))
+
+        if stale_sys_ids or stale_numbers:
+            fetched = self._fetch_change_requests(stale_sys_ids, stale_numbers, by_sys_id)
+            # The change requests which are no more in SNow are left out
+            by_sys_id = {change_request.sys_id: change_request for change_request in fresh.union(fetched)}
+
+        by_number = {change_request.number: change_request for change_request in by_sys_id.values()}
+        change_requests = {}
+        for identifier, sys_id in identifiers.items():
+            change_request = by_sys_id.get(sys_id) if sys_id is not None else by_number.get(identifier)
+            if change_request is not None:
+                change_requests[identifier] = change_request
+
+        return change_requests
+
+    def _fetch_change_requests(self, sys_ids, numbers, local):
+        """
+        Fetch the change requests of the sys_ids and numbers from SNow, and save them. The local change requests, by
+        sys_id, are updated in place.
+        """
+        fields = None
+        if self.snow_response_fields is not None:
+            fields = self.snow_response_fields + ['closed_at']
+
+        terms = [('sys_id', sys_id.hex) for sys_id in sys_ids] + [('number', number) for number in numbers]
+        records = []
+        for offset in range(0, len(terms), self.LOOKUP_CHUNK_SIZE):
+            chunk = terms[offset:offset + self.LOOKUP_CHUNK_SIZE]
+            values = OrderedDict()
+            for name, value in chunk:
+                values.setdefault(name, []).append(value)
+            query = '^OR'.join('%sIN%s' % (name, ','.join(values[name])) for name in values)
+            records.extend(self._get_records(query, fields, len(chunk)))
+
+        return self._save_records(records, local)
+
+    def _save_records(self, records, local):
+        """
+        Save the change requests of the records from SNow, updating the local ones, by sys_id, in place.
+        """
+        created, updated = [], []
+        for record in records:
+            try:
+                # Built first, so that an invalid record leaves the local change request untouched
+                fetched = self._build_change_request(record)
+                closed_time = self._parse_datetime(record.get('closed_at'))
+            except (KeyError, TypeError, ValueError) as e:
+                # An invalid record must not spoil the others
+                logger.warning('Not saving the invalid change request record %s: %r', record.get('sys_id'), e)
+                continue
+
+            change_request = local.get(fetched.sys_id)
+            if change_request is None:
+                change_request = fetched
+                created.append(change_request)
+            else:
+                self._apply_result(change_request, record)
+                change_request.number = record['number']
+                updated.append(change_request)
+            change_request.closed_time = closed_time or change_request.closed_time
+
+        # Another process may have saved the same change requests in the meantime
+        ChangeRequest.objects.bulk_create(created, ignore_conflicts=True)
+        ChangeRequest.objects.bulk_update(updated, [
+            'number', 'title', 'description', 'assignment_group_guid', 'state', 'closed_time', 'synced_time'
+        ])
+        for change_request in created + updated:
+            change_request._snapshot()
+
+        return created + updated
+
+    def iter_change_requests(self, query=None, fields=None, page_size=500, save=False):
+        """Iterate over the change requests in SNow matching the query, in creation order.
+
+        The change requests are fetched lazily, one page at a time, so that iterating over many of them takes constant
+        memory. The pages are walked by `sys_created_on` and `sys_id` (keyset pagination) rather than by offset, so
+        that the change requests created or deleted meanwhile do not shift them.
+
+        :param query: (optional) An encoded query, e.g. `state=1^assignment_group=<GUID>`. It may not contain
+            `ORDERBY` or `NQ` clauses.
+        :type query: str
+        :param fields: (optional) The fields of the records, defaults to all of them. `sys_id` and `sys_created_on`
+            are always included.
+        :type fields: list of str
+        :param page_size: The number of change requests fetched at once
+        :type page_size: int
+        :param save: Whether to save the change requests, a page at a time, into the :class:`ChangeRequest` table.
+            The invalid records are yielded, but not saved.
+        :type save: bool
+        :return: The records of the change requests, as returned by SNow
+        :rtype: iterator of dict
+        """
+        if fields is not None:
+            required = ['sys_id', 'sys_created_on']
+            if save:
+                required += list(self.RESPONSE_FIELDS) + ['closed_at']
+            fields = list(fields) + [field for field in required if field not in fields]
+
+        for records in self._iter_pages('list', query, fields, page_size, 'sys_created_on'):
+            if save:
+                self._save_records(records, ChangeRequest.objects.in_bulk([
+                    uuid.UUID(record['sys_id']) for record in records
+                ]))
+            for record in records:
+                yield record
+
+    def _iter_pages(self, operation, query, fields, page_size, order_by, after=None):
+        """Iterate over the pages of the change requests matching the query, in `order_by` then `sys_id` order.
+
+        Each page is fetched from after the last record of the previous one, rather than by offset. After a full
+        page, the rest of the records with the same `order_by` value as its last one are fetched by sys_id, before
+        moving on to the following values.
+
+        :param after: (optional) The `(order_by value, sys_id)` of the record to start after
+        :type after: tuple
+        """
+        value, sys_id = after or ('', '')
+        prefix = '%s^' % query if query else ''
+        same_value = bool(sys_id)
+        while True:
+            if same_value:
+                keyset = '%s=%s^sys_id>%s^ORDERBYsys_id' % (order_by, value, sys_id)
+            elif value:
+                keyset = '%s>%s^ORDERBY%s^ORDERBYsys_id' % (order_by, value, order_by)
+            else:
+                keyset = 'ORDERBY%s^ORDERBYsys_id' % order_by
+
+            records = self._get_records(prefix + keyset, fields, page_size, operation)
+            if records:
+                yield records
+                value, sys_id = records[-1][order_by], records[-1]['sys_id']
+
+            if len(records) >= page_size:
+                same_value = True
+            elif same_value:
+                same_value = False
+            else:
+                return
+
+    def _get_records(self, query, fields, limit, operation='get'):
+        from requests.exceptions import HTTPError
+
+        change_requests = self._get_client().resource(api_path=self.CHANGE_REQUEST_TABLE_PATH)
+        try:
+            return self._send(operation, lambda: list(change_requests.get(
+                query=query,
+                fields=fields or [],
+                limit=limit,
+                exclude_reference_link=bool(self.snow_exclude_reference_link),
+                suppress_pagination_header=True,
+            ).all()))
+        except HTTPError as e:
+            logger.error('Could not %s change requests due to %s', operation, e.response.text)
+            raise ChangeRequestException('Could not %s change requests due to %s' % (operation, e.response.text))
+
+    def _get_change_request_resource(self):
+        """
+        Get the change request table resource, projecting the records returned to the fields used.
+        """
+        change_requests = self._get_client().resource(api_path=self.CHANGE_REQUEST_TABLE_PATH)
+        if self.snow_response_fields is not None:
+            change_requests.parameters.fields = list(self.snow_response_fields)
+        change_requests.parameters.exclude_reference_link = bool(self.snow_exclude_reference_link)
+        return change_requests
+
     def _get_client(self):
         if self._client is None:
-            self._client = pysnow.Client(
-                instance=self.snow_instance, user=self.snow_api_user, password=self.snow_api_pass
-            )
+            # pysnow and requests are only imported once SNow is talked to, as they are slow to import.
+            from .clients import get_client
+
+            self._client = get_client(self.snow_instance, self.snow_api_user, self.snow_api_pass)
         return self._client
 
     def get_snow_group_guid(self, group_name):
@@ -140,17 +859,56 @@ class ChangeRequestHandler:
         Get the SNow Group's GUID from the Group Name
         """
 
-        if group_name not in self.group_guid_dict:
-            client = self._get_client()
-            user_groups = client.resource(api_path=self.USER_GROUP_TABLE_PATH)
-            response = user_groups.get(query={'name': group_name})
-            result = response.one()
-            self.group_guid_dict[group_name] = result['sys_id']
+        loaded = []
 
-        return self.group_guid_dict[group_name]
+        def load(group_name):
+            loaded.append(group_name)
+            return self._lookup_group_guid(group_name)
 
-    def clear_group_guid_cache(self):
-        """
-        Clear the SNow Group Name - GUID cache.
+        guid = self.group_guid_cache.get_or_load(group_name, load)
+        self.metrics.observe_group_cache(hits=0 if loaded else 1, misses=len(loaded))
+        return guid
+
+    def prefetch_group_guids(self, group_names):
+        """Resolve the GUIDs of many SNow Groups at once, and cache them.
+
+        The groups missing from the cache are looked up with a single `nameIN` query per
+        `GROUP_PREFETCH_CHUNK_SIZE` groups.
+
+        :param group_names: The names of the groups
+        :type group_names: iterable of str
+        :return: A dict of the names of the groups found to their GUIDs
+        :rtype: dict
         """
-        self.group_guid_dict.clear()
+        group_names = {group_name for group_name in group_names if group_name}
+        guids = self.group_guid_cache.get_many(group_names)
+        missing = sorted(group_names.difference(guids))
+        # The names looked up one by one below are accounted for by get_snow_group_guid
+        self.metrics.observe_group_cache(hits=len(guids), misses=len([name for name in missing if ',' not in name]))
+
+        # Commas separate the values of an IN query, so such names have to be looked up one by one.
+        for group_name in [group_name for group_name in missing if ',' in group_name]:
+            guids[group_name] = self.get_snow_group_guid(group_name)
+            missing.remove(group_name)
+
+        for offset in range(0, len(missing), self.GROUP_PREFETCH_CHUNK_SIZE):
+            chunk = missing[offset:offset + self.GROUP_PREFETCH_CHUNK_SIZE]
+            user_groups = self._get_client().resource(api_path=self.USER_GROUP_TABLE_PATH)
+            records = self._send('group_lookup', lambda: list(
+                user_groups.get(query='nameIN%s' % ','.join(chunk), fields=['sys_id', 'name']).all()
+            ))
+            for record in records:
+                if record['name'] not in guids:
+                    self.group_guid_cache.set(record['name'], record['sys_id'])
+                    guids[record['name']] = record['sys_id']
+
+        not_found = group_names.difference(guids)
+        if not_found:
+            logger.warning('Could not find the SNow groups %s', ', '.join(sorted(not_found)))
+
+        return guids
+
+    def _lookup_group_guid(self, group_name):
+        client = self._get_client()
+        user_groups = client.resource(api_path=self.USER_GROUP_TABLE_PATH)
+        return self._send('group_lookup', lambda: user_groups.get(query={'name': group_name}).one()['sys_id'])
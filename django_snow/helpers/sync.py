@@ -0,0 +1,127 @@
+import logging
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from ..models import ChangeRequest, SyncWatermark
+from .snow_request_handler import ChangeRequestHandler
+
+
+logger = logging.getLogger('django_snow')
+
+
+class ChangeRequestSynchronizer:
+    """
+    Reconciles the local change requests with their records in SNow.
+
+    Only the records updated since the last sync are pulled, one page at a time, in `sys_updated_on` then `sys_id`
+    order. The pages are walked with keyset pagination rather than offsets, so that records updated during the sync
+    cannot shift the pages. Each page is applied to the local change requests with a single `bulk_update`, and the
+    watermark is moved past it, so that an interrupted sync resumes where it stopped.
+    """
+
+    WATERMARK_NAME = 'change_request'
+
+    # The fields pulled from SNow
+    FIELDS = [
+        'sys_id', 'sys_updated_on', 'number', 'short_description', 'description', 'assignment_group', 'state',
+        'closed_at',
+    ]
+
+    # The ChangeRequest fields, by the record field they are copied from
+    FIELD_NAMES = {
+        'number': 'number',
+        'short_description': 'title',
+        'description': 'description',
+        'state': 'state',
+    }
+
+    # The errors raised by the invalid records
+    RECORD_ERRORS = (ValidationError, ValueError, KeyError, TypeError)
+
+    def __init__(self, handler=None, page_size=500):
+        """
+        :param handler: (optional) The handler making the requests to SNow
+        :type handler: :class:`ChangeRequestHandler`
+        :param page_size: The number of records pulled, and applied, at once
+        :type page_size: int
+        """
+        self.handler = handler or ChangeRequestHandler()
+        self.page_size = page_size
+
+    def sync(self, full=False):
+        """Pull the change requests updated in SNow since the last sync, and update the local ones accordingly.
+
+        :param full: Whether to pull all the change requests, rather than those updated since the last sync
+        :type full: bool
+        :return: The number of local change requests updated
+        :rtype: int
+        """
+        watermark, _ = SyncWatermark.objects.get_or_create(name=self.WATERMARK_NAME)
+        if full:
+            watermark.updated_on = watermark.sys_id = ''
+
+        updated = 0
+        pages = self.handler._iter_pages(
+            'sync', None, self.FIELDS, self.page_size, 'sys_updated_on', (watermark.updated_on, watermark.sys_id)
+        )
+        for records in pages:
+            with transaction.atomic():
+                updated += self._apply(records)
+                watermark.updated_on = records[-1]['sys_updated_on']
+                watermark.sys_id = records[-1]['sys_id']
+                watermark.save()
+
+        return updated
+
+    def _apply(self, records):
+        """
+        Update the local change requests of the records, returning how many were updated. The records may only have
+        some of the `FIELDS`, besides their sys_id.
+        """
+        records = {uuid.UUID(record['sys_id']): record for record in records}
+        change_requests = ChangeRequest.objects.in_bulk(list(records))
+
+        changed = []
+        for sys_id, change_request in change_requests.items():
+            try:
+                values = self._get_values(records[sys_id])
+            except self.RECORD_ERRORS as e:
+                # An invalid record must not spoil the others
+                logger.warning('Not applying the invalid record of the change request %s: %s', change_request, e)
+                continue
+
+            if any(getattr(change_request, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(change_request, field, value)
+                changed.append(change_request)
+
+        ChangeRequest.objects.bulk_update(
+            changed, ['number', 'title', 'description', 'assignment_group_guid', 'state', 'closed_time']
+        )
+
+        return len(changed)
+
+    def _get_values(self, record):
+        """
+        Get the values of the ChangeRequest fields from those of the record, raising one of the `RECORD_ERRORS` if
+        the record is invalid.
+        """
+        values = {}
+        for name, field_name in self.FIELD_NAMES.items():
+            if name in record:
+                values[field_name] = record[name]
+        if 'assignment_group' in record:
+            values['assignment_group_guid'] = self.handler._get_group_guid(record['assignment_group'])
+        closed_time = self.handler._parse_datetime(record.get('closed_at'))
+        if closed_time is not None:
+            values['closed_time'] = closed_time
+
+        # E.g. a title too long for the column would fail the update of the whole page
+        for field_name, value in values.items():
+            field = ChangeRequest._meta.get_field(field_name)
+            values[field_name] = field.to_python(value)
+            field.run_validators(values[field_name])
+
+        return values
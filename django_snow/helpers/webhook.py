@@ -0,0 +1,185 @@
+import atexit
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+from .sync import ChangeRequestSynchronizer
+
+
+logger = logging.getLogger('django_snow')
+
+_lock = threading.Lock()
+_event_buffers = {}
+
+
+def verify_signature(body, signature, secret, timestamp, tolerance=300):
+    """Check the HMAC-SHA256 signature of a request body and of its timestamp.
+
+    The signed message is the timestamp, a dot, then the body, so that a captured request cannot be replayed once
+    the timestamp is `tolerance` seconds away from now.
+
+    :param body: The raw body of the request
+    :type body: bytes
+    :param signature: The signature sent along, as a hex or base64 digest, optionally prefixed by `sha256=`
+    :type signature: str
+    :param secret: The secret shared with SNow
+    :type secret: str
+    :param timestamp: The time the request was signed at, in seconds since the epoch
+    :type timestamp: str
+    :param tolerance: The maximum number of seconds between the timestamp and now
+    :type tolerance: float
+    :rtype: bool
+    """
+    if not signature or not secret or not timestamp:
+        return False
+
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+        message = timestamp.encode('ascii') + b'.' + body
+    except ValueError:
+        return False
+
+    digest = hmac.new(secret.encode('utf-8'), message, hashlib.sha256).digest()
+    signature = signature.strip()
+    if signature.startswith('sha256='):
+        signature = signature[len('sha256='):]
+
+    try:
+        signed = bytes.fromhex(signature)
+    except ValueError:
+        try:
+            signed = base64.b64decode(signature, validate=True)
+        except (binascii.Error, ValueError):
+            return False
+    return hmac.compare_digest(digest, signed)
+
+
+def clean_records(records):
+    """Check the change request records pushed by SNow, before they are acknowledged.
+
+    :raises: One of :attr:`ChangeRequestSynchronizer.RECORD_ERRORS` if a record is invalid
+    """
+    synchronizer = ChangeRequestSynchronizer()
+    for record in records:
+        uuid.UUID(record['sys_id'])
+        synchronizer._get_values(record)
+        if 'sys_updated_on' in record:
+            # Compared as a string when merging the records
+            synchronizer.handler._parse_datetime(record['sys_updated_on'])
+
+
+class ChangeRequestEventBuffer:
+    """
+    Buffers the change request records pushed by SNow, and applies them to the local change requests in bulk.
+
+    The records are applied once `max_size` change requests are buffered, or `max_delay` seconds after the oldest
+    of them was buffered, with a single `bulk_update` (see :class:`ChangeRequestSynchronizer`). The records of the
+    same change request are merged, the latest `sys_updated_on` winning. With a `max_delay` of `0`, the records are
+    applied straight away. The buffered records are lost if the process dies before applying them.
+    """
+
+    def __init__(self, max_size=100, max_delay=0):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        # The buffered records, by sys_id
+        self._records = {}
+        self._timer = None
+
+    def add(self, records):
+        """
+        Buffer the records, applying the buffered ones if they are due.
+        """
+        with self._lock:
+            for record in records:
+                buffered = self._records.get(record['sys_id'])
+                if buffered is None:
+                    self._records[record['sys_id']] = dict(record)
+                elif record.get('sys_updated_on', '') >= buffered.get('sys_updated_on', ''):
+                    buffered.update(record)
+                else:
+                    self._records[record['sys_id']] = dict(record, **buffered)
+
+            due = self.max_delay <= 0 or len(self._records) >= self.max_size
+            if not due and self._timer is None and self._records:
+                self._timer = threading.Timer(self.max_delay, self._flush_later)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Apply the buffered records to the local change requests.
+
+        :return: The number of local change requests updated
+        :rtype: int
+        """
+        with self._lock:
+            records, self._records = list(self._records.values()), {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not records:
+            return 0
+
+        start = time.perf_counter()
+        synchronizer = ChangeRequestSynchronizer()
+        try:
+            with transaction.atomic():
+                updated = synchronizer._apply(records)
+        except DatabaseError:
+            # The records are applied one at a time, so that the one the database refuses does not spoil the others
+            logger.exception('Could not apply the change request events at once, applying them one at a time')
+            updated = 0
+            for record in records:
+                try:
+                    with transaction.atomic():
+                        updated += synchronizer._apply([record])
+                except DatabaseError:
+                    logger.exception('Could not apply the change request event %s', record)
+        logger.debug(
+            'Applied %d change request events, updating %d change requests in %.3f seconds',
+            len(records), updated, time.perf_counter() - start
+        )
+        return updated
+
+    def _flush_later(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not apply the change request events')
+        finally:
+            # The timer's thread has its own database connections
+            connections.close_all()
+
+
+def get_event_buffer():
+    """Get the process-wide buffer of the change request records pushed by SNow.
+
+    The records are applied by batches of up to `SNOW_WEBHOOK_BATCH_SIZE` change requests, at most
+    `SNOW_WEBHOOK_MAX_DELAY` seconds after they are received, which defaults to applying them straight away.
+    """
+    max_size = getattr(settings, 'SNOW_WEBHOOK_BATCH_SIZE', 100)
+    max_delay = getattr(settings, 'SNOW_WEBHOOK_MAX_DELAY', 0)
+    key = (max_size, max_delay)
+    with _lock:
+        event_buffer = _event_buffers.get(key)
+        if event_buffer is None:
+            event_buffer = _event_buffers[key] = ChangeRequestEventBuffer(max_size, max_delay)
+            # Apply the records left when the process exits
+            atexit.register(event_buffer.flush)
+
+    return event_buffer
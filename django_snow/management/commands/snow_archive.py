@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from ...helpers.archive import ChangeRequestArchiver
+
+
+class Command(BaseCommand):
+    help = 'Move the change requests closed for a while out of the change request table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=90,
+            help='The number of days after which the closed change requests are archived. Defaults to 90.'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='The number of change requests moved per transaction. Defaults to 1000.'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='The number of seconds to pause for between the chunks. Defaults to 0.'
+        )
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete the change requests, rather than moving them to the archived change requests.'
+        )
+
+    def handle(self, *args, **options):
+        archiver = ChangeRequestArchiver(
+            days=options['days'],
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            delete=options['delete'],
+        )
+        archived = archiver.archive()
+
+        self.stdout.write('%s %d change requests.' % ('Deleted' if options['delete'] else 'Archived', archived))
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...helpers.outbox import OutboxProcessor
+
+
+class Command(BaseCommand):
+    help = 'Send the change request operations queued by the OutboxChangeRequestHandler to SNow.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='The maximum number of operations claimed at once. Defaults to 100.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='The maximum number of concurrent requests to SNow. Defaults to SNOW_BULK_MAX_WORKERS.'
+        )
+        parser.add_argument(
+            '--max-attempts', type=int, default=5,
+            help='The number of attempts after which a failing operation is given up. Defaults to 5.'
+        )
+        parser.add_argument(
+            '--backoff', type=float, default=30,
+            help='The number of seconds after which a failed operation is attempted again, doubled by each failure. '
+                 'Defaults to 30.'
+        )
+        parser.add_argument(
+            '--max-backoff', type=float, default=3600,
+            help='The maximum number of seconds between two attempts of an operation. Defaults to 3600.'
+        )
+        parser.add_argument(
+            '--lease-timeout', type=float, default=300,
+            help='The number of seconds after which the operations claimed by a worker which died are claimed again. '
+                 'Defaults to 300.'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Keep waiting for operations once the queue is drained.'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='The number of seconds to wait for operations when looping. Defaults to 1.'
+        )
+
+    def handle(self, *args, **options):
+        processor = OutboxProcessor(
+            batch_size=options['batch_size'],
+            max_workers=options['workers'],
+            max_attempts=options['max_attempts'],
+            backoff=options['backoff'],
+            max_backoff=options['max_backoff'],
+            lease_timeout=options['lease_timeout'],
+        )
+
+        total = 0
+        while True:
+            count = processor.process_batch()
+            total += count
+            if count:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write('Processed %d operations.' % total)
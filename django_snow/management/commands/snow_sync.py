@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ...helpers.sync import ChangeRequestSynchronizer
+
+
+class Command(BaseCommand):
+    help = 'Update the local change requests with the changes made to them in SNow since the last sync.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size', type=int, default=500,
+            help='The number of records pulled from SNow at once. Defaults to 500.'
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Pull all the change requests, rather than those updated since the last sync.'
+        )
+
+    def handle(self, *args, **options):
+        synchronizer = ChangeRequestSynchronizer(page_size=options['page_size'])
+        updated = synchronizer.sync(full=options['full'])
+
+        self.stdout.write('Updated %d change requests.' % updated)
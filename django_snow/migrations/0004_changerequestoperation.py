@@ -0,0 +1,41 @@
+# Generated by Django 3.1.14 on 2026-10-16 19:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0003_auto_20190607_1500'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changerequest',
+            name='state',
+            field=models.CharField(choices=[('pnd', 'Pending'), ('1', 'Open'), ('2', 'In Progress'), ('3', 'Complete'), ('4', 'Complete With Errors')], help_text='The current state the change order is in.', max_length=3),
+        ),
+        migrations.CreateModel(
+            name='ChangeRequestOperation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('close', 'Close'), ('close_with_error', 'Close With Error')], max_length=16)),
+                ('payload', models.TextField(default='{}')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0, help_text='The number of times the operation was attempted')),
+                ('error', models.TextField(blank=True, help_text='The error of the last attempt')),
+                ('created_time', models.DateTimeField(auto_now_add=True, help_text='Timestamp when the operation was queued')),
+                ('processed_time', models.DateTimeField(help_text='Timestamp when the operation was sent to SNow', null=True)),
+                ('change_request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operations', to='django_snow.changerequest')),
+            ],
+            options={
+                'verbose_name': 'service-now change request operation',
+                'verbose_name_plural': 'service-now change request operations',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='changerequestoperation',
+            index=models.Index(fields=['status', 'id'], name='django_snow_status_82303a_idx'),
+        ),
+    ]
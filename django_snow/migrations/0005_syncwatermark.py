@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-16 19:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0004_changerequestoperation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='The name of the synced table', max_length=64, unique=True)),
+                ('updated_on', models.CharField(blank=True, max_length=19)),
+                ('sys_id', models.CharField(blank=True, help_text='The sys_id of the last record synced', max_length=32)),
+                ('synced_time', models.DateTimeField(auto_now=True, help_text='Timestamp when the table was last synced')),
+            ],
+            options={
+                'verbose_name': 'service-now sync watermark',
+                'verbose_name_plural': 'service-now sync watermarks',
+            },
+        ),
+    ]
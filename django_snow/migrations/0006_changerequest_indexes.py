@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-16 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0005_syncwatermark'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changerequest',
+            index=models.Index(fields=['number'], name='django_snow_cr_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changerequest',
+            index=models.Index(fields=['assignment_group_guid', 'state'], name='django_snow_cr_group_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changerequest',
+            index=models.Index(condition=models.Q(state__in=('1', '2')), fields=['assignment_group_guid', 'created_time'], name='django_snow_cr_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changerequest',
+            index=models.Index(fields=['created_time'], name='django_snow_cr_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changerequest',
+            index=models.Index(fields=['closed_time'], name='django_snow_cr_closed_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-16 19:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0006_changerequest_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changerequest',
+            name='synced_time',
+            field=models.DateTimeField(help_text='Timestamp when the Change Request was last synced with SNow', null=True),
+        ),
+    ]
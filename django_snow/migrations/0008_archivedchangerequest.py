@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-16 20:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0007_changerequest_synced_time'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedChangeRequest',
+            fields=[
+                ('sys_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('number', models.CharField(help_text='The Change Order number', max_length=32)),
+                ('title', models.CharField(help_text='Title of the ServiceNow Change Request', max_length=160)),
+                ('description', models.TextField(help_text='Description of the ServiceNow Change Request')),
+                ('assignment_group_guid', models.UUIDField()),
+                ('state', models.CharField(choices=[('pnd', 'Pending'), ('1', 'Open'), ('2', 'In Progress'), ('3', 'Complete'), ('4', 'Complete With Errors')], help_text='The state the change order was in when archived.', max_length=3)),
+                ('created_time', models.DateTimeField(help_text='Timestamp when the Change Request was created', null=True)),
+                ('closed_time', models.DateTimeField(help_text='Timestamp when the Change Request was closed', null=True)),
+                ('synced_time', models.DateTimeField(help_text='Timestamp when the Change Request was last synced with SNow', null=True)),
+                ('archived_time', models.DateTimeField(auto_now_add=True, help_text='Timestamp when the Change Request was archived')),
+            ],
+            options={
+                'verbose_name': 'archived service-now change request',
+                'verbose_name_plural': 'archived service-now change requests',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedchangerequest',
+            index=models.Index(fields=['number'], name='django_snow_acr_number_idx'),
+        ),
+    ]
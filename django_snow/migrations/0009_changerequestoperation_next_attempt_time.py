@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-16 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0008_archivedchangerequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changerequestoperation',
+            name='next_attempt_time',
+            field=models.DateTimeField(help_text='Timestamp before which the operation is not attempted again', null=True),
+        ),
+    ]
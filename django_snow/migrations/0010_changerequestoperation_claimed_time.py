@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-16 20:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0009_changerequestoperation_next_attempt_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changerequestoperation',
+            name='claimed_time',
+            field=models.DateTimeField(help_text='Timestamp when the operation was last claimed to be sent to SNow', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0010_changerequestoperation_claimed_time'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedchangerequest',
+            name='assignment_group_guid',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='changerequest',
+            name='assignment_group_guid',
+            field=models.UUIDField(null=True),
+        ),
+    ]
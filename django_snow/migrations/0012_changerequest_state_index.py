@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-17 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_snow', '0011_changerequest_assignment_group_guid_null'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changerequest',
+            index=models.Index(fields=['state', 'created_time'], name='django_snow_cr_state_idx'),
+        ),
+    ]
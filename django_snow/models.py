@@ -2,6 +2,27 @@ from django.core.validators import MaxLengthValidator
 from django.db import models
 
 
+class ChangeRequestQuerySet(models.QuerySet):
+    """
+    The queries commonly made on change requests, each of them served by an index.
+    """
+
+    def open(self):
+        """The change requests which are not closed in SNow."""
+
+        return self.filter(state__in=ChangeRequest.OPEN_STATES)
+
+    def for_group(self, assignment_group_guid):
+        """The change requests assigned to the group of the given GUID."""
+
+        return self.filter(assignment_group_guid=assignment_group_guid)
+
+    def by_number(self, number):
+        """The change request of the given number, e.g. `CHG0000001`."""
+
+        return self.filter(number=number)
+
+
 class ChangeRequest(models.Model):
     """
     SNow Change Request Model Class.
@@ -12,16 +33,22 @@ class ChangeRequest(models.Model):
     # https://docs.servicenow.com/bundle/kingston-it-service-management/page/product/change-management/task/state-model-activate-tasks.html
 
     # The state of the Change Request
+    # Local only, until the Change Request is created in SNow (see ChangeRequestOperation)
+    TICKET_STATE_PENDING = 'pnd'
     TICKET_STATE_OPEN = '1'
     TICKET_STATE_IN_PROGRESS = '2'
     TICKET_STATE_COMPLETE = '3'
     TICKET_STATE_COMPLETE_WITH_ERRORS = '4'
     TICKET_STATE_CHOICES = (
+        (TICKET_STATE_PENDING, 'Pending'),
         (TICKET_STATE_OPEN, 'Open'),
         (TICKET_STATE_IN_PROGRESS, 'In Progress'),
         (TICKET_STATE_COMPLETE, 'Complete'),
         (TICKET_STATE_COMPLETE_WITH_ERRORS, 'Complete With Errors'),
     )
+    # The states of the Change Requests which are not closed in SNow
+    OPEN_STATES = (TICKET_STATE_OPEN, TICKET_STATE_IN_PROGRESS)
+    CLOSED_STATES = (TICKET_STATE_COMPLETE, TICKET_STATE_COMPLETE_WITH_ERRORS)
 
     # The 32 character GUID for a SNow record
     sys_id = models.UUIDField(
@@ -45,9 +72,10 @@ class ChangeRequest(models.Model):
         help_text="Description of the ServiceNow Change Request"
     )
 
-    # The GUID of the Group to which the Ticket was assigned to
+    # The GUID of the Group to which the Ticket was assigned to, if any
     assignment_group_guid = models.UUIDField(
-        max_length=32
+        max_length=32,
+        null=True
     )
 
     state = models.CharField(
@@ -68,9 +96,277 @@ class ChangeRequest(models.Model):
         help_text='Timestamp when the Change Request was closed'
     )
 
+    # The time at which the Change Request was last read from, or written to, SNow.
+    synced_time = models.DateTimeField(
+        null=True,
+        help_text='Timestamp when the Change Request was last synced with SNow'
+    )
+
+    objects = ChangeRequestQuerySet.as_manager()
+
     def __str__(self):
         return self.number
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._snapshot(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        self._snapshot(fields)
+
+    def get_dirty_fields(self):
+        """
+        Get the names of the fields changed since the Change Request was loaded from, or saved to, the database.
+        Returns `None` if it was neither, as it is then unknown which fields differ from the database.
+        """
+        saved_values = getattr(self, '_saved_values', None)
+        if saved_values is None:
+            return None
+
+        return [
+            field.attname for field in self._meta.concrete_fields
+            if field.attname in saved_values and self._get_value(field) != saved_values[field.attname]
+        ]
+
+    def _snapshot(self, field_names=None):
+        """
+        Remember the values of the given fields, or of all of them, as those in the database.
+        """
+        deferred = self.get_deferred_fields()
+        saved_values = getattr(self, '_saved_values', None) or {}
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred:
+                continue
+            if field_names is None or field.name in field_names or field.attname in field_names:
+                saved_values[field.attname] = self._get_value(field)
+        self._saved_values = saved_values
+
+    def _get_value(self, field):
+        # Normalized, e.g. the GUIDs may be assigned as strings
+        return field.to_python(getattr(self, field.attname))
+
     class Meta:
         verbose_name = 'service-now change request'
         verbose_name_plural = 'service-now change requests'
+        indexes = [
+            models.Index(fields=['number'], name='django_snow_cr_number_idx'),
+            models.Index(fields=['assignment_group_guid', 'state'], name='django_snow_cr_group_state_idx'),
+            # Only the open change requests, which are few compared to the closed ones. Databases not supporting
+            # partial indexes skip it, and use the index above.
+            models.Index(
+                fields=['assignment_group_guid', 'created_time'],
+                name='django_snow_cr_open_idx',
+                condition=models.Q(state__in=('1', '2'))  # OPEN_STATES, which is out of the scope of Meta
+            ),
+            models.Index(fields=['state', 'created_time'], name='django_snow_cr_state_idx'),
+            models.Index(fields=['created_time'], name='django_snow_cr_created_idx'),
+            models.Index(fields=['closed_time'], name='django_snow_cr_closed_idx'),
+        ]
+
+
+class ChangeRequestOperation(models.Model):
+    """
+    An operation on a SNow Change Request, queued to be sent to SNow by the `snow_outbox` management command.
+    """
+
+    OPERATION_CREATE = 'create'
+    OPERATION_UPDATE = 'update'
+    OPERATION_CLOSE = 'close'
+    OPERATION_CLOSE_WITH_ERROR = 'close_with_error'
+    OPERATION_CHOICES = (
+        (OPERATION_CREATE, 'Create'),
+        (OPERATION_UPDATE, 'Update'),
+        (OPERATION_CLOSE, 'Close'),
+        (OPERATION_CLOSE_WITH_ERROR, 'Close With Error'),
+    )
+
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    change_request = models.ForeignKey(
+        ChangeRequest,
+        on_delete=models.CASCADE,
+        related_name='operations'
+    )
+
+    operation = models.CharField(
+        max_length=16,
+        choices=OPERATION_CHOICES
+    )
+
+    # The JSON encoded arguments of the operation
+    payload = models.TextField(
+        default='{}'
+    )
+
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        help_text='The number of times the operation was attempted'
+    )
+
+    error = models.TextField(
+        blank=True,
+        help_text='The error of the last attempt'
+    )
+
+    created_time = models.DateTimeField(
+        auto_now_add=True,
+        help_text='Timestamp when the operation was queued'
+    )
+
+    processed_time = models.DateTimeField(
+        null=True,
+        help_text='Timestamp when the operation was sent to SNow'
+    )
+
+    # Set when claimed, as the claims of the workers which died expire
+    claimed_time = models.DateTimeField(
+        null=True,
+        help_text='Timestamp when the operation was last claimed to be sent to SNow'
+    )
+
+    # Set after a failed attempt, as the attempts are backed off
+    next_attempt_time = models.DateTimeField(
+        null=True,
+        help_text='Timestamp before which the operation is not attempted again'
+    )
+
+    def __str__(self):
+        return '%s %s' % (self.operation, self.change_request_id)
+
+    class Meta:
+        verbose_name = 'service-now change request operation'
+        verbose_name_plural = 'service-now change request operations'
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+
+
+class SyncWatermark(models.Model):
+    """
+    How far the `snow_sync` management command got through the records of a SNow table, ordered by `sys_updated_on`
+    then `sys_id`.
+    """
+
+    name = models.CharField(
+        max_length=64,
+        unique=True,
+        help_text='The name of the synced table'
+    )
+
+    # The `sys_updated_on` of the last record synced, as returned by SNow: 'YYYY-MM-DD HH:MM:SS', in UTC.
+    updated_on = models.CharField(
+        max_length=19,
+        blank=True
+    )
+
+    sys_id = models.CharField(
+        max_length=32,
+        blank=True,
+        help_text='The sys_id of the last record synced'
+    )
+
+    synced_time = models.DateTimeField(
+        auto_now=True,
+        help_text='Timestamp when the table was last synced'
+    )
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = 'service-now sync watermark'
+        verbose_name_plural = 'service-now sync watermarks'
+
+
+class ArchivedChangeRequest(models.Model):
+    """
+    A closed SNow Change Request moved out of the `ChangeRequest` table by the `snow_archive` management command.
+    """
+
+    sys_id = models.UUIDField(
+        max_length=32,
+        primary_key=True
+    )
+
+    number = models.CharField(
+        max_length=32,
+        help_text="The Change Order number"
+    )
+
+    title = models.CharField(
+        max_length=160,
+        help_text="Title of the ServiceNow Change Request"
+    )
+
+    description = models.TextField(
+        help_text="Description of the ServiceNow Change Request"
+    )
+
+    assignment_group_guid = models.UUIDField(
+        max_length=32,
+        null=True
+    )
+
+    state = models.CharField(
+        max_length=3,
+        choices=ChangeRequest.TICKET_STATE_CHOICES,
+        help_text='The state the change order was in when archived.'
+    )
+
+    created_time = models.DateTimeField(
+        null=True,
+        help_text='Timestamp when the Change Request was created'
+    )
+
+    closed_time = models.DateTimeField(
+        null=True,
+        help_text='Timestamp when the Change Request was closed'
+    )
+
+    synced_time = models.DateTimeField(
+        null=True,
+        help_text='Timestamp when the Change Request was last synced with SNow'
+    )
+
+    archived_time = models.DateTimeField(
+        auto_now_add=True,
+        help_text='Timestamp when the Change Request was archived'
+    )
+
+    # The fields copied from the ChangeRequest
+    COPIED_FIELDS = (
+        'sys_id', 'number', 'title', 'description', 'assignment_group_guid', 'state', 'created_time', 'closed_time',
+        'synced_time',
+    )
+
+    def __str__(self):
+        return self.number
+
+    class Meta:
+        verbose_name = 'archived service-now change request'
+        verbose_name_plural = 'archived service-now change requests'
+        indexes = [
+            models.Index(fields=['number'], name='django_snow_acr_number_idx'),
+        ]
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from .views import ChangeRequestWebhookView
+
+
+app_name = 'django_snow'
+
+urlpatterns = [
+    path('change_requests/webhook/', ChangeRequestWebhookView.as_view(), name='change_request_webhook'),
+]
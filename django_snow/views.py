@@ -0,0 +1,65 @@
+import json
+import logging
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from .helpers.sync import ChangeRequestSynchronizer
+from .helpers.webhook import clean_records, get_event_buffer, verify_signature
+
+
+logger = logging.getLogger('django_snow')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChangeRequestWebhookView(View):
+    """
+    Receives the change requests pushed by a SNow business rule, through an outbound REST message.
+
+    The body is a JSON object with a `records` list of change request records, or a single record. Each record must
+    have a `sys_id`, and may have any of `number`, `short_description`, `description`, `assignment_group`, `state`,
+    `closed_at` and `sys_updated_on`. The records are checked before being acknowledged, so that they can be applied.
+
+    The request must be signed with an HMAC-SHA256 of the `SNOW_WEBHOOK_SECRET` setting, sent as a hex or base64
+    digest in the `X-Snow-Signature` header. The signed message is the `X-Snow-Timestamp` header, the time of the
+    request in seconds since the epoch, a dot, then the body. The requests whose timestamp is more than
+    `SNOW_WEBHOOK_TOLERANCE` seconds away from now are refused.
+
+    The records are applied to the local change requests in bulk (see
+    :class:`django_snow.helpers.webhook.ChangeRequestEventBuffer`) before the response, unless
+    `SNOW_WEBHOOK_MAX_DELAY` buffers them, in which case the response does not wait for them.
+    """
+
+    http_method_names = ['post']
+
+    SIGNATURE_HEADER = 'HTTP_X_SNOW_SIGNATURE'
+    TIMESTAMP_HEADER = 'HTTP_X_SNOW_TIMESTAMP'
+
+    def post(self, request):
+        secret = getattr(settings, 'SNOW_WEBHOOK_SECRET', None)
+        if not secret:
+            raise ImproperlyConfigured('SNOW_WEBHOOK_SECRET must be set to receive the change requests from SNow.')
+
+        signed = verify_signature(
+            request.body, request.META.get(self.SIGNATURE_HEADER), secret, request.META.get(self.TIMESTAMP_HEADER),
+            tolerance=getattr(settings, 'SNOW_WEBHOOK_TOLERANCE', 300)
+        )
+        if not signed:
+            logger.warning('Rejecting a change request event with an invalid or stale signature')
+            return JsonResponse({'error': 'Invalid signature'}, status=403)
+
+        try:
+            body = json.loads(request.body.decode('utf-8'))
+            records = body['records'] if 'records' in body else [body]
+            # Invalid records must not be acknowledged, as they could not be applied
+            clean_records(records)
+        except (AttributeError,) + ChangeRequestSynchronizer.RECORD_ERRORS as e:
+            return JsonResponse({'error': 'Invalid change request event: %s' % e}, status=400)
+
+        get_event_buffer().add(records)
+
+        return JsonResponse({'accepted': len(records)}, status=202)
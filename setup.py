@@ -20,14 +20,20 @@ setup(
     license='MIT',
     description='Django package for creation of ServiceNow Tickets',
     long_description=README,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'testapp']),
     include_package_data=True,
     url='https://github.com/godaddy/django-snow',
     download_url='https://github.com/godaddy/django-snow/archive/master.tar.gz',
     install_requires=[
-        'Django>=1.8',
+        'Django>=2.2',
         'pysnow>=0.6.4',
     ],
+    python_requires='>=3.5',
+    extras_require={
+        'async': ['asgiref', 'httpx'],
+        'prometheus': ['prometheus_client'],
+        'statsd': ['statsd'],
+    },
     tests_require=[
         'six',
     ],
@@ -40,17 +46,17 @@ setup(
         'Natural Language :: English',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
         'Framework :: Django',
-        'Framework :: Django :: 1.8',
-        'Framework :: Django :: 1.9',
-        'Framework :: Django :: 1.10',
-        'Framework :: Django :: 1.11',
+        'Framework :: Django :: 2.2',
+        'Framework :: Django :: 3.0',
+        'Framework :: Django :: 3.1',
         'Topic :: Software Development :: Libraries :: Python Modules',
     ],
     zip_safe=False,
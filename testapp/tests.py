@@ -1,12 +1,51 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import unittest
 import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from email.utils import formatdate
 
+import requests
 import six
-from django.test import TestCase, override_settings
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import QuerySet
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 from requests.exceptions import HTTPError
 
-from django_snow.helpers import ChangeRequestHandler
-from django_snow.helpers.exceptions import ChangeRequestException
-from django_snow.models import ChangeRequest
+from benchmarks.fake_snow import FakeServiceNow
+from django_snow.admin import ChangeRequestAdmin, EstimatedCountPaginator
+from django_snow.helpers import ChangeRequestHandler, ChangeRequestResult
+from django_snow.helpers.archive import ChangeRequestArchiver
+from django_snow.helpers.batch import ChangeRequestBatch
+from django_snow.helpers.clients import SnowHTTPAdapter, clear_clients
+from django_snow.helpers.coalescing import CoalescingChangeRequestHandler, _flush_handlers
+from django_snow.helpers.circuit_breaker import CacheCircuitBreaker, CircuitBreaker, get_circuit_breaker
+from django_snow.helpers.exceptions import ChangeRequestException, CircuitOpenException
+from django_snow.helpers.group_cache import GroupGuidCache
+from django_snow.helpers.metrics import NullMetrics, PrometheusMetrics, StatsdMetrics, get_metrics
+from django_snow.helpers.outbox import OutboxChangeRequestHandler, OutboxProcessor
+from django_snow.helpers.rate_limit import CacheFixedWindowLimiter, TokenBucket, get_rate_limiter
+from django_snow.helpers.retry import RetryPolicy
+from django_snow.helpers.sync import ChangeRequestSynchronizer
+from django_snow.helpers.webhook import ChangeRequestEventBuffer
+from django_snow.models import ArchivedChangeRequest, ChangeRequest, ChangeRequestOperation, SyncWatermark
 
 
 try:
@@ -14,6 +53,49 @@ try:
 except ImportError:
     import mock
 
+try:
+    import httpx
+    from asgiref.sync import async_to_sync
+
+    from django_snow.helpers.async_handler import AsyncChangeRequestHandler
+except ImportError:
+    httpx = None
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+def query_records(records, query, fields, limit):
+    """
+    A fake of the change request table, supporting the `=`, `>` and `ORDERBY` clauses of the encoded queries.
+    """
+    order_by = []
+    for term in query.split('^'):
+        if term.startswith('ORDERBY'):
+            order_by.append(term[len('ORDERBY'):])
+            continue
+        name, operator, value = re.match(r'(\w+)([=>])(.*)', term).groups()
+        if operator == '=':
+            records = [record for record in records if record[name] == value]
+        else:
+            records = [record for record in records if record[name] > value]
+
+    records = sorted(records, key=lambda record: [record[name] for name in order_by])
+    response = mock.MagicMock()
+    response.all.return_value = iter([
+        {field: record[field] for field in fields} if fields else dict(record) for record in records[:limit]
+    ])
+    return response
+
+
+def make_http_error(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return HTTPError(response=response)
+
 
 @override_settings(
     SNOW_INSTANCE='devgodaddy',
@@ -21,7 +103,7 @@ except ImportError:
     SNOW_API_PASS='snow_pass',
     SNOW_ASSIGNMENT_GROUP='assignment_group'
 )
-@mock.patch('django_snow.helpers.snow_request_handler.pysnow')
+@mock.patch('django_snow.helpers.clients.pysnow')
 class TestChangeRequestHandler(TestCase):
 
     def setUp(self):
@@ -30,6 +112,7 @@ class TestChangeRequestHandler(TestCase):
 
     def tearDown(self):
         self.change_request_handler.clear_group_guid_cache()
+        clear_clients()
 
     def test__get_client(self, mock_pysnow):
         mock_pysnow.Client.return_value = self.mock_pysnow_client
@@ -38,6 +121,51 @@ class TestChangeRequestHandler(TestCase):
             self.change_request_handler._get_client()
         )
 
+        session = mock_pysnow.Client.call_args[1]['session']
+        mock_pysnow.Client.assert_called_once_with(instance='devgodaddy', session=session)
+        self.assertEqual(session.auth, ('snow_user', 'snow_pass'))
+
+    def test__get_client_is_shared_between_handlers(self, mock_pysnow):
+        self.assertIs(self.change_request_handler._get_client(), ChangeRequestHandler()._get_client())
+        self.assertEqual(mock_pysnow.Client.call_count, 1)
+
+        with override_settings(SNOW_API_USER='other_user'):
+            ChangeRequestHandler()._get_client()
+        self.assertEqual(mock_pysnow.Client.call_count, 2)
+
+    @mock.patch('django_snow.helpers.clients.os')
+    def test__get_client_is_not_shared_with_forked_processes(self, mock_os, mock_pysnow):
+        mock_os.getpid.return_value = 1
+        parent_client = self.change_request_handler._get_client()
+
+        mock_os.getpid.return_value = 2
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+        self.assertIs(ChangeRequestHandler()._get_client(), self.mock_pysnow_client)
+        self.assertIsNot(self.mock_pysnow_client, parent_client)
+        self.assertFalse(parent_client.session.close.called)
+
+    @override_settings(SNOW_POOL_MAXSIZE=32, SNOW_POOL_BLOCK=True, SNOW_POOL_KEEPALIVE=False, SNOW_TIMEOUT=(3, 10))
+    def test__get_client_pool_settings(self, mock_pysnow):
+        self.change_request_handler._get_client()
+
+        session = mock_pysnow.Client.call_args[1]['session']
+        adapter = session.get_adapter('https://devgodaddy.service-now.com')
+        self.assertIsInstance(adapter, SnowHTTPAdapter)
+        self.assertEqual(adapter._pool_maxsize, 32)
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(adapter.timeout, (3, 10))
+        self.assertEqual(session.headers['Connection'], 'close')
+
+    @mock.patch('requests.adapters.HTTPAdapter.send')
+    def test_snow_http_adapter_timeout(self, mock_send, mock_pysnow):
+        request = mock.MagicMock()
+
+        SnowHTTPAdapter(timeout=5).send(request, timeout=60)
+        mock_send.assert_called_with(request, timeout=5)
+
+        SnowHTTPAdapter().send(request, timeout=60)
+        mock_send.assert_called_with(request, timeout=60)
+
     def test__get_client_once_initialized_returns_same_instance(self, mock_pysnow):
         mock_pysnow.Client.return_value = self.mock_pysnow_client
         self.change_request_handler._get_client()
@@ -53,6 +181,9 @@ class TestChangeRequestHandler(TestCase):
         self.assertEqual(self.change_request_handler.snow_api_pass, 'snow_pass')
         self.assertEqual(self.change_request_handler.snow_assignment_group, 'assignment_group')
         self.assertEqual(self.change_request_handler.snow_default_cr_type, 'standard')
+        self.assertEqual(self.change_request_handler.snow_bulk_max_workers, 8)
+        self.assertEqual(self.change_request_handler.retry_policy.max_attempts, 3)
+        self.assertIsNone(self.change_request_handler.rate_limiter)
         self.assertEqual(self.change_request_handler.CHANGE_REQUEST_TABLE_PATH, '/table/change_request')
         self.assertEqual(self.change_request_handler.USER_GROUP_TABLE_PATH, '/table/sys_user_group')
 
@@ -87,7 +218,8 @@ class TestChangeRequestHandler(TestCase):
             'type': 'normal',
             'assignment_group': 'bar',
             'short_description': 'Title',
-            'description': 'Description'
+            'description': 'Description',
+            'sys_id': mock.ANY
         }
 
         fake_insert_retval = {
@@ -116,7 +248,8 @@ class TestChangeRequestHandler(TestCase):
             'short_description': 'Title',
             'description': 'Description',
             'type': 'standard',
-            'assignment_group': 'bar'
+            'assignment_group': 'bar',
+            'sys_id': mock.ANY
         }
 
         fake_insert_retval = {
@@ -171,6 +304,290 @@ class TestChangeRequestHandler(TestCase):
         with six.assertRaisesRegex(self, ChangeRequestException, 'Could not create change request due to.*'):
             self.change_request_handler.create_change_request('Title', 'Description', None, payload={})
 
+    def test_create_change_requests(self, mock_pysnow):
+        def fake_create(payload):
+            return {
+                'sys_id': uuid.uuid4(),
+                'number': 'CHG%s' % payload['short_description'],
+                'short_description': payload['short_description'],
+                'description': payload['description'],
+                'assignment_group': {'value': uuid.uuid4()},
+                'state': '1'
+            }
+
+        fake_resource = mock.MagicMock()
+        fake_resource.create.side_effect = fake_create
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        specs = [
+            {'title': str(i), 'description': 'Description', 'payload': {'assignment_group': 'bar'}} for i in range(5)
+        ]
+        with self.assertNumQueries(1):
+            results = self.change_request_handler.create_change_requests(specs, max_workers=3)
+
+        self.assertEqual(fake_resource.create.call_count, 5)
+        self.assertEqual([result.item for result in results], specs)
+        self.assertEqual([result.change_request.title for result in results], [str(i) for i in range(5)])
+        self.assertTrue(all(result.error is None for result in results))
+        self.assertEqual(ChangeRequest.objects.count(), 5)
+
+    def test_create_change_requests_reports_failures(self, mock_pysnow):
+        fake_exception = HTTPError()
+        fake_exception.response = mock.MagicMock()
+
+        def fake_create(payload):
+            if payload['short_description'] == 'bad':
+                raise fake_exception
+            return {
+                'sys_id': uuid.uuid4(),
+                'number': 'CHG0000001',
+                'short_description': payload['short_description'],
+                'description': payload['description'],
+                'assignment_group': {'value': uuid.uuid4()},
+                'state': '1'
+            }
+
+        fake_resource = mock.MagicMock()
+        fake_resource.create.side_effect = fake_create
+        fake_response = mock.MagicMock()
+        fake_response.all.return_value = [{'sys_id': 'bar', 'name': 'assignment_group'}]
+        fake_resource.get.return_value = fake_response
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        good, bad = self.change_request_handler.create_change_requests([
+            {'title': 'good', 'description': 'Description'},
+            {'title': 'bad', 'description': 'Description'},
+        ])
+
+        self.assertIsNone(good.error)
+        self.assertEqual(good.change_request.title, 'good')
+        self.assertIsNone(bad.change_request)
+        self.assertIsInstance(bad.error, ChangeRequestException)
+        self.assertEqual(list(ChangeRequest.objects.values_list('title', flat=True)), ['good'])
+        # The assignment group is looked up once, before the requests are dispatched.
+        fake_resource.get.assert_called_once_with(query='nameINassignment_group', fields=['sys_id', 'name'])
+        self.assertEqual(fake_resource.create.call_args[1]['payload']['assignment_group'], 'bar')
+
+    @mock.patch('django_snow.helpers.retry.time')
+    def test_create_change_requests_reports_transport_errors(self, mock_time, mock_pysnow):
+        def fake_create(payload):
+            if payload['short_description'] == 'bad':
+                raise requests.ConnectionError('Connection refused')
+            return {
+                'sys_id': uuid.uuid4(),
+                'number': 'CHG0000001',
+                'short_description': payload['short_description'],
+                'description': payload['description'],
+                'assignment_group': {'value': uuid.uuid4()},
+                'state': '1'
+            }
+
+        fake_resource = mock.MagicMock()
+        fake_resource.create.side_effect = fake_create
+        fake_resource.get.return_value.all.return_value = []
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        good, bad = self.change_request_handler.create_change_requests([
+            {'title': 'good', 'description': 'Description', 'payload': {'assignment_group': 'bar'}},
+            {'title': 'bad', 'description': 'Description', 'payload': {'assignment_group': 'bar'}},
+        ])
+
+        self.assertIsNone(good.error)
+        self.assertIsNone(bad.change_request)
+        self.assertIsInstance(bad.error, ChangeRequestException)
+        self.assertIn('Connection refused', str(bad.error))
+        self.assertEqual(list(ChangeRequest.objects.values_list('title', flat=True)), ['good'])
+
+    def test_create_change_requests_reports_every_error(self, mock_pysnow):
+        from pysnow.exceptions import NoResults, UnexpectedResponseFormat
+
+        def fake_create(payload):
+            if payload['short_description'] == 'unexpected':
+                raise UnexpectedResponseFormat('Unexpected HTTP response code')
+            return {
+                'sys_id': uuid.uuid4(),
+                'number': 'CHG0000001',
+                'short_description': payload['short_description'],
+                'description': payload['description'],
+                'assignment_group': {'value': uuid.uuid4()},
+                'state': '1'
+            }
+
+        fake_resource = mock.MagicMock()
+        fake_resource.create.side_effect = fake_create
+        fake_resource.get.return_value.all.return_value = []
+        fake_resource.get.return_value.one.side_effect = NoResults('No records found')
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        good, unknown_group, unexpected = self.change_request_handler.create_change_requests([
+            {'title': 'good', 'description': 'Description', 'payload': {'assignment_group': 'bar'}},
+            {'title': 'unknown', 'description': 'Description', 'assignment_group': 'unknown'},
+            {'title': 'unexpected', 'description': 'Description', 'payload': {'assignment_group': 'bar'}},
+        ])
+
+        self.assertIsNone(good.error)
+        self.assertIsInstance(unknown_group.error, ChangeRequestException)
+        self.assertIn('No records found', str(unknown_group.error))
+        self.assertIsInstance(unexpected.error, ChangeRequestException)
+        self.assertIn('Unexpected HTTP response code', str(unexpected.error))
+        self.assertEqual(fake_resource.create.call_count, 2)
+        self.assertEqual(list(ChangeRequest.objects.values_list('title', flat=True)), ['good'])
+
+    def test_create_change_requests_without_specs(self, mock_pysnow):
+        self.assertEqual(self.change_request_handler.create_change_requests([]), [])
+        self.assertFalse(mock_pysnow.Client.called)
+
+    @mock.patch('django_snow.helpers.retry.time')
+    def test_create_change_request_retries_transient_errors(self, mock_time, mock_pysnow):
+        fake_insert_retval = {
+            'sys_id': uuid.uuid4(),
+            'number': 'CHG0000001',
+            'short_description': 'Title',
+            'description': 'Description',
+            'assignment_group': {'value': uuid.uuid4()},
+            'state': '1'
+        }
+
+        fake_resource = mock.MagicMock()
+        fake_resource.create.side_effect = [make_http_error(429, {'Retry-After': '2'}), fake_insert_retval]
+        fake_resource.get.return_value.all.return_value = []
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        co = self.change_request_handler.create_change_request(
+            'Title', 'Description', payload={'assignment_group': 'a'}
+        )
+
+        self.assertEqual(co.number, 'CHG0000001')
+        mock_time.sleep.assert_called_once_with(2)
+        self.assertEqual(fake_resource.create.call_count, 2)
+        # The same sys_id, generated locally, is sent by both attempts, and is looked up before retrying.
+        sys_id = fake_resource.create.call_args[1]['payload']['sys_id']
+        fake_resource.get.assert_called_once_with(
+            query={'sys_id': sys_id},
+            limit=1,
+            fields=list(ChangeRequestHandler.RESPONSE_FIELDS),
+            exclude_reference_link=True
+        )
+        self.assertEqual(self.change_request_handler.retries, {'create': 1})
+        self.assertEqual(self.change_request_handler.round_trips, {'create': 3})
+
+    @mock.patch('django_snow.helpers.retry.time')
+    def test_create_change_requests_retry_ignores_correlation_id(self, mock_time, mock_pysnow):
+        created = {}
+        failed = []
+
+        def create(payload):
+            if payload['short_description'] == 'Second' and not failed:
+                failed.append(payload)
+                raise make_http_error(503)
+            record = dict(payload, number='CHG000000%d' % (len(created) + 1), state='1')
+            created[payload['sys_id']] = record
+            return record
+
+        fake_resource = mock.MagicMock()
+        fake_resource.create.side_effect = create
+        fake_resource.get.side_effect = lambda query, **kwargs: mock.Mock(
+            all=mock.Mock(return_value=[created[query['sys_id']]] if query.get('sys_id') in created else [])
+        )
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+        group = uuid.uuid4().hex
+
+        # A correlation_id shared by the change requests of a deploy is not mistaken for the key of a retry
+        results = self.change_request_handler.create_change_requests([
+            {
+                'title': title, 'description': 'Description',
+                'payload': {'correlation_id': 'deploy-42', 'assignment_group': group},
+            }
+            for title in ('First', 'Second')
+        ])
+
+        self.assertEqual([result.error for result in results], [None, None])
+        self.assertEqual([result.change_request.title for result in results], ['First', 'Second'])
+        self.assertEqual(ChangeRequest.objects.count(), 2)
+        self.assertEqual(fake_resource.create.call_count, 3)
+        self.assertEqual({record['correlation_id'] for record in created.values()}, {'deploy-42'})
+
+    @mock.patch('django_snow.helpers.retry.time')
+    def test_create_change_request_retry_does_not_duplicate(self, mock_time, mock_pysnow):
+        existing = {
+            'sys_id': uuid.uuid4(),
+            'number': 'CHG0000001',
+            'short_description': 'Title',
+            'description': 'Description',
+            'assignment_group': {'value': uuid.uuid4()},
+            'state': '1'
+        }
+
+        fake_resource = mock.MagicMock()
+        fake_resource.create.side_effect = make_http_error(504)
+        fake_resource.get.return_value.all.return_value = [existing]
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        co = self.change_request_handler.create_change_request(
+            'Title', 'Description', payload={'assignment_group': 'a'}
+        )
+
+        self.assertEqual(co.sys_id, existing['sys_id'])
+        fake_resource.create.assert_called_once()
+
+    @mock.patch('django_snow.helpers.retry.time')
+    def test_update_change_request_gives_up_after_max_attempts(self, mock_time, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        fake_resource.request.side_effect = make_http_error(503)
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        with six.assertRaisesRegex(self, ChangeRequestException, 'Could not update change request due to '):
+            self.change_request_handler.update_change_request(mock.MagicMock(), {'state': '3'})
+
+        self.assertEqual(fake_resource.request.call_count, 3)
+        self.assertEqual(mock_time.sleep.call_count, 2)
+
+    @override_settings(SNOW_RETRY_MAX_ATTEMPTS=1)
+    def test_create_change_request_without_retries(self, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        fake_resource.create.side_effect = make_http_error(503)
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        with self.assertRaises(ChangeRequestException):
+            ChangeRequestHandler().create_change_request('Title', 'Description', payload={'assignment_group': 'a'})
+
+        fake_resource.create.assert_called_once_with(payload={
+            'short_description': 'Title',
+            'description': 'Description',
+            'type': 'standard',
+            'assignment_group': 'a',
+        })
+
+    @override_settings(SNOW_RATE_LIMIT=5)
+    def test_requests_are_rate_limited(self, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        fake_resource.request.return_value = {
+            'state': ChangeRequest.TICKET_STATE_COMPLETE,
+            'short_description': 'Short Description',
+            'description': 'Long Description',
+            'assignment_group': {'value': uuid.uuid4()}
+        }
+        fake_resource.get.return_value.one.return_value = {'sys_id': 'bar'}
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        change_request_handler = ChangeRequestHandler()
+        self.assertIs(change_request_handler.rate_limiter, get_rate_limiter('snow_user'))
+
+        with mock.patch.object(change_request_handler.rate_limiter, 'acquire') as mock_acquire:
+            change_request_handler.get_snow_group_guid('foo')
+            change_request_handler.update_change_request(mock.MagicMock(), {'state': '3'})
+        self.assertEqual(mock_acquire.call_count, 2)
+
     @mock.patch('django_snow.helpers.snow_request_handler.ChangeRequestHandler.update_change_request')
     def test_close_change_request(self, mock_update_request, mock_pysnow):
         fake_change_order = mock.MagicMock()
@@ -205,17 +622,268 @@ class TestChangeRequestHandler(TestCase):
             'assignment_group': {'value': uuid.uuid4()}
         }
 
-        fake_resource.update.return_value = retval
+        fake_resource.request.return_value = retval
         self.mock_pysnow_client.resource.return_value = fake_resource
         mock_pysnow.Client.return_value = self.mock_pysnow_client
 
-        ret_val = self.change_request_handler.update_change_request(fake_change_order, payload='{"foo": "bar"}')
+        ret_val = self.change_request_handler.update_change_request(fake_change_order, payload={'foo': 'bar'})
+        fake_resource.request.assert_called_once_with(
+            'PATCH', path_append=fake_change_order.sys_id.hex, data='{"foo": "bar"}'
+        )
+        self.assertFalse(fake_resource.update.called)
+        self.assertEqual(self.change_request_handler.round_trips['update'], 1)
         self.assertEqual(fake_change_order.state, ChangeRequest.TICKET_STATE_COMPLETE)
         self.assertEqual(fake_change_order.title, retval['short_description'])
         self.assertEqual(fake_change_order.description, retval['description'])
         self.assertEqual(fake_change_order.assignment_group_guid, retval['assignment_group']['value'])
         self.assertEqual(ret_val, retval)
 
+    def test_response_projection(self, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        # The assignment group is returned by value when the reference links are excluded
+        fake_resource.request.return_value = {
+            'state': ChangeRequest.TICKET_STATE_COMPLETE,
+            'short_description': 'Short Description',
+            'description': 'Long Description',
+            'assignment_group': uuid.uuid4().hex,
+        }
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+        fake_change_order = mock.MagicMock()
+
+        self.change_request_handler.update_change_request(fake_change_order, payload={'foo': 'bar'})
+
+        self.assertEqual(fake_resource.parameters.fields, [
+            'sys_id', 'number', 'short_description', 'description', 'assignment_group', 'state'
+        ])
+        self.assertTrue(fake_resource.parameters.exclude_reference_link)
+        self.assertEqual(
+            fake_change_order.assignment_group_guid.hex, fake_resource.request.return_value['assignment_group']
+        )
+
+    def test_response_projection_settings(self, mock_pysnow):
+        with override_settings(SNOW_RESPONSE_FIELDS=['state', 'u_custom'], SNOW_EXCLUDE_REFERENCE_LINK=False):
+            handler = ChangeRequestHandler()
+        self.assertEqual(handler.snow_response_fields, list(ChangeRequestHandler.RESPONSE_FIELDS) + ['u_custom'])
+        self.assertEqual(handler._get_response_params(), {
+            'sysparm_fields': 'sys_id,number,short_description,description,assignment_group,state,u_custom'
+        })
+
+        with override_settings(SNOW_RESPONSE_FIELDS=None):
+            handler = ChangeRequestHandler()
+        self.assertIsNone(handler.snow_response_fields)
+        self.assertEqual(handler._get_response_params(), {'sysparm_exclude_reference_link': 'true'})
+
+    def test_round_trips(self, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        fake_resource.create.return_value = {
+            'sys_id': uuid.uuid4(),
+            'number': 'CHG0000001',
+            'short_description': 'Title',
+            'description': 'Description',
+            'assignment_group': {'value': uuid.uuid4()},
+            'state': ChangeRequest.TICKET_STATE_OPEN
+        }
+        fake_resource.request.side_effect = lambda method, path_append, data: dict(
+            fake_resource.create.return_value, **json.loads(data)
+        )
+        fake_response = mock.MagicMock()
+        fake_response.one.return_value = {'sys_id': 'bar'}
+        fake_resource.get.return_value = fake_response
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        change_request = self.change_request_handler.create_change_request('Title', 'Description')
+        self.change_request_handler.update_change_request(change_request, {'description': 'New description'})
+        self.change_request_handler.close_change_request(change_request)
+
+        self.assertEqual(
+            self.change_request_handler.round_trips, {'group_lookup': 1, 'create': 1, 'update': 2}
+        )
+
+    def test_update_change_request_skips_unchanged_values(self, mock_pysnow):
+        group_guid = uuid.uuid4()
+        change_request = ChangeRequest.objects.create(
+            sys_id=uuid.uuid4(),
+            number='CHG0000001',
+            title='Title',
+            description='Description',
+            assignment_group_guid=group_guid,
+            state=ChangeRequest.TICKET_STATE_OPEN
+        )
+        change_request = ChangeRequest.objects.get(pk=change_request.pk)
+        fake_resource = mock.MagicMock()
+        fake_resource.request.return_value = {
+            'short_description': 'Title',
+            'description': 'Description',
+            'assignment_group': group_guid.hex,
+            'state': ChangeRequest.TICKET_STATE_IN_PROGRESS,
+        }
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        # Nothing changed
+        with self.assertNumQueries(0):
+            result = self.change_request_handler.update_change_request(change_request, {
+                'short_description': 'Title',
+                'description': 'Description',
+                'assignment_group': group_guid.hex,
+                'state': ChangeRequest.TICKET_STATE_OPEN,
+            })
+        self.assertIsNone(result)
+        self.assertFalse(fake_resource.request.called)
+
+        # Only the changed values are sent, and saved
+        with CaptureQueriesContext(connection) as queries:
+            self.change_request_handler.update_change_request(change_request, {
+                'description': 'Description',
+                'state': ChangeRequest.TICKET_STATE_IN_PROGRESS,
+                'work_notes': 'Started',
+            })
+        fake_resource.request.assert_called_once_with(
+            'PATCH', path_append=change_request.sys_id.hex, data=json.dumps({'state': '2', 'work_notes': 'Started'})
+        )
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"state"', queries[0]['sql'])
+        self.assertNotIn('"description"', queries[0]['sql'])
+        self.assertEqual(ChangeRequest.objects.get().state, ChangeRequest.TICKET_STATE_IN_PROGRESS)
+
+    def test_close_change_request_already_closed(self, mock_pysnow):
+        closed_time = timezone.now()
+        change_request = ChangeRequest.objects.create(
+            sys_id=uuid.uuid4(),
+            number='CHG0000001',
+            title='Title',
+            description='Description',
+            assignment_group_guid=uuid.uuid4(),
+            state=ChangeRequest.TICKET_STATE_COMPLETE,
+            closed_time=closed_time
+        )
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        self.change_request_handler.close_change_request(change_request)
+
+        self.assertFalse(self.mock_pysnow_client.resource.called)
+        self.assertEqual(change_request.closed_time, closed_time)
+
+    def make_snow_record(self, **values):
+        record = {
+            'sys_id': uuid.uuid4().hex,
+            'number': 'CHG0000001',
+            'short_description': 'Title',
+            'description': 'Description',
+            'assignment_group': uuid.uuid4().hex,
+            'state': ChangeRequest.TICKET_STATE_OPEN,
+            'closed_at': '',
+        }
+        record.update(values)
+        return record
+
+    def save_change_request(self, record, **values):
+        change_request = ChangeRequest(
+            sys_id=uuid.UUID(record['sys_id']),
+            number=record['number'],
+            title='Old title',
+            description=record['description'],
+            assignment_group_guid=record['assignment_group'],
+            state=ChangeRequest.TICKET_STATE_OPEN,
+        )
+        for name, value in values.items():
+            setattr(change_request, name, value)
+        change_request.save()
+        return change_request
+
+    def test_get_change_request_fresh(self, mock_pysnow):
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+        change_request = self.save_change_request(self.make_snow_record(), synced_time=timezone.now())
+
+        with self.assertNumQueries(2):
+            self.assertEqual(self.change_request_handler.get_change_request('CHG0000001'), change_request)
+            self.assertEqual(
+                self.change_request_handler.get_change_request(change_request.sys_id, max_age=60), change_request
+            )
+
+        self.assertFalse(self.mock_pysnow_client.resource.called)
+
+    def test_get_change_request_stale(self, mock_pysnow):
+        record = self.make_snow_record(state=ChangeRequest.TICKET_STATE_COMPLETE, closed_at='2018-01-02 00:00:00')
+        self.save_change_request(record, synced_time=timezone.now())
+        fake_resource = mock.MagicMock()
+        fake_resource.get.return_value.all.return_value = iter([record])
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        change_request = self.change_request_handler.get_change_request(record['sys_id'], max_age=0)
+
+        fake_resource.get.assert_called_once_with(
+            query='sys_idIN%s' % record['sys_id'],
+            fields=list(ChangeRequestHandler.RESPONSE_FIELDS) + ['closed_at'],
+            limit=1,
+            exclude_reference_link=True,
+            suppress_pagination_header=True
+        )
+        self.assertEqual(self.change_request_handler.round_trips, {'get': 1})
+        for change_request in (change_request, ChangeRequest.objects.get()):
+            self.assertEqual(change_request.title, 'Title')
+            self.assertEqual(change_request.state, ChangeRequest.TICKET_STATE_COMPLETE)
+            self.assertEqual(
+                change_request.closed_time, self.change_request_handler._parse_datetime('2018-01-02 00:00:00')
+            )
+        self.assertEqual(change_request.get_dirty_fields(), [])
+
+    def test_get_change_requests(self, mock_pysnow):
+        fresh = self.save_change_request(self.make_snow_record(number='CHG0000001'), synced_time=timezone.now())
+        stale_record = self.make_snow_record(number='CHG0000002')
+        self.save_change_request(stale_record)
+        new_record = self.make_snow_record(number='CHG0000003')
+        deleted_sys_id = uuid.uuid4()
+        fake_resource = mock.MagicMock()
+        fake_resource.get.return_value.all.return_value = iter([stale_record, new_record])
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        change_requests = self.change_request_handler.get_change_requests([
+            'CHG0000001', stale_record['sys_id'], deleted_sys_id, 'CHG0000003'
+        ])
+
+        self.assertEqual(set(change_requests), {'CHG0000001', stale_record['sys_id'], 'CHG0000003'})
+        self.assertEqual(change_requests['CHG0000001'], fresh)
+        self.assertEqual(change_requests[stale_record['sys_id']].title, 'Title')
+        self.assertEqual(change_requests['CHG0000003'].sys_id.hex, new_record['sys_id'])
+        self.assertEqual(ChangeRequest.objects.count(), 3)
+        self.assertEqual(ChangeRequest.objects.filter(synced_time__isnull=False).count(), 3)
+        fake_resource.get.assert_called_once_with(
+            query='sys_idIN%s^ORnumberINCHG0000003' % ','.join(sorted([stale_record['sys_id'], deleted_sys_id.hex])),
+            fields=mock.ANY,
+            limit=3,
+            exclude_reference_link=True,
+            suppress_pagination_header=True
+        )
+
+    def test_get_change_requests_without_group(self, mock_pysnow):
+        no_group = self.make_snow_record(number='CHG0000001', assignment_group='')
+        invalid = self.make_snow_record(number='CHG0000002', closed_at='yesterday')
+        fake_resource = mock.MagicMock()
+        fake_resource.get.return_value.all.return_value = iter([no_group, invalid])
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        change_requests = self.change_request_handler.get_change_requests(['CHG0000001', 'CHG0000002'])
+
+        # SNow returns no group as an empty string, while an invalid record is left out alone
+        self.assertEqual(list(change_requests), ['CHG0000001'])
+        self.assertIsNone(ChangeRequest.objects.get(number='CHG0000001').assignment_group_guid)
+        self.assertFalse(ChangeRequest.objects.filter(number='CHG0000002').exists())
+
+    def test_get_change_request_does_not_exist(self, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        fake_resource.get.return_value.all.return_value = iter([])
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        with self.assertRaises(ChangeRequest.DoesNotExist):
+            self.change_request_handler.get_change_request('CHG0000001')
+
     def test_update_change_request_raises_exception_for_http_error(self, mock_pysnow):
         fake_resource = mock.MagicMock()
         fake_change_order = mock.MagicMock()
@@ -224,24 +892,24 @@ class TestChangeRequestHandler(TestCase):
         fake_exception.response = mock.MagicMock()
         fake_exception.response.text.return_value = 'Foobar'
 
-        fake_resource.update.side_effect = fake_exception
+        fake_resource.request.side_effect = fake_exception
 
         self.mock_pysnow_client.resource.return_value = fake_resource
         mock_pysnow.Client.return_value = self.mock_pysnow_client
 
         with six.assertRaisesRegex(self, ChangeRequestException, 'Could not update change request due to '):
-            self.change_request_handler.update_change_request(fake_change_order, payload='{"foo": "bar"}')
+            self.change_request_handler.update_change_request(fake_change_order, payload={'foo': 'bar'})
 
     def test_update_change_request_raises_exception_for_error_in_result(self, mock_pysnow):
         fake_resource = mock.MagicMock()
         fake_change_order = mock.MagicMock()
 
-        fake_resource.update.return_value = {'error': '3'}
+        fake_resource.request.return_value = {'error': '3'}
         self.mock_pysnow_client.resource.return_value = fake_resource
         mock_pysnow.Client.return_value = self.mock_pysnow_client
 
         with six.assertRaisesRegex(self, ChangeRequestException, 'Could not update change request due to '):
-            self.change_request_handler.update_change_request(fake_change_order, payload='{"foo": "bar"}')
+            self.change_request_handler.update_change_request(fake_change_order, payload={'foo': 'bar'})
 
     def test_get_snow_group_guid_cached_result(self, mock_pysnow):
         fake_resource = mock.MagicMock()
@@ -268,6 +936,54 @@ class TestChangeRequestHandler(TestCase):
 
         self.assertEqual(self.change_request_handler.get_snow_group_guid('hello'), 'yo')
 
+    def test_prefetch_group_guids(self, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        fake_response = mock.MagicMock()
+        fake_response.all.return_value = [{'sys_id': 'guid1', 'name': 'foo'}, {'sys_id': 'guid2', 'name': 'bar'}]
+        fake_resource.get.return_value = fake_response
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+        self.change_request_handler.group_guid_cache.set('baz', 'guid3')
+
+        guids = self.change_request_handler.prefetch_group_guids(['foo', 'bar', 'baz', 'missing'])
+
+        self.assertEqual(guids, {'foo': 'guid1', 'bar': 'guid2', 'baz': 'guid3'})
+        fake_resource.get.assert_called_once_with(query='nameINbar,foo,missing', fields=['sys_id', 'name'])
+
+        # The prefetched groups are served from the cache
+        self.assertEqual(self.change_request_handler.get_snow_group_guid('foo'), 'guid1')
+        self.assertEqual(fake_resource.get.call_count, 1)
+
+    @mock.patch.object(ChangeRequestHandler, 'GROUP_PREFETCH_CHUNK_SIZE', 2)
+    def test_prefetch_group_guids_in_chunks(self, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        fake_resource.get.return_value.all.return_value = []
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        self.change_request_handler.prefetch_group_guids(['a', 'b', 'c'])
+
+        self.assertEqual(
+            [call[1]['query'] for call in fake_resource.get.call_args_list], ['nameINa,b', 'nameINc']
+        )
+
+    def test_prefetch_group_guids_with_comma_in_name(self, mock_pysnow):
+        fake_resource = mock.MagicMock()
+        fake_resource.get.return_value.one.return_value = {'sys_id': 'guid'}
+        self.mock_pysnow_client.resource.return_value = fake_resource
+        mock_pysnow.Client.return_value = self.mock_pysnow_client
+
+        guids = self.change_request_handler.prefetch_group_guids(['foo, bar'])
+
+        self.assertEqual(guids, {'foo, bar': 'guid'})
+        fake_resource.get.assert_called_once_with(query={'name': 'foo, bar'})
+
+    def test_prefetch_group_guids_all_cached(self, mock_pysnow):
+        self.change_request_handler.group_guid_cache.set('foo', 'guid')
+
+        self.assertEqual(self.change_request_handler.prefetch_group_guids(['foo']), {'foo': 'guid'})
+        self.assertFalse(mock_pysnow.Client.called)
+
     def test_clear_snow_group_guid_cache(self, mock_pysnow):
         fake_resource = mock.MagicMock()
         fake_response = mock.MagicMock()
@@ -284,3 +1000,2053 @@ class TestChangeRequestHandler(TestCase):
         self.change_request_handler.get_snow_group_guid('hello')
         self.change_request_handler.get_snow_group_guid('hello')
         self.assertEqual(fake_resource.get.call_count, 2)
+
+
+class TestGroupGuidCache(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = GroupGuidCache()
+
+    def test_get_or_load(self):
+        loader = mock.MagicMock(return_value='guid')
+
+        self.assertEqual(self.cache.get_or_load('foo', loader), 'guid')
+        self.assertEqual(self.cache.get_or_load('foo', loader), 'guid')
+        loader.assert_called_once_with('foo')
+
+    @override_settings(SNOW_GROUP_GUID_CACHE_TTL=60)
+    @mock.patch('django_snow.helpers.group_cache.time')
+    def test_entries_expire(self, mock_time):
+        mock_time.monotonic.return_value = 1000
+        self.cache.set('foo', 'guid')
+
+        mock_time.monotonic.return_value = 1059
+        self.assertEqual(self.cache.get('foo'), 'guid')
+
+        mock_time.monotonic.return_value = 1060
+        self.assertIsNone(self.cache.get('foo'))
+
+    @override_settings(SNOW_GROUP_GUID_CACHE_TTL=None)
+    @mock.patch('django_snow.helpers.group_cache.time')
+    def test_entries_without_ttl_never_expire(self, mock_time):
+        mock_time.monotonic.return_value = 1000
+        self.cache.set('foo', 'guid')
+
+        mock_time.monotonic.return_value = 10 ** 9
+        self.assertEqual(self.cache.get('foo'), 'guid')
+
+    @override_settings(SNOW_GROUP_GUID_CACHE_MAXSIZE=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.set('foo', 'guid1')
+        self.cache.set('bar', 'guid2')
+        self.cache.get('foo')
+        self.cache.set('baz', 'guid3')
+
+        self.assertEqual(self.cache.get('foo'), 'guid1')
+        self.assertIsNone(self.cache.get('bar'))
+        self.assertEqual(self.cache.get('baz'), 'guid3')
+
+    def test_concurrent_misses_are_loaded_once(self):
+        loader = mock.MagicMock()
+
+        def slow_loader(group_name):
+            time.sleep(0.05)
+            return 'guid'
+        loader.side_effect = slow_loader
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.cache.get_or_load('foo', loader))) for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(loader.call_count, 1)
+        self.assertEqual(results, ['guid'] * 5)
+
+    def test_failed_load_is_not_cached(self):
+        loader = mock.MagicMock(side_effect=[ValueError, 'guid'])
+
+        with self.assertRaises(ValueError):
+            self.cache.get_or_load('foo', loader)
+        self.assertEqual(self.cache.get_or_load('foo', loader), 'guid')
+
+    @override_settings(
+        SNOW_GROUP_GUID_CACHE='snow',
+        CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'snow': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'snow'},
+        }
+    )
+    def test_django_cache_backend(self):
+        self.cache.set('foo bar', 'guid')
+
+        # Another process sees the same entries
+        self.assertEqual(GroupGuidCache().get('foo bar'), 'guid')
+        self.assertEqual(caches['snow'].get(self.cache._make_key('foo bar')), 'guid')
+
+        self.cache.clear()
+        self.assertIsNone(GroupGuidCache().get('foo bar'))
+
+
+class TestChangeRequestDirtyFields(TestCase):
+
+    def setUp(self):
+        self.group_guid = uuid.uuid4()
+        self.change_request = ChangeRequest(
+            sys_id=uuid.uuid4(),
+            number='CHG0000001',
+            title='Title',
+            description='Description',
+            assignment_group_guid=self.group_guid,
+            state=ChangeRequest.TICKET_STATE_OPEN
+        )
+
+    def test_unsaved(self):
+        self.assertIsNone(self.change_request.get_dirty_fields())
+
+    def test_saved(self):
+        self.change_request.save()
+        self.assertEqual(self.change_request.get_dirty_fields(), [])
+
+        self.change_request.title = 'New title'
+        self.change_request.state = ChangeRequest.TICKET_STATE_COMPLETE
+        # The same GUID, as a string
+        self.change_request.assignment_group_guid = self.group_guid.hex
+        self.assertEqual(self.change_request.get_dirty_fields(), ['title', 'state'])
+
+        self.change_request.save(update_fields=['title'])
+        self.assertEqual(self.change_request.get_dirty_fields(), ['state'])
+
+    def test_loaded(self):
+        self.change_request.save()
+        change_request = ChangeRequest.objects.get()
+        self.assertEqual(change_request.get_dirty_fields(), [])
+
+        change_request.description = 'New description'
+        self.assertEqual(change_request.get_dirty_fields(), ['description'])
+        change_request.refresh_from_db()
+        self.assertEqual(change_request.get_dirty_fields(), [])
+
+        # The deferred fields are not loaded to be compared
+        change_request = ChangeRequest.objects.only('state').get()
+        with self.assertNumQueries(0):
+            self.assertEqual(change_request.get_dirty_fields(), [])
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'The query plans are those of SQLite')
+class TestChangeRequestQuerySet(TestCase):
+
+    def setUp(self):
+        self.group_guid = uuid.uuid4()
+        self.change_requests = [
+            ChangeRequest.objects.create(
+                sys_id=uuid.uuid4(),
+                number='CHG%07d' % index,
+                title='Title',
+                description='Description',
+                assignment_group_guid=self.group_guid if index % 2 else uuid.uuid4(),
+                state=state
+            )
+            for index, state in enumerate([
+                ChangeRequest.TICKET_STATE_OPEN, ChangeRequest.TICKET_STATE_IN_PROGRESS,
+                ChangeRequest.TICKET_STATE_COMPLETE, ChangeRequest.TICKET_STATE_OPEN,
+            ])
+        ]
+
+    def test_open(self):
+        self.assertEqual(
+            set(ChangeRequest.objects.open().for_group(self.group_guid)),
+            {self.change_requests[1], self.change_requests[3]}
+        )
+        self.assertEqual(ChangeRequest.objects.open().count(), 3)
+        self.assertIn('USING INDEX django_snow_cr_', ChangeRequest.objects.open().for_group(self.group_guid).explain())
+        self.assertIn('USING INDEX django_snow_cr_state_idx', ChangeRequest.objects.open().explain())
+
+    def test_state(self):
+        queryset = ChangeRequest.objects.filter(state=ChangeRequest.TICKET_STATE_COMPLETE).order_by('-created_time')
+        self.assertEqual(list(queryset), [self.change_requests[2]])
+        # The state filter of the admin, with its ordering
+        self.assertIn('USING INDEX django_snow_cr_state_idx', queryset.explain())
+        self.assertNotIn('USE TEMP B-TREE', queryset.explain())
+
+    def test_for_group(self):
+        self.assertEqual(ChangeRequest.objects.for_group(self.group_guid).count(), 2)
+        self.assertIn(
+            'USING INDEX django_snow_cr_group_state_idx', ChangeRequest.objects.for_group(self.group_guid).explain()
+        )
+
+    def test_by_number(self):
+        self.assertEqual(ChangeRequest.objects.by_number('CHG0000002').get(), self.change_requests[2])
+        self.assertIn('USING INDEX django_snow_cr_number_idx', ChangeRequest.objects.by_number('CHG0000002').explain())
+
+    def test_closed_time(self):
+        queryset = ChangeRequest.objects.filter(closed_time__lt=timezone.now())
+        self.assertIn('USING INDEX django_snow_cr_closed_idx', queryset.explain())
+
+
+class TestServiceNowAppConfig(SimpleTestCase):
+
+    @override_settings(SNOW_PREFETCH_ASSIGNMENT_GROUPS=['foo', 'bar'])
+    @mock.patch('django_snow.helpers.ChangeRequestHandler')
+    def test_ready_prefetches_groups(self, mock_handler):
+        apps.get_app_config('django_snow').ready()
+        mock_handler.return_value.prefetch_group_guids.assert_called_once_with(['foo', 'bar'])
+
+    @override_settings(SNOW_PREFETCH_ASSIGNMENT_GROUPS=['foo'])
+    @mock.patch('django_snow.helpers.ChangeRequestHandler')
+    def test_ready_ignores_prefetch_errors(self, mock_handler):
+        mock_handler.return_value.prefetch_group_guids.side_effect = ChangeRequestException
+        apps.get_app_config('django_snow').ready()
+
+    @mock.patch('django_snow.helpers.ChangeRequestHandler')
+    def test_ready_without_groups(self, mock_handler):
+        apps.get_app_config('django_snow').ready()
+        self.assertFalse(mock_handler.called)
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+    SNOW_ASSIGNMENT_GROUP='assignment_group',
+    SNOW_RETRY_MAX_ATTEMPTS=1,
+)
+@unittest.skipIf(httpx is None, 'The async extra is not installed')
+class TestAsyncChangeRequestHandler(TestCase):
+
+    def setUp(self):
+        self.requests = []
+        self.responses = []
+
+        def handle(request):
+            self.requests.append(request)
+            return self.responses.pop(0)
+
+        self.client = httpx.AsyncClient(
+            transport=httpx.MockTransport(handle), base_url='https://devgodaddy.service-now.com/api/now'
+        )
+        self.change_request_handler = AsyncChangeRequestHandler(client=self.client)
+
+    def tearDown(self):
+        self.change_request_handler.clear_group_guid_cache()
+
+    def make_record(self, **kwargs):
+        record = {
+            'sys_id': uuid.uuid4().hex,
+            'number': 'CHG0000001',
+            'short_description': 'Title',
+            'description': 'Description',
+            'assignment_group': {'value': uuid.uuid4().hex},
+            'state': ChangeRequest.TICKET_STATE_OPEN,
+        }
+        record.update(kwargs)
+        return record
+
+    def test_circuit_breaker(self):
+        self.change_request_handler.circuit_breaker = CircuitBreaker(threshold=2)
+        self.responses = [httpx.Response(503, json={'error': {'message': 'Unavailable'}})]
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            async_to_sync(self.change_request_handler.get_snow_group_guid)('assignment_group')
+        with mock.patch.object(self.client, 'request', side_effect=httpx.ConnectError('Refused')):
+            with self.assertRaises(httpx.ConnectError):
+                async_to_sync(self.change_request_handler.update_change_request)(
+                    ChangeRequest(sys_id=uuid.uuid4(), state=ChangeRequest.TICKET_STATE_OPEN), {'description': 'New'}
+                )
+        with self.assertRaises(CircuitOpenException):
+            async_to_sync(self.change_request_handler.get_snow_group_guid)('assignment_group')
+        self.assertEqual(len(self.requests), 1)
+
+    def test_metrics_status(self):
+        client = mock.MagicMock()
+        self.change_request_handler.metrics = StatsdMetrics(client=client)
+        self.responses = [
+            httpx.Response(200, json={'result': [{'sys_id': 'bar'}]}),
+            httpx.Response(201, json={'result': self.make_record()}),
+        ]
+
+        async_to_sync(self.change_request_handler.create_change_request)('Title', 'Description')
+        with mock.patch.object(self.client, 'request', side_effect=httpx.ConnectError('Refused')):
+            with self.assertRaises(httpx.ConnectError):
+                async_to_sync(self.change_request_handler.update_change_request)(
+                    ChangeRequest(sys_id=uuid.uuid4(), state=ChangeRequest.TICKET_STATE_OPEN), {'description': 'New'}
+                )
+
+        responses = [call[0][0] for call in client.incr.call_args_list if call[0][0].startswith('response.')]
+        self.assertEqual(
+            responses, ['response.group_lookup.200', 'response.create.201', 'response.update.ConnectError']
+        )
+
+    def test_circuit_breaker_cancelled_probe(self):
+        self.change_request_handler.circuit_breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+        self.responses = [httpx.Response(503, json={'error': {'message': 'Unavailable'}})]
+        with self.assertRaises(httpx.HTTPStatusError):
+            async_to_sync(self.change_request_handler.get_snow_group_guid)('assignment_group')
+        time.sleep(0.06)
+
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(10)
+
+        async def lookup_timing_out():
+            with mock.patch.object(self.client, 'request', side_effect=hang):
+                await asyncio.wait_for(self.change_request_handler.get_snow_group_guid('assignment_group'), 0.01)
+
+        # The cancelled probe counts as failed, opening the circuit again rather than leaving it half-open
+        after_request = CircuitBreaker.after_request
+        with mock.patch.object(CircuitBreaker, 'after_request', autospec=True, side_effect=after_request) as mocked:
+            with self.assertRaises(asyncio.TimeoutError):
+                async_to_sync(lookup_timing_out)()
+        mocked.assert_called_once_with(self.change_request_handler.circuit_breaker, True, True)
+        with self.assertRaises(CircuitOpenException):
+            async_to_sync(self.change_request_handler.get_snow_group_guid)('assignment_group')
+
+        time.sleep(0.06)
+        self.responses = [httpx.Response(200, json={'result': [{'sys_id': 'bar'}]})]
+        self.assertEqual(async_to_sync(self.change_request_handler.get_snow_group_guid)('assignment_group'), 'bar')
+
+    def test_create_change_request(self):
+        record = self.make_record()
+        self.responses = [
+            httpx.Response(200, json={'result': [{'sys_id': 'bar'}]}),
+            httpx.Response(201, json={'result': record}),
+        ]
+
+        co = async_to_sync(self.change_request_handler.create_change_request)('Title', 'Description')
+
+        group_request, create_request = self.requests
+        self.assertEqual(group_request.url.path, '/api/now/table/sys_user_group')
+        self.assertEqual(group_request.url.params['sysparm_query'], 'name=assignment_group')
+        self.assertEqual(create_request.method, 'POST')
+        self.assertEqual(create_request.url.path, '/api/now/table/change_request')
+        self.assertEqual(
+            create_request.url.params['sysparm_fields'],
+            'sys_id,number,short_description,description,assignment_group,state'
+        )
+        self.assertEqual(create_request.url.params['sysparm_exclude_reference_link'], 'true')
+        self.assertEqual(json.loads(create_request.content), {
+            'short_description': 'Title',
+            'description': 'Description',
+            'type': 'standard',
+            'assignment_group': 'bar',
+        })
+        self.assertEqual(ChangeRequest.objects.get().pk, co.pk)
+        self.assertEqual(co.sys_id.hex, record['sys_id'])
+        self.assertEqual(co.number, 'CHG0000001')
+
+        # The group is served from the cache the second time
+        self.responses = [httpx.Response(201, json={'result': self.make_record()})]
+        async_to_sync(self.change_request_handler.create_change_request)('Title', 'Description')
+        self.assertEqual(self.change_request_handler.round_trips, {'group_lookup': 1, 'create': 2})
+
+    def test_create_change_request_retries_transient_errors(self):
+        self.change_request_handler.retry_policy = RetryPolicy(max_attempts=3, backoff=0)
+        record = self.make_record()
+        self.responses = [
+            httpx.Response(200, json={'result': [{'sys_id': 'bar'}]}),
+            httpx.Response(503, json={'error': {'message': 'Unavailable'}}),
+            httpx.Response(200, json={'result': []}),
+            httpx.Response(201, json={'result': record}),
+        ]
+
+        co = async_to_sync(self.change_request_handler.create_change_request)('Title', 'Description')
+
+        _, first, lookup, second = self.requests
+        # The sys_id generated locally is looked up before retrying, then sent again
+        sys_id = json.loads(first.content)['sys_id']
+        self.assertEqual(lookup.url.params['sysparm_query'], 'sys_id=%s' % sys_id)
+        self.assertEqual(json.loads(second.content)['sys_id'], sys_id)
+        self.assertEqual(co.sys_id.hex, record['sys_id'])
+        self.assertEqual(self.change_request_handler.retries, {'create': 1})
+
+    def test_create_change_request_retry_does_not_duplicate(self):
+        self.change_request_handler.retry_policy = RetryPolicy(max_attempts=3, backoff=0)
+        record = self.make_record()
+        self.responses = [
+            httpx.Response(200, json={'result': [{'sys_id': 'bar'}]}),
+            httpx.Response(504, text='Gateway Timeout'),
+            httpx.Response(200, json={'result': [record]}),
+        ]
+
+        co = async_to_sync(self.change_request_handler.create_change_request)('Title', 'Description')
+
+        self.assertEqual(co.sys_id.hex, record['sys_id'])
+        self.assertEqual([request.method for request in self.requests], ['GET', 'POST', 'GET'])
+        self.assertEqual(ChangeRequest.objects.count(), 1)
+
+    def test_create_change_request_raises_exception_for_http_error(self):
+        self.responses = [httpx.Response(500, text='Foobar')]
+
+        with six.assertRaisesRegex(self, ChangeRequestException, 'Could not create change request due to Foobar'):
+            async_to_sync(self.change_request_handler.create_change_request)(
+                'Title', 'Description', payload={'assignment_group': 'bar'}
+            )
+
+    def test_create_change_request_raises_exception_when_error_in_result(self):
+        self.responses = [httpx.Response(200, json={'result': {'error': 'some error message'}})]
+
+        with six.assertRaisesRegex(self, ChangeRequestException, 'Could not create change request due to some err'):
+            async_to_sync(self.change_request_handler.create_change_request)(
+                'Title', 'Description', payload={'assignment_group': 'bar'}
+            )
+        self.assertFalse(ChangeRequest.objects.exists())
+
+    def test_update_and_close_change_request(self):
+        record = self.make_record()
+        change_request = self.change_request_handler._build_change_request(record)
+        change_request.save()
+        self.responses = [
+            httpx.Response(200, json={'result': dict(record, description='Updated')}),
+            httpx.Response(200, json={'result': dict(record, state=ChangeRequest.TICKET_STATE_COMPLETE)}),
+        ]
+
+        async_to_sync(self.change_request_handler.update_change_request)(change_request, {'description': 'Updated'})
+        async_to_sync(self.change_request_handler.close_change_request)(change_request)
+
+        for request in self.requests:
+            self.assertEqual(request.method, 'PATCH')
+            self.assertEqual(request.url.path, '/api/now/table/change_request/%s' % record['sys_id'])
+        self.assertEqual(json.loads(self.requests[1].content), {'state': ChangeRequest.TICKET_STATE_COMPLETE})
+
+        change_request.refresh_from_db()
+        self.assertEqual(change_request.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertIsNotNone(change_request.closed_time)
+
+    def test_update_change_request_raises_exception_for_http_error(self):
+        change_request = self.change_request_handler._build_change_request(self.make_record())
+        self.responses = [httpx.Response(404, text='Not found')]
+
+        with six.assertRaisesRegex(self, ChangeRequestException, 'Could not update change request due to Not found'):
+            async_to_sync(self.change_request_handler.update_change_request)(change_request, {'state': '2'})
+
+    def test_get_snow_group_guid_not_found(self):
+        self.responses = [httpx.Response(200, json={'result': []})]
+
+        with self.assertRaises(ChangeRequestException):
+            async_to_sync(self.change_request_handler.get_snow_group_guid)('missing')
+
+    def test_aclose_does_not_close_given_client(self):
+        async_to_sync(self.change_request_handler.aclose)()
+        self.assertFalse(self.client.is_closed)
+
+    @override_settings(SNOW_TIMEOUT=(3, 10))
+    def test_client_timeout(self):
+        client = AsyncChangeRequestHandler()._get_client()
+        self.assertEqual(client.timeout, httpx.Timeout(10, connect=3))
+
+    def test_default_client(self):
+        change_request_handler = AsyncChangeRequestHandler()
+        client = change_request_handler._get_client()
+
+        self.assertEqual(str(client.base_url), 'https://devgodaddy.service-now.com/api/now/')
+        self.assertEqual(client.timeout, httpx.Timeout(60))
+        async_to_sync(change_request_handler.aclose)()
+        self.assertTrue(client.is_closed)
+
+
+class TestRetryPolicy(SimpleTestCase):
+
+    def setUp(self):
+        self.policy = RetryPolicy(max_attempts=4, backoff=1, max_backoff=5)
+
+    def test_is_retryable(self):
+        self.assertTrue(self.policy.is_retryable(make_http_error(429)))
+        self.assertTrue(self.policy.is_retryable(make_http_error(503)))
+        self.assertTrue(self.policy.is_retryable(requests.ConnectionError()))
+        self.assertTrue(self.policy.is_retryable(requests.Timeout()))
+        self.assertFalse(self.policy.is_retryable(make_http_error(400)))
+        self.assertFalse(self.policy.is_retryable(make_http_error(500)))
+        self.assertFalse(self.policy.is_retryable(ValueError()))
+
+    @mock.patch('django_snow.helpers.retry.random')
+    def test_get_delay_backs_off_exponentially(self, mock_random):
+        mock_random.uniform.side_effect = lambda low, high: high
+
+        self.assertEqual([self.policy.get_delay(attempt) for attempt in range(1, 5)], [1, 2, 4, 5])
+
+    def test_get_delay_has_jitter(self):
+        delays = [self.policy.get_delay(3) for _ in range(20)]
+        self.assertTrue(all(0 <= delay <= 4 for delay in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_get_delay_honors_retry_after(self):
+        self.assertEqual(self.policy.get_delay(1, make_http_error(429, {'Retry-After': '3'})), 3)
+        self.assertEqual(self.policy.get_delay(1, make_http_error(429, {'Retry-After': '60'})), 5)
+
+        retry_at = formatdate(time.time() + 2, usegmt=True)
+        delay = self.policy.get_delay(1, make_http_error(503, {'Retry-After': retry_at}))
+        self.assertTrue(0 < delay <= 2)
+
+    @mock.patch('django_snow.helpers.retry.time')
+    def test_call(self, mock_time):
+        request = mock.MagicMock(side_effect=[requests.Timeout(), make_http_error(502), 'result'])
+        before_retry = mock.MagicMock()
+
+        self.assertEqual(self.policy.call(request, before_retry), 'result')
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual([call[0][0] for call in before_retry.call_args_list], [1, 2])
+        self.assertEqual(mock_time.sleep.call_count, 2)
+
+    @mock.patch('django_snow.helpers.retry.time')
+    def test_call_does_not_retry_other_errors(self, mock_time):
+        request = mock.MagicMock(side_effect=make_http_error(404))
+
+        with self.assertRaises(HTTPError):
+            self.policy.call(request)
+        request.assert_called_once_with()
+        self.assertFalse(mock_time.sleep.called)
+
+
+@mock.patch('django_snow.helpers.rate_limit.time')
+class TestRateLimit(SimpleTestCase):
+
+    def test_token_bucket(self, mock_time):
+        mock_time.monotonic.return_value = 100
+        bucket = TokenBucket(rate=2, burst=3)
+
+        # The burst goes through straight away
+        for _ in range(3):
+            bucket.acquire()
+        self.assertFalse(mock_time.sleep.called)
+
+        # Then the requests are spaced by 1 / rate
+        bucket.acquire()
+        mock_time.sleep.assert_called_once_with(0.5)
+        bucket.acquire()
+        mock_time.sleep.assert_called_with(1.0)
+
+        # The bucket refills over time, up to the burst
+        mock_time.sleep.reset_mock()
+        mock_time.monotonic.return_value = 200
+        for _ in range(3):
+            bucket.acquire()
+        self.assertFalse(mock_time.sleep.called)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'rate_limit': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'rate_limit'},
+    })
+    def test_cache_fixed_window_limiter(self, mock_time):
+        clock = [1000.0]
+        mock_time.time.side_effect = lambda: clock[0]
+        mock_time.sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+
+        # Two processes sharing the same limit of 2 requests per second
+        limiters = [CacheFixedWindowLimiter(rate=2, cache_alias='rate_limit', name='snow_user') for _ in range(2)]
+        limiters[0].acquire()
+        limiters[1].acquire()
+        self.assertFalse(mock_time.sleep.called)
+
+        limiters[0].acquire()
+        mock_time.sleep.assert_called_once_with(1.0)
+        self.assertEqual(clock[0], 1001.0)
+
+        # Other users have their own limits
+        CacheFixedWindowLimiter(rate=2, cache_alias='rate_limit', name='other_user').acquire()
+        self.assertEqual(mock_time.sleep.call_count, 1)
+
+        # Twice the burst goes through across the end of a window and the start of the next
+        clock[0] = 1002.9
+        for _ in range(2):
+            limiters[0].acquire()
+        clock[0] = 1003.0
+        for _ in range(2):
+            limiters[1].acquire()
+        self.assertEqual(mock_time.sleep.call_count, 1)
+
+    def test_get_rate_limiter(self, mock_time):
+        self.assertIsNone(get_rate_limiter('snow_user'))
+
+        with override_settings(SNOW_RATE_LIMIT=10):
+            rate_limiter = get_rate_limiter('snow_user')
+            self.assertIsInstance(rate_limiter, TokenBucket)
+            self.assertIs(get_rate_limiter('snow_user'), rate_limiter)
+            self.assertIsNot(get_rate_limiter('other_user'), rate_limiter)
+
+        with override_settings(SNOW_RATE_LIMIT=10, SNOW_RATE_LIMIT_BURST=20, SNOW_RATE_LIMIT_CACHE='default'):
+            rate_limiter = get_rate_limiter('snow_user')
+            self.assertIsInstance(rate_limiter, CacheFixedWindowLimiter)
+            self.assertEqual(rate_limiter.window, 2)
+
+
+@mock.patch('django_snow.helpers.circuit_breaker.time')
+class TestCircuitBreaker(SimpleTestCase):
+
+    def test_circuit_breaker(self, mock_time):
+        mock_time.time.return_value = 1000.0
+        circuit_breaker = CircuitBreaker(threshold=2, cooldown=30, window=60)
+
+        # The failures of different windows do not add up, and the other outcomes are not counted
+        self.assertFalse(circuit_breaker.before_request())
+        circuit_breaker.after_request(False, True)
+        circuit_breaker.after_request(False, False)
+        mock_time.time.return_value = 1080.0
+        circuit_breaker.after_request(False, True)
+        self.assertFalse(circuit_breaker.before_request())
+
+        circuit_breaker.after_request(False, True)
+        with self.assertRaises(CircuitOpenException) as context:
+            circuit_breaker.before_request()
+        self.assertEqual(context.exception.retry_after, 30)
+        self.assertIsInstance(context.exception, ChangeRequestException)
+
+        # Once cooled down, a single request probes SNow, and opens the circuit again if it fails
+        mock_time.time.return_value = 1110.0
+        self.assertTrue(circuit_breaker.before_request())
+        with self.assertRaises(CircuitOpenException):
+            circuit_breaker.before_request()
+        circuit_breaker.after_request(True, True)
+        with self.assertRaises(CircuitOpenException):
+            circuit_breaker.before_request()
+
+        # Or closes it if it succeeds
+        mock_time.time.return_value = 1140.0
+        self.assertTrue(circuit_breaker.before_request())
+        circuit_breaker.after_request(True, False)
+        self.assertFalse(circuit_breaker.before_request())
+        circuit_breaker.after_request(False, True)
+        self.assertFalse(circuit_breaker.before_request())
+
+    def test_circuit_breaker_abandoned_probe(self, mock_time):
+        mock_time.time.return_value = 1000.0
+        circuit_breaker = CircuitBreaker(threshold=1, cooldown=30)
+        circuit_breaker.after_request(False, True)
+
+        mock_time.time.return_value = 1030.0
+        self.assertTrue(circuit_breaker.before_request())
+        mock_time.time.return_value = 1040.0
+        with self.assertRaises(CircuitOpenException) as context:
+            circuit_breaker.before_request()
+        self.assertEqual(context.exception.retry_after, 20)
+
+        # The probe was never reported, e.g. as its request was cancelled, so another request probes SNow
+        mock_time.time.return_value = 1060.0
+        self.assertTrue(circuit_breaker.before_request())
+        circuit_breaker.after_request(True, False)
+        self.assertFalse(circuit_breaker.before_request())
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'circuit_breaker': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'circuit_breaker'},
+    })
+    def test_cache_circuit_breaker(self, mock_time):
+        mock_time.time.return_value = 1000.0
+
+        # Two processes sharing the same circuit
+        circuit_breakers = [
+            CacheCircuitBreaker(threshold=2, cooldown=30, cache_alias='circuit_breaker', name='snow') for _ in range(2)
+        ]
+        circuit_breakers[0].after_request(False, True)
+        self.assertFalse(circuit_breakers[1].before_request())
+        circuit_breakers[1].after_request(False, True)
+        for circuit_breaker in circuit_breakers:
+            with self.assertRaises(CircuitOpenException):
+                circuit_breaker.before_request()
+
+        # Other instances have their own circuits
+        other = CacheCircuitBreaker(threshold=2, cache_alias='circuit_breaker', name='other')
+        self.assertFalse(other.before_request())
+
+        mock_time.time.return_value = 1030.0
+        self.assertTrue(circuit_breakers[0].before_request())
+        with self.assertRaises(CircuitOpenException):
+            circuit_breakers[1].before_request()
+        circuit_breakers[0].after_request(True, False)
+        self.assertFalse(circuit_breakers[1].before_request())
+
+    def test_get_circuit_breaker(self, mock_time):
+        self.assertIsNone(get_circuit_breaker('snow'))
+
+        with override_settings(SNOW_CIRCUIT_BREAKER_THRESHOLD=5):
+            circuit_breaker = get_circuit_breaker('snow')
+            self.assertIsInstance(circuit_breaker, CircuitBreaker)
+            self.assertEqual((circuit_breaker.cooldown, circuit_breaker.window), (30, 60))
+            self.assertIs(get_circuit_breaker('snow'), circuit_breaker)
+            self.assertIsNot(get_circuit_breaker('other'), circuit_breaker)
+
+        with override_settings(SNOW_CIRCUIT_BREAKER_THRESHOLD=5, SNOW_CIRCUIT_BREAKER_CACHE='default'):
+            self.assertIsInstance(get_circuit_breaker('snow'), CacheCircuitBreaker)
+
+    def test_is_outage(self, mock_time):
+        self.assertTrue(ChangeRequestHandler._is_outage(make_http_error(503)))
+        self.assertFalse(ChangeRequestHandler._is_outage(make_http_error(404)))
+        self.assertTrue(ChangeRequestHandler._is_outage(requests.ConnectionError()))
+        self.assertTrue(ChangeRequestHandler._is_outage(requests.Timeout()))
+        self.assertFalse(ChangeRequestHandler._is_outage(ChangeRequestException()))
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+    SNOW_ASSIGNMENT_GROUP='assignment_group'
+)
+@mock.patch('django_snow.helpers.clients.pysnow')
+class TestOutbox(TestCase):
+
+    def setUp(self):
+        self.group_guid = uuid.uuid4()
+        self.records = {}
+
+        def create(payload):
+            record = dict(payload, number='CHG%07d' % (len(self.records) + 1), state='1')
+            record['assignment_group'] = {'value': payload['assignment_group']}
+            self.records[record['sys_id']] = record
+            return record
+
+        def request(method, path_append, data):
+            self.records[path_append].update(json.loads(data))
+            return self.records[path_append]
+
+        def get(query, **kwargs):
+            response = mock.MagicMock()
+            if query.startswith('sys_id='):
+                record = self.records.get(query[len('sys_id='):])
+                response.all.return_value = [record] if record is not None else []
+            else:
+                response.all.return_value = [{'sys_id': self.group_guid.hex, 'name': 'assignment_group'}]
+            return response
+
+        self.fake_resource = mock.MagicMock()
+        self.fake_resource.create.side_effect = create
+        self.fake_resource.request.side_effect = request
+        self.fake_resource.get.side_effect = get
+        self.handler = OutboxChangeRequestHandler()
+
+    def tearDown(self):
+        self.handler.clear_group_guid_cache()
+        clear_clients()
+
+    def test_operations_are_queued(self, mock_pysnow):
+        # The savepoint and inserts of the creation, then one insert per operation
+        with self.assertNumQueries(6):
+            co = self.handler.create_change_request('Title', 'Description')
+            self.handler.update_change_request(co, {'description': 'Updated'})
+            self.handler.close_change_request(co)
+
+        self.assertFalse(mock_pysnow.Client.called)
+        co.refresh_from_db()
+        self.assertEqual(co.state, ChangeRequest.TICKET_STATE_PENDING)
+        self.assertEqual(co.number, '')
+        self.assertEqual(
+            list(co.operations.order_by('pk').values_list('operation', 'status')),
+            [('create', 'pending'), ('update', 'pending'), ('close', 'pending')]
+        )
+
+    def test_close_change_requests_are_queued(self, mock_pysnow):
+        first = self.handler.create_change_request('First', 'Description')
+        second = self.handler.create_change_request('Second', 'Description')
+
+        results = self.handler.close_change_requests([first], payload={'description': 'Done'})
+        self.handler.close_change_requests([second], with_errors=True, payload={'description': 'Failed'})
+
+        self.assertEqual(results, [ChangeRequestResult(first, first, None)])
+        self.assertFalse(mock_pysnow.Client.called)
+        self.assertEqual(
+            list(first.operations.order_by('pk').values_list('operation', flat=True)), ['create', 'update', 'close']
+        )
+        self.assertEqual(
+            list(second.operations.order_by('pk').values_list('operation', flat=True)), ['create', 'close_with_error']
+        )
+
+    def test_process_batch(self, mock_pysnow):
+        self.fake_resource.create.return_value = None
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+
+        first = self.handler.create_change_request('First', 'Description')
+        self.handler.update_change_request(first, {'description': 'Updated'})
+        self.handler.close_change_request(first)
+        second = self.handler.create_change_request('Second', 'Description')
+        self.handler.close_change_request_with_error(second, {'description': 'Failed'})
+
+        self.assertEqual(OutboxProcessor(max_workers=2).process_batch(), 5)
+
+        first.refresh_from_db()
+        self.assertEqual(first.number, self.records[first.sys_id.hex]['number'])
+        self.assertEqual(first.description, 'Updated')
+        self.assertEqual(first.assignment_group_guid, self.group_guid)
+        self.assertEqual(first.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertIsNotNone(first.closed_time)
+        second.refresh_from_db()
+        self.assertEqual(second.description, 'Failed')
+        self.assertEqual(second.state, ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS)
+
+        # The change requests are created with their local sys_id, and the group is looked up once.
+        self.assertEqual(set(self.records), {first.sys_id.hex, second.sys_id.hex})
+        self.fake_resource.get.assert_called_once_with(query='nameINassignment_group', fields=['sys_id', 'name'])
+        self.assertFalse(ChangeRequestOperation.objects.exclude(status=ChangeRequestOperation.STATUS_DONE).exists())
+        self.assertEqual(OutboxProcessor().process_batch(), 0)
+
+    def test_process_batch_failure(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        self.fake_resource.create.side_effect = make_http_error(400)
+
+        co = self.handler.create_change_request('Title', 'Description')
+        self.handler.close_change_request(co)
+        processor = OutboxProcessor(max_attempts=2)
+
+        processor.process_batch()
+        create, close = co.operations.order_by('pk')
+        self.assertEqual((create.status, create.attempts), (ChangeRequestOperation.STATUS_PENDING, 1))
+        self.assertIn('Could not create change request', create.error)
+        self.assertEqual((close.status, close.attempts), (ChangeRequestOperation.STATUS_PENDING, 0))
+        self.assertFalse(self.fake_resource.request.called)
+        self.assertAlmostEqual((create.next_attempt_time - timezone.now()).total_seconds(), 30, delta=5)
+
+        # The operation is backed off, and the close waits for it
+        self.assertEqual(processor.process_batch(), 0)
+        self.assertEqual(self.fake_resource.create.call_count, 1)
+
+        co.operations.filter(pk=create.pk).update(next_attempt_time=timezone.now())
+        processor.process_batch()
+        create.refresh_from_db()
+        self.assertEqual((create.status, create.attempts), (ChangeRequestOperation.STATUS_FAILED, 2))
+
+    def test_process_batch_when_circuit_is_open(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        co = self.handler.create_change_request('Title', 'Description', payload={'assignment_group': uuid.uuid4().hex})
+        processor = OutboxProcessor()
+        processor.handler.circuit_breaker = mock.Mock()
+        processor.handler.circuit_breaker.before_request.side_effect = CircuitOpenException(30)
+
+        processor.process_batch()
+
+        # SNow was not even tried, so the operation is retried as if it was not processed
+        create = co.operations.get()
+        self.assertEqual((create.status, create.attempts), (ChangeRequestOperation.STATUS_PENDING, 0))
+        self.assertFalse(self.fake_resource.create.called)
+        # Nor is it claimed again until SNow is tried again
+        self.assertAlmostEqual((create.next_attempt_time - timezone.now()).total_seconds(), 30, delta=5)
+        self.assertEqual(processor.process_batch(), 0)
+
+    def test_process_batch_expired_claim(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        co = self.handler.create_change_request(
+            'Title', 'Description', payload={'assignment_group': self.group_guid.hex}
+        )
+        self.handler.close_change_request(co)
+
+        # A worker claims the operations, creates the change request in SNow, then dies
+        self.assertEqual(len(OutboxProcessor(batch_size=1).claim()), 1)
+        self.fake_resource.create(dict(json.loads(co.operations.first().payload)['payload'], sys_id=co.sys_id.hex))
+        self.assertEqual(OutboxProcessor().process_batch(), 0)
+
+        co.operations.filter(status=ChangeRequestOperation.STATUS_PROCESSING).update(
+            claimed_time=timezone.now() - timedelta(seconds=301)
+        )
+        self.assertEqual(OutboxProcessor().process_batch(), 2)
+
+        # The change request is looked up by its sys_id rather than created again
+        self.assertEqual(self.fake_resource.create.call_count, 1)
+        self.assertEqual(len(self.records), 1)
+        co.refresh_from_db()
+        self.assertEqual((co.number, co.state), ('CHG0000001', ChangeRequest.TICKET_STATE_COMPLETE))
+        self.assertEqual(
+            list(co.operations.order_by('pk').values_list('status', 'attempts')),
+            [(ChangeRequestOperation.STATUS_DONE, 1), (ChangeRequestOperation.STATUS_DONE, 0)]
+        )
+
+    def test_process_batch_backoff(self, mock_pysnow):
+        processor = OutboxProcessor(max_attempts=10, backoff=10, max_backoff=60)
+        operation = ChangeRequestOperation(attempts=0)
+        now = timezone.now()
+        delays = []
+        for _ in range(6):
+            with mock.patch.object(operation, 'save'):
+                processor._fail(operation, ChangeRequestException('Failed'), now)
+            delays.append((operation.next_attempt_time - now).total_seconds())
+
+        self.assertEqual(delays, [10, 20, 40, 60, 60, 60])
+
+    def test_claim_locks_change_requests(self, mock_pysnow):
+        co = self.handler.create_change_request('Title', 'Description')
+        self.handler.close_change_request(co)
+
+        select_for_update = QuerySet.select_for_update
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', True), \
+                mock.patch.object(connection.features, 'has_select_for_update_of', True), \
+                mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=select_for_update) as lock:
+            operations = OutboxProcessor(batch_size=1).claim()
+
+        # The later operations of the change request are not claimed by the other processes meanwhile
+        lock.assert_called_once_with(mock.ANY, skip_locked=True, of=('self', 'change_request'))
+        self.assertEqual([operation.operation for operation in operations], ['create'])
+
+    def test_process_batch_when_sys_id_is_not_kept(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        create = self.fake_resource.create.side_effect
+        self.fake_resource.create.side_effect = lambda payload: create(dict(payload, sys_id=uuid.uuid4().hex))
+
+        co = self.handler.create_change_request('Title', 'Description')
+        self.handler.close_change_request(co)
+        OutboxProcessor().process_batch()
+
+        self.assertFalse(ChangeRequest.objects.filter(pk=co.pk).exists())
+        moved = ChangeRequest.objects.get()
+        self.assertEqual(moved.sys_id.hex, list(self.records)[0])
+        self.assertEqual(moved.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertEqual(moved.operations.filter(status=ChangeRequestOperation.STATUS_DONE).count(), 2)
+
+    def test_snow_outbox_command(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        self.handler.create_change_request('Title', 'Description')
+
+        out = six.StringIO()
+        call_command('snow_outbox', batch_size=1, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Processed 1 operations.')
+        self.assertEqual(ChangeRequest.objects.get().state, '1')
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+)
+@mock.patch('django_snow.helpers.clients.pysnow')
+class TestChangeRequestSynchronizer(TestCase):
+
+    def setUp(self):
+        self.group_guid = uuid.uuid4()
+        self.records = []
+        self.queries = []
+        self.fake_resource = mock.MagicMock()
+        self.fake_resource.get.side_effect = self.get
+
+    def tearDown(self):
+        clear_clients()
+
+    def add_record(self, updated_on, **values):
+        record = {
+            'sys_id': uuid.uuid4().hex,
+            'sys_updated_on': updated_on,
+            'number': 'CHG%07d' % (len(self.records) + 1),
+            'short_description': 'Title',
+            'description': 'Description',
+            'assignment_group': self.group_guid.hex,
+            'state': ChangeRequest.TICKET_STATE_OPEN,
+            'closed_at': '',
+        }
+        record.update(values)
+        self.records.append(record)
+        return record
+
+    def get(self, query, fields, limit, **kwargs):
+        self.queries.append(query)
+        return query_records(self.records, query, fields, limit)
+
+    def make_change_request(self, record):
+        return ChangeRequest.objects.create(
+            sys_id=uuid.UUID(record['sys_id']),
+            number=record['number'],
+            title='Old title',
+            description=record['description'],
+            assignment_group_guid=self.group_guid,
+            state=ChangeRequest.TICKET_STATE_OPEN,
+        )
+
+    def test_sync(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        first = self.make_change_request(self.add_record('2018-01-01 00:00:00'))
+        # More records updated in the same second than fit in a page
+        same_second = [self.make_change_request(self.add_record('2018-01-01 00:00:01')) for _ in range(3)]
+        # Not a local change request
+        self.add_record('2018-01-01 00:00:01')
+        last = self.make_change_request(self.add_record(
+            '2018-01-02 00:00:00', state=ChangeRequest.TICKET_STATE_COMPLETE, closed_at='2018-01-02 00:00:00'
+        ))
+
+        synchronizer = ChangeRequestSynchronizer(page_size=2)
+        self.assertEqual(synchronizer.sync(), 5)
+
+        for change_request in [first, last] + same_second:
+            change_request.refresh_from_db()
+            self.assertEqual(change_request.title, 'Title')
+        self.assertEqual(last.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        # In the local time zone, as USE_TZ is off
+        self.assertEqual(last.closed_time, timezone.make_naive(datetime(2018, 1, 2, tzinfo=dt_timezone.utc)))
+        self.assertEqual(self.queries[0], 'ORDERBYsys_updated_on^ORDERBYsys_id')
+        _, kwargs = self.fake_resource.get.call_args
+        self.assertEqual(kwargs['fields'], ChangeRequestSynchronizer.FIELDS)
+        self.assertTrue(kwargs['exclude_reference_link'])
+        self.assertEqual(synchronizer.handler.round_trips['sync'], len(self.queries))
+
+        watermark = SyncWatermark.objects.get(name='change_request')
+        self.assertEqual((watermark.updated_on, watermark.sys_id), ('2018-01-02 00:00:00', self.records[-1]['sys_id']))
+
+        # Only the records updated since are pulled by the next sync
+        self.queries = []
+        self.records[1]['short_description'] = 'New title'
+        self.records[1]['sys_updated_on'] = '2018-01-03 00:00:00'
+        self.assertEqual(synchronizer.sync(), 1)
+        self.assertEqual(self.queries, [
+            # The records updated in the same second as the watermark, after it
+            'sys_updated_on=2018-01-02 00:00:00^sys_id>%s^ORDERBYsys_id' % watermark.sys_id,
+            'sys_updated_on>2018-01-02 00:00:00^ORDERBYsys_updated_on^ORDERBYsys_id',
+        ])
+        same_second[0].refresh_from_db()
+        self.assertEqual(same_second[0].title, 'New title')
+
+        # Nothing is updated when nothing changed
+        self.assertEqual(synchronizer.sync(full=True), 0)
+
+    def test_sync_error(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        self.fake_resource.get.side_effect = make_http_error(400)
+
+        with self.assertRaises(ChangeRequestException):
+            ChangeRequestSynchronizer().sync()
+
+    def test_snow_sync_command(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        self.make_change_request(self.add_record('2018-01-01 00:00:00'))
+
+        out = six.StringIO()
+        call_command('snow_sync', page_size=10, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Updated 1 change requests.')
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+)
+@mock.patch('django_snow.helpers.clients.pysnow')
+class TestIterChangeRequests(TestCase):
+
+    def setUp(self):
+        self.records = [
+            {
+                'sys_id': uuid.uuid4().hex,
+                'sys_created_on': '2018-01-0%d 00:00:00' % (1 + index // 2),
+                'number': 'CHG%07d' % index,
+                'short_description': 'Title',
+                'description': 'Description',
+                'assignment_group': uuid.uuid4().hex,
+                'state': ChangeRequest.TICKET_STATE_COMPLETE if index % 3 else ChangeRequest.TICKET_STATE_OPEN,
+                'closed_at': '',
+                'u_custom': 'value',
+            }
+            for index in range(7)
+        ]
+        self.fake_resource = mock.MagicMock()
+        self.fake_resource.get.side_effect = lambda query, fields, limit, **kwargs: query_records(
+            self.records, query, fields, limit
+        )
+        self.handler = ChangeRequestHandler()
+
+    def tearDown(self):
+        clear_clients()
+
+    def test_iter_change_requests(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+
+        records = self.handler.iter_change_requests(page_size=2)
+        self.assertFalse(self.fake_resource.get.called)
+
+        expected = sorted(self.records, key=lambda record: (record['sys_created_on'], record['sys_id']))
+        self.assertEqual(list(records), expected)
+        self.assertEqual(ChangeRequest.objects.count(), 0)
+        # The full pages are followed by the rest of the records created in the same second
+        self.assertEqual(self.handler.round_trips['list'], 7)
+
+    def test_iter_change_requests_query_and_fields(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+
+        records = list(self.handler.iter_change_requests(query='state=1', fields=['number'], page_size=2))
+
+        self.assertEqual([record['number'] for record in records], ['CHG0000000', 'CHG0000003', 'CHG0000006'])
+        self.assertEqual(set(records[0]), {'number', 'sys_id', 'sys_created_on'})
+        query = self.fake_resource.get.call_args_list[0][1]['query']
+        self.assertEqual(query, 'state=1^ORDERBYsys_created_on^ORDERBYsys_id')
+
+    def test_iter_change_requests_save(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        existing = ChangeRequest.objects.create(
+            sys_id=uuid.UUID(self.records[0]['sys_id']),
+            number=self.records[0]['number'],
+            title='Old title',
+            description='Description',
+            assignment_group_guid=self.records[0]['assignment_group'],
+            state=ChangeRequest.TICKET_STATE_OPEN,
+        )
+
+        records = list(self.handler.iter_change_requests(fields=['u_custom'], page_size=3, save=True))
+
+        self.assertEqual(len(records), 7)
+        self.assertEqual(ChangeRequest.objects.count(), 7)
+        existing.refresh_from_db()
+        self.assertEqual(existing.title, 'Title')
+        self.assertIsNotNone(existing.synced_time)
+
+    def test_iter_change_requests_save_invalid_records(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        self.records[1]['assignment_group'] = ''
+        self.records[2]['assignment_group'] = 'group'
+
+        records = list(self.handler.iter_change_requests(page_size=3, save=True))
+
+        # The rest of the page of the invalid record is saved
+        self.assertEqual(len(records), 7)
+        self.assertEqual(ChangeRequest.objects.count(), 6)
+        self.assertFalse(ChangeRequest.objects.filter(number='CHG0000002').exists())
+        self.assertIsNone(ChangeRequest.objects.get(number='CHG0000001').assignment_group_guid)
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+    SNOW_ASSIGNMENT_GROUP='assignment_group',
+    SNOW_RETRY_BACKOFF=0,
+)
+@mock.patch('django_snow.helpers.clients.pysnow')
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.fake_resource = mock.MagicMock()
+        self.fake_resource.create.return_value = {
+            'sys_id': uuid.uuid4().hex,
+            'number': 'CHG0000001',
+            'short_description': 'Title',
+            'description': 'Description',
+            'assignment_group': uuid.uuid4().hex,
+            'state': ChangeRequest.TICKET_STATE_OPEN,
+        }
+        self.fake_resource.get.return_value.one.return_value = {'sys_id': uuid.uuid4().hex}
+        self.fake_resource.get.return_value.all.return_value = []
+
+    def tearDown(self):
+        ChangeRequestHandler.group_guid_cache.clear()
+        clear_clients()
+
+    def test_get_metrics(self, mock_pysnow):
+        self.assertIsInstance(get_metrics(), NullMetrics)
+        self.assertFalse(get_metrics().enabled)
+
+        client = mock.MagicMock()
+        with override_settings(
+            SNOW_METRICS='django_snow.helpers.metrics.StatsdMetrics', SNOW_METRICS_OPTIONS={'client': client}
+        ):
+            metrics = get_metrics()
+            self.assertIsInstance(metrics, StatsdMetrics)
+            self.assertIs(metrics.client, client)
+            self.assertIs(ChangeRequestHandler().metrics, metrics)
+
+    def test_disabled(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        handler = ChangeRequestHandler()
+
+        with mock.patch.object(handler, '_get_size') as mock_get_size:
+            handler.create_change_request('Title', 'Description')
+        self.assertFalse(mock_get_size.called)
+
+    def test_statsd(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        self.fake_resource.create.side_effect = [make_http_error(503), self.fake_resource.create.return_value]
+        client = mock.MagicMock()
+        handler = ChangeRequestHandler()
+        handler.metrics = StatsdMetrics(client=client)
+
+        handler.create_change_request('Title', 'Description')
+        handler.get_snow_group_guid('assignment_group')
+
+        client.incr.assert_has_calls([
+            mock.call('response.group_lookup.ok'),
+            mock.call('group_cache.miss', 1),
+            mock.call('response.create.503'),
+            mock.call('retry.create'),
+            mock.call('response.create.ok'),
+            mock.call('group_cache.hit', 1),
+        ])
+        client.timing.assert_any_call('request.create', mock.ANY)
+        sizes = [call[0][1] for call in client.timing.call_args_list if call[0][0] == 'request_size.create']
+        self.assertEqual(len(sizes), 2)
+        self.assertGreater(sizes[0], 0)
+
+    @unittest.skipIf(prometheus_client is None, 'prometheus_client is not installed')
+    def test_prometheus(self, mock_pysnow):
+        mock_pysnow.Client.return_value.resource.return_value = self.fake_resource
+        registry = prometheus_client.CollectorRegistry()
+        handler = ChangeRequestHandler()
+        handler.metrics = PrometheusMetrics(registry=registry)
+
+        handler.create_change_request('Title', 'Description')
+        handler.prefetch_group_guids(['assignment_group', 'other_group'])
+
+        def sample(name, **labels):
+            return registry.get_sample_value('django_snow_%s' % name, labels)
+
+        self.assertEqual(sample('request_duration_seconds_count', operation='create', status='ok'), 1)
+        self.assertEqual(sample('request_duration_seconds_count', operation='group_lookup', status='ok'), 2)
+        self.assertGreater(sample('request_size_bytes_sum', operation='create'), 0)
+        self.assertGreater(sample('response_size_bytes_sum', operation='create'), 0)
+        self.assertEqual(sample('group_cache_lookups_total', result='hit'), 1)
+        self.assertEqual(sample('group_cache_lookups_total', result='miss'), 2)
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+    SNOW_ASSIGNMENT_GROUP='assignment_group',
+    SNOW_RETRY_BACKOFF=0,
+    SNOW_USE_SSL=False,
+)
+class TestFakeServiceNow(TestCase):
+
+    def setUp(self):
+        self.server = FakeServiceNow().start()
+        self.settings_override = override_settings(SNOW_HOST=self.server.host)
+        self.settings_override.enable()
+        self.handler = ChangeRequestHandler()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.stop()
+        ChangeRequestHandler.group_guid_cache.clear()
+        clear_clients()
+
+    def test_round_trip(self):
+        change_request = self.handler.create_change_request('Title', 'Description')
+        self.assertEqual(change_request.number, 'CHG0000001')
+        group = FakeServiceNow.get_group('assignment_group')
+        self.assertEqual(uuid.UUID(str(change_request.assignment_group_guid)), uuid.UUID(group['sys_id']))
+
+        self.handler.close_change_request(change_request)
+        record = self.server.change_requests[change_request.sys_id.hex]
+        self.assertEqual(record['state'], ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertEqual(self.server.requests, {'GET': 1, 'POST': 1, 'PATCH': 1})
+
+        fetched = self.handler.get_change_request(change_request.number, max_age=0)
+        self.assertEqual(fetched.pk, change_request.pk)
+        self.assertEqual(fetched.state, ChangeRequest.TICKET_STATE_COMPLETE)
+
+    def test_close_change_requests(self):
+        first = self.handler.create_change_request('First', 'Description')
+        second = self.handler.create_change_request('Second', 'Description')
+        self.handler.close_change_request_with_error(second, {})
+        missing = ChangeRequest.objects.create(
+            sys_id=uuid.uuid4(), number='CHG0000099', title='Missing', description='Description',
+            assignment_group_guid=uuid.uuid4(), state=ChangeRequest.TICKET_STATE_OPEN
+        )
+        closed_time = ChangeRequest.objects.get(pk=second.pk).closed_time
+        self.server.requests.clear()
+
+        # The selection of the change requests, then a single update
+        with self.assertNumQueries(2):
+            results = self.handler.close_change_requests(
+                ChangeRequest.objects.order_by('number'), with_errors=True, payload={'description': 'Failed'}
+            )
+
+        self.assertEqual(self.server.requests, {'PATCH': 3})
+        self.assertEqual([result.item.pk for result in results], [first.pk, second.pk, missing.pk])
+        self.assertIsNone(results[0].error)
+        self.assertIsNone(results[1].error)
+        self.assertIsNone(results[2].change_request)
+        self.assertIn('No Record found', str(results[2].error))
+
+        first.refresh_from_db()
+        self.assertEqual(first.state, ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS)
+        self.assertEqual(first.description, 'Failed')
+        self.assertIsNotNone(first.closed_time)
+        second.refresh_from_db()
+        self.assertEqual(second.description, 'Failed')
+        self.assertEqual(second.closed_time, closed_time)
+        missing.refresh_from_db()
+        self.assertEqual(missing.state, ChangeRequest.TICKET_STATE_OPEN)
+        self.assertIsNone(missing.closed_time)
+
+        # Nothing is left to change
+        self.server.requests.clear()
+        results = self.handler.close_change_requests([first, second], with_errors=True)
+        self.assertEqual(self.server.requests, {})
+        self.assertEqual([result.change_request for result in results], [first, second])
+
+    def test_metrics_status(self):
+        client = mock.MagicMock()
+        self.handler.metrics = StatsdMetrics(client=client)
+
+        change_request = self.handler.create_change_request('Title', 'Description')
+        del self.server.change_requests[change_request.sys_id.hex]
+        with self.assertRaises(ChangeRequestException):
+            self.handler.update_change_request(change_request, {'description': 'Updated'})
+        with override_settings(SNOW_HOST='127.0.0.1:1', SNOW_RETRY_MAX_ATTEMPTS=1):
+            handler = ChangeRequestHandler()
+            handler.metrics = self.handler.metrics
+            with self.assertRaises(requests.ConnectionError):
+                handler.get_change_request(change_request.sys_id, max_age=0)
+
+        responses = [call[0][0] for call in client.incr.call_args_list if call[0][0].startswith('response.')]
+        self.assertEqual(responses, [
+            'response.group_lookup.200', 'response.create.201', 'response.update.404', 'response.get.ConnectionError'
+        ])
+
+    def test_close_change_requests_unexpected_response(self):
+        from pysnow.exceptions import UnexpectedResponseFormat
+
+        first, second, third = [
+            self.handler.create_change_request(title, 'Description') for title in ('First', 'Second', 'Third')
+        ]
+        update_remote = self.handler._update_remote
+
+        def fake_update_remote(change_request, payload):
+            if change_request.pk == second.pk:
+                raise UnexpectedResponseFormat('Unexpected HTTP response code')
+            result = update_remote(change_request, payload)
+            if change_request.pk == third.pk:
+                del result['state']
+            return result
+
+        with mock.patch.object(self.handler, '_update_remote', side_effect=fake_update_remote):
+            results = self.handler.close_change_requests([first, second, third])
+
+        self.assertIsNone(results[0].error)
+        self.assertIn('Unexpected HTTP response code', str(results[1].error))
+        self.assertIsInstance(results[2].error, ChangeRequestException)
+        first.refresh_from_db()
+        self.assertEqual(first.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertEqual(ChangeRequest.objects.filter(state=ChangeRequest.TICKET_STATE_OPEN).count(), 2)
+
+    def test_close_change_requests_transport_error(self):
+        first = self.handler.create_change_request('First', 'Description')
+        second = self.handler.create_change_request('Second', 'Description')
+        update_remote = self.handler._update_remote
+
+        def fake_update_remote(change_request, payload):
+            if change_request.pk == second.pk:
+                raise requests.ConnectionError('Connection reset')
+            return update_remote(change_request, payload)
+
+        with mock.patch.object(self.handler, '_update_remote', side_effect=fake_update_remote):
+            results = self.handler.close_change_requests([first, second])
+
+        self.assertIsNone(results[0].error)
+        self.assertIsNone(results[1].change_request)
+        self.assertIn('Connection reset', str(results[1].error))
+        # The change request closed in SNow is saved regardless
+        first.refresh_from_db()
+        self.assertEqual(first.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertIsNotNone(first.closed_time)
+        second.refresh_from_db()
+        self.assertEqual(second.state, ChangeRequest.TICKET_STATE_OPEN)
+
+    def test_circuit_breaker(self):
+        self.server.error_rate = 1
+        self.handler.circuit_breaker = CircuitBreaker(threshold=2)
+        payload = {'assignment_group': uuid.uuid4().hex}
+
+        for _ in range(2):
+            with self.assertRaises(ChangeRequestException):
+                self.handler.create_change_request('Title', 'Description', payload=dict(payload))
+        self.assertEqual(self.server.requests, {'POST': 2})
+
+        with self.assertRaises(CircuitOpenException):
+            self.handler.create_change_request('Title', 'Description', payload=dict(payload))
+        self.assertEqual(self.server.requests, {'POST': 2})
+
+    def test_faults(self):
+        self.server.throttle_rate = 1
+        with override_settings(SNOW_RETRY_MAX_ATTEMPTS=2):
+            handler = ChangeRequestHandler()
+        with self.assertRaises(HTTPError) as context:
+            handler.get_snow_group_guid('assignment_group')
+        self.assertEqual(context.exception.response.status_code, 429)
+        self.assertEqual(handler.retries['group_lookup'], 1)
+
+        self.server.throttle_rate = 0
+        self.server.error_rate = 1
+        with self.assertRaises(ChangeRequestException):
+            handler.create_change_request('Title', 'Description', payload={'assignment_group': uuid.uuid4().hex})
+        self.assertEqual(self.server.change_requests, {})
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+    SNOW_ASSIGNMENT_GROUP='assignment_group',
+    SNOW_RETRY_BACKOFF=0,
+    SNOW_USE_SSL=False,
+)
+class TestChangeRequestBatch(TestCase):
+
+    def setUp(self):
+        self.server = FakeServiceNow().start()
+        self.settings_override = override_settings(SNOW_HOST=self.server.host)
+        self.settings_override.enable()
+        self.handler = ChangeRequestHandler()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.stop()
+        ChangeRequestHandler.group_guid_cache.clear()
+        clear_clients()
+
+    def test_execute_circuit_open(self):
+        first = self.handler.create_change_request('First', 'Description')
+        second = self.handler.create_change_request('Second', 'Description')
+        self.server.error_rate = 1
+        self.handler.circuit_breaker = CircuitBreaker(threshold=1)
+        send_batch = ChangeRequestBatch._send_batch
+        calls = []
+
+        def fake_send_batch(batch, requests):
+            # The first batch goes through, then SNow fails and opens the circuit
+            self.server.error_rate = 0 if not calls else 1
+            calls.append(requests)
+            return send_batch(batch, requests)
+
+        batch = ChangeRequestBatch(self.handler, batch_size=1)
+        batch.close_change_request(first)
+        batch.close_change_request(second)
+        batch.close_change_request(second)
+        with mock.patch.object(ChangeRequestBatch, '_send_batch', autospec=True, side_effect=fake_send_batch):
+            results = batch.execute()
+
+        self.assertIsNone(results[0].error)
+        self.assertIsInstance(results[1].error, ChangeRequestException)
+        self.assertIsInstance(results[2].error, CircuitOpenException)
+        self.assertEqual(self.server.change_requests[first.sys_id.hex]['state'], ChangeRequest.TICKET_STATE_COMPLETE)
+        # The operations of the batch sent before the circuit opened are saved
+        first.refresh_from_db()
+        self.assertEqual(first.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        second.refresh_from_db()
+        self.assertEqual(second.state, ChangeRequest.TICKET_STATE_OPEN)
+
+    def test_execute(self):
+        first = self.handler.create_change_request('First', 'Description')
+        second = self.handler.create_change_request('Second', 'Description')
+        missing = ChangeRequest.objects.create(
+            sys_id=uuid.uuid4(), number='CHG0000099', title='Missing', description='Description',
+            assignment_group_guid=uuid.uuid4(), state=ChangeRequest.TICKET_STATE_OPEN
+        )
+        self.server.requests.clear()
+
+        batch = ChangeRequestBatch(self.handler, batch_size=2)
+        batch.create_change_request('Third', 'Description', payload={'priority': '2'})
+        batch.close_change_request(first)
+        batch.update_change_request(second, {'short_description': 'Second'})
+        batch.close_change_request_with_error(second, {'description': 'Failed'})
+        batch.close_change_request(missing)
+
+        with self.assertNumQueries(4):
+            results = batch.execute()
+
+        self.assertEqual(self.server.requests, {'POST': 2})
+        self.assertEqual(batch.operations, [])
+        self.assertEqual([result.item.operation for result in results], ['create'] + ['update'] * 4)
+
+        created = results[0].change_request
+        self.assertEqual(created.title, 'Third')
+        self.assertEqual(self.server.change_requests[created.sys_id.hex]['priority'], '2')
+        self.assertTrue(ChangeRequest.objects.filter(sys_id=created.sys_id).exists())
+
+        self.assertIs(results[1].change_request, first)
+        self.assertIsNone(results[2].error)
+        self.assertEqual(results[3].change_request.state, ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS)
+        self.assertIsNone(results[4].change_request)
+        self.assertIsInstance(results[4].error, ChangeRequestException)
+        self.assertIn('No Record found', str(results[4].error))
+
+        first.refresh_from_db()
+        self.assertEqual(first.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertIsNotNone(first.closed_time)
+        second.refresh_from_db()
+        self.assertEqual(second.description, 'Failed')
+        self.assertIsNotNone(second.closed_time)
+        missing.refresh_from_db()
+        self.assertIsNone(missing.closed_time)
+
+        self.assertEqual(batch.execute(), [])
+
+    def test_batch_timeout(self):
+        batch = ChangeRequestBatch(self.handler)
+        batch.create_change_request('Title', 'Description')
+        send = requests.adapters.HTTPAdapter.send
+
+        with mock.patch.object(requests.adapters.HTTPAdapter, 'send', autospec=True, side_effect=send) as spy:
+            batch.execute()
+            with override_settings(SNOW_TIMEOUT=5):
+                clear_clients()
+                batch = ChangeRequestBatch(ChangeRequestHandler())
+                batch.create_change_request('Title', 'Description')
+                batch.execute()
+
+        self.assertEqual(spy.call_args_list[-2][1]['timeout'], 60)
+        self.assertEqual(spy.call_args_list[-1][1]['timeout'], 5)
+
+    def test_failed_batch(self):
+        self.server.error_rate = 1
+        batch = ChangeRequestBatch(self.handler)
+        batch.create_change_request('Title', 'Description', payload={'assignment_group': uuid.uuid4().hex})
+
+        results = batch.execute()
+
+        self.assertIsInstance(results[0].error, ChangeRequestException)
+        self.assertFalse(ChangeRequest.objects.exists())
+
+    def test_retried_batch(self):
+        # The creation of the first attempt, which failed with a gateway timeout, went through.
+        sys_id = uuid.uuid4().hex
+        group = FakeServiceNow.get_group('assignment_group')['sys_id']
+        self.server.create_change_request({
+            'sys_id': sys_id, 'short_description': 'Title', 'description': 'Description', 'assignment_group': group,
+        })
+        batch = ChangeRequestBatch(self.handler)
+        batch.create_change_request('Title', 'Description', payload={'sys_id': sys_id})
+
+        with mock.patch.object(self.server, 'get_fault', side_effect=[None, 429, None, None]):
+            results = batch.execute()
+
+        self.assertIsNone(results[0].error)
+        self.assertEqual(results[0].change_request.sys_id.hex, sys_id)
+        self.assertEqual(self.handler.retries['batch'], 1)
+        self.assertEqual(len(self.server.change_requests), 1)
+
+
+class TestImportTime(SimpleTestCase):
+
+    SCRIPT = """
+import json, sys, time
+import django
+from django.conf import settings
+settings.configure(INSTALLED_APPS=['django_snow'], SNOW_INSTANCE='snow', SNOW_API_USER='user', SNOW_API_PASS='pass')
+django.setup()
+
+start = time.perf_counter()
+import django_snow.helpers, django_snow.helpers.batch, django_snow.helpers.outbox, django_snow.helpers.sync
+from django.core.management import load_command_class
+load_command_class('django_snow', 'snow_outbox')
+load_command_class('django_snow', 'snow_sync')
+handler = django_snow.helpers.ChangeRequestHandler()
+imported = time.perf_counter() - start
+loaded = [name for name in ('pysnow', 'requests', 'oauthlib') if name in sys.modules]
+
+start = time.perf_counter()
+handler._get_client()
+connected = time.perf_counter() - start
+
+print(json.dumps({'imported': imported, 'loaded': loaded, 'connected': connected, 'pysnow': 'pysnow' in sys.modules}))
+"""
+
+    def test_import_time(self):
+        output = subprocess.check_output(
+            [sys.executable, '-c', self.SCRIPT], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        result = json.loads(output.decode('utf-8'))
+
+        # pysnow and requests are only imported once SNow is talked to, and cost more than the rest of django_snow.
+        self.assertEqual(result['loaded'], [])
+        self.assertTrue(result['pysnow'])
+        self.assertLess(result['imported'], result['connected'])
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+    SNOW_WEBHOOK_SECRET='secret',
+)
+class TestChangeRequestWebhook(TestCase):
+
+    def setUp(self):
+        self.url = reverse('django_snow:change_request_webhook')
+        self.change_requests = [
+            ChangeRequest.objects.create(
+                sys_id=uuid.uuid4(), number='CHG000000%d' % index, title='Title', description='Description',
+                assignment_group_guid=uuid.uuid4(), state=ChangeRequest.TICKET_STATE_OPEN
+            )
+            for index in range(3)
+        ]
+
+    def post(self, body, secret='secret', encode=lambda digest: digest.hex(), timestamp=None):
+        body = json.dumps(body).encode('utf-8')
+        timestamp = str(int(timestamp if timestamp is not None else time.time()))
+        message = timestamp.encode('ascii') + b'.' + body
+        signature = encode(hmac.new(secret.encode('utf-8'), message, hashlib.sha256).digest())
+        return self.client.post(
+            self.url, body, content_type='application/json', HTTP_X_SNOW_SIGNATURE=signature,
+            HTTP_X_SNOW_TIMESTAMP=timestamp
+        )
+
+    def test_signature(self):
+        body = {'sys_id': self.change_requests[0].sys_id.hex, 'state': ChangeRequest.TICKET_STATE_COMPLETE}
+
+        self.assertEqual(self.post(body, secret='other').status_code, 403)
+        self.assertEqual(self.client.post(self.url, body, content_type='application/json').status_code, 403)
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.assertFalse(ChangeRequest.objects.filter(state=ChangeRequest.TICKET_STATE_COMPLETE).exists())
+
+        response = self.post(body, encode=lambda digest: base64.b64encode(digest).decode('ascii'))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'accepted': 1})
+
+        with override_settings(SNOW_WEBHOOK_SECRET=None):
+            with self.assertRaises(ImproperlyConfigured):
+                self.post(body)
+
+    def test_stale_signature(self):
+        body = {'sys_id': self.change_requests[0].sys_id.hex, 'state': ChangeRequest.TICKET_STATE_COMPLETE}
+
+        self.assertEqual(self.post(body, timestamp=time.time() - 301).status_code, 403)
+        self.assertEqual(self.post(body, timestamp=time.time() + 301).status_code, 403)
+        self.assertFalse(ChangeRequest.objects.filter(state=ChangeRequest.TICKET_STATE_COMPLETE).exists())
+
+        with override_settings(SNOW_WEBHOOK_TOLERANCE=600):
+            self.assertEqual(self.post(body, timestamp=time.time() - 301).status_code, 202)
+
+        # The body signed without its timestamp
+        body = json.dumps(body).encode('utf-8')
+        response = self.client.post(
+            self.url, body, content_type='application/json', HTTP_X_SNOW_TIMESTAMP=str(int(time.time())),
+            HTTP_X_SNOW_SIGNATURE=hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_body(self):
+        sys_id = self.change_requests[0].sys_id.hex
+        self.assertEqual(self.post({'records': [{'state': '3'}]}).status_code, 400)
+        self.assertEqual(self.post({'records': [{'sys_id': 'CHG0000001'}]}).status_code, 400)
+        self.assertEqual(self.post(['records']).status_code, 400)
+        self.assertEqual(self.post({'sys_id': sys_id, 'closed_at': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.post({'sys_id': sys_id, 'assignment_group': 'group'}).status_code, 400)
+        self.assertEqual(self.post({'sys_id': sys_id, 'short_description': 'T' * 1000}).status_code, 400)
+        self.assertEqual(self.post({'sys_id': sys_id, 'sys_updated_on': 'now'}).status_code, 400)
+        self.assertEqual(self.post({'sys_id': sys_id, 'state': {'value': '3'}}).status_code, 400)
+        self.assertFalse(ChangeRequest.objects.exclude(title='Title').exists())
+
+    def test_apply(self):
+        first, second, third = self.change_requests
+        body = {'records': [
+            {'sys_id': first.sys_id.hex, 'state': '3', 'closed_at': '2018-01-29 10:00:00'},
+            {'sys_id': second.sys_id.hex, 'short_description': 'New title'},
+            {'sys_id': third.sys_id.hex, 'state': ChangeRequest.TICKET_STATE_OPEN},
+            {'sys_id': uuid.uuid4().hex, 'state': ChangeRequest.TICKET_STATE_COMPLETE},
+        ]}
+
+        # The selection of the change requests and a single update, within the savepoint of the test's transaction
+        with self.assertNumQueries(4):
+            self.assertEqual(self.post(body).status_code, 202)
+
+        first.refresh_from_db()
+        self.assertEqual(first.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertIsNotNone(first.closed_time)
+        second.refresh_from_db()
+        self.assertEqual(second.title, 'New title')
+        self.assertEqual(second.description, 'Description')
+        self.assertEqual(ChangeRequest.objects.count(), 3)
+
+    def test_buffer(self):
+        first, second, _ = self.change_requests
+        event_buffer = ChangeRequestEventBuffer(max_size=2, max_delay=60)
+
+        with mock.patch('django_snow.views.get_event_buffer', return_value=event_buffer):
+            self.post({'sys_id': first.sys_id.hex, 'state': '3', 'sys_updated_on': '2018-01-29 10:00:02'})
+            # An older event of the same change request, received late
+            self.post({
+                'sys_id': first.sys_id.hex, 'state': '2', 'short_description': 'Old',
+                'sys_updated_on': '2018-01-29 10:00:01',
+            })
+            self.assertFalse(ChangeRequest.objects.exclude(state=ChangeRequest.TICKET_STATE_OPEN).exists())
+
+            with self.assertNumQueries(4):
+                self.post({'sys_id': second.sys_id.hex, 'state': '2'})
+
+        first.refresh_from_db()
+        self.assertEqual((first.state, first.title), ('3', 'Old'))
+        second.refresh_from_db()
+        self.assertEqual(second.state, '2')
+        self.assertEqual(event_buffer.flush(), 0)
+
+    def test_buffer_invalid_record(self):
+        first, second, third = self.change_requests
+        event_buffer = ChangeRequestEventBuffer(max_size=10, max_delay=60)
+
+        event_buffer.add([
+            {'sys_id': first.sys_id.hex, 'state': '3'},
+            {'sys_id': second.sys_id.hex, 'short_description': 'T' * 1000},
+            {'sys_id': third.sys_id.hex, 'closed_at': 'yesterday'},
+        ])
+
+        self.assertEqual(event_buffer.flush(), 1)
+        first.refresh_from_db()
+        self.assertEqual(first.state, '3')
+        self.assertFalse(ChangeRequest.objects.exclude(title='Title').exists())
+        self.assertFalse(ChangeRequest.objects.filter(closed_time__isnull=False).exists())
+
+    def test_buffer_database_error(self):
+        first, second, _ = self.change_requests
+        event_buffer = ChangeRequestEventBuffer(max_size=10, max_delay=60)
+        apply = ChangeRequestSynchronizer._apply
+
+        def fake_apply(synchronizer, records):
+            if any(record['sys_id'] == second.sys_id.hex for record in records):
+                raise DatabaseError('value too long')
+            return apply(synchronizer, records)
+
+        event_buffer.add([{'sys_id': first.sys_id.hex, 'state': '3'}, {'sys_id': second.sys_id.hex, 'state': '3'}])
+        with mock.patch.object(ChangeRequestSynchronizer, '_apply', autospec=True, side_effect=fake_apply):
+            self.assertEqual(event_buffer.flush(), 1)
+
+        self.assertEqual(
+            list(ChangeRequest.objects.filter(state='3').values_list('sys_id', flat=True)), [first.sys_id]
+        )
+
+    @mock.patch('django_snow.helpers.webhook.ChangeRequestSynchronizer')
+    def test_buffer_delay(self, mock_synchronizer):
+        applied = threading.Event()
+        mock_synchronizer.return_value._apply.side_effect = lambda records: applied.set() or len(records)
+        event_buffer = ChangeRequestEventBuffer(max_size=10, max_delay=0.01)
+
+        event_buffer.add([{'sys_id': self.change_requests[0].sys_id.hex, 'state': '3'}])
+
+        self.assertTrue(applied.wait(5))
+        mock_synchronizer.return_value._apply.assert_called_once_with([
+            {'sys_id': self.change_requests[0].sys_id.hex, 'state': '3'}
+        ])
+
+
+@override_settings(
+    SNOW_INSTANCE='devgodaddy',
+    SNOW_API_USER='snow_user',
+    SNOW_API_PASS='snow_pass',
+    SNOW_ASSIGNMENT_GROUP='assignment_group',
+    SNOW_RETRY_BACKOFF=0,
+    SNOW_USE_SSL=False,
+)
+class TestCoalescingChangeRequestHandler(TestCase):
+
+    def setUp(self):
+        self.server = FakeServiceNow().start()
+        self.settings_override = override_settings(SNOW_HOST=self.server.host)
+        self.settings_override.enable()
+        self.handler = CoalescingChangeRequestHandler(window=60)
+        self.change_request = self.handler.create_change_request('Title', 'Description')
+        self.server.requests.clear()
+
+    def tearDown(self):
+        self.handler.flush()
+        self.settings_override.disable()
+        self.server.stop()
+        ChangeRequestHandler.group_guid_cache.clear()
+        clear_clients()
+
+    def test_close(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.handler.update_change_request(self.change_request, {'description': 'Deploying'}))
+            self.handler.update_change_request(
+                self.change_request, {'description': 'Deployed', 'short_description': 'Deploy'}
+            )
+            self.assertEqual(self.server.requests, {})
+            self.assertEqual(self.change_request.description, 'Description')
+
+            self.handler.close_change_request(self.change_request)
+
+        self.assertEqual(self.server.requests, {'PATCH': 1})
+        record = self.server.change_requests[self.change_request.sys_id.hex]
+        self.assertEqual(record['description'], 'Deployed')
+        self.assertEqual(record['short_description'], 'Deploy')
+        self.assertEqual(record['state'], ChangeRequest.TICKET_STATE_COMPLETE)
+
+        self.change_request.refresh_from_db()
+        self.assertEqual(self.change_request.description, 'Deployed')
+        self.assertEqual(self.change_request.state, ChangeRequest.TICKET_STATE_COMPLETE)
+        self.assertIsNotNone(self.change_request.closed_time)
+        self.assertEqual(self.handler.flush(), [])
+
+    def test_closing_update(self):
+        self.handler.update_change_request(self.change_request, {'description': 'Deploying'})
+
+        payload = {'state': ChangeRequest.TICKET_STATE_COMPLETE}
+        record = self.handler.update_change_request(self.change_request, payload)
+
+        self.assertEqual(self.server.requests, {'PATCH': 1})
+        self.assertEqual(record['description'], 'Deploying')
+        self.assertEqual(record['state'], ChangeRequest.TICKET_STATE_COMPLETE)
+
+    def test_close_error(self):
+        self.handler.update_change_request(self.change_request, {'description': 'Deploying'})
+        del self.server.change_requests[self.change_request.sys_id.hex]
+
+        with self.assertRaises(ChangeRequestException):
+            self.handler.close_change_request_with_error(self.change_request, {'description': 'Failed'})
+        self.assertEqual(self.handler.flush(), [])
+
+    def test_flush(self):
+        other = self.handler.create_change_request('Other', 'Description')
+        self.server.requests.clear()
+        self.handler.update_change_request(self.change_request, {'description': 'First'})
+        self.handler.update_change_request(other, {'description': 'Other'})
+        self.handler.update_change_request(self.change_request, {'description': 'Second'})
+
+        results = self.handler.flush()
+
+        self.assertEqual(self.server.requests, {'PATCH': 2})
+        self.assertEqual([result.item for result in results], [{'description': 'Second'}, {'description': 'Other'}])
+        self.assertEqual([result.change_request for result in results], [self.change_request, other])
+        self.assertEqual(ChangeRequest.objects.get(pk=self.change_request.pk).description, 'Second')
+        self.assertEqual(self.handler.flush(), [])
+
+    def test_context_manager(self):
+        with self.handler as handler:
+            handler.update_change_request(self.change_request, {'description': 'Updated'})
+            self.assertEqual(self.server.requests, {})
+
+        self.assertEqual(self.server.requests, {'PATCH': 1})
+
+    def test_flush_at_exit(self):
+        self.handler.update_change_request(self.change_request, {'description': 'Updated'})
+
+        _flush_handlers()
+
+        self.assertEqual(self.server.requests, {'PATCH': 1})
+        self.assertEqual(ChangeRequest.objects.get(pk=self.change_request.pk).description, 'Updated')
+
+    def test_close_change_requests(self):
+        self.handler.update_change_request(self.change_request, {'description': 'Deploying'})
+
+        results = self.handler.close_change_requests(ChangeRequest.objects.all())
+
+        self.assertEqual(self.server.requests, {'PATCH': 2})
+        self.assertIsNone(results[0].error)
+        record = self.server.change_requests[self.change_request.sys_id.hex]
+        self.assertEqual((record['description'], record['state']), ('Deploying', ChangeRequest.TICKET_STATE_COMPLETE))
+
+    def test_no_window(self):
+        handler = CoalescingChangeRequestHandler(window=0)
+
+        self.assertIsNotNone(handler.update_change_request(self.change_request, {'description': 'Updated'}))
+        self.assertEqual(self.server.requests, {'PATCH': 1})
+
+    @mock.patch.object(ChangeRequestHandler, 'update_change_request')
+    def test_window(self, mock_update):
+        flushed = threading.Event()
+        mock_update.side_effect = lambda change_request, payload: flushed.set()
+        handler = CoalescingChangeRequestHandler(window=0.01)
+
+        handler.update_change_request(self.change_request, {'description': 'Updated'})
+
+        self.assertTrue(flushed.wait(5))
+        mock_update.assert_called_once_with(self.change_request, {'description': 'Updated'})
+        self.assertEqual(handler.flush(), [])
+
+    @mock.patch('django_snow.helpers.coalescing.connections')
+    def test_window_per_change_request(self, mock_connections):
+        other = self.handler.create_change_request('Other', 'Description')
+        self.server.requests.clear()
+        self.handler.update_change_request(self.change_request, {'description': 'First'})
+        self.handler.update_change_request(other, {'description': 'Other'})
+        self.handler._timer.cancel()
+        self.handler._pending[self.change_request.sys_id].deadline = time.monotonic()
+
+        # Neither the later updates of the change request postpone its deadline, nor those of the others
+        self.handler.update_change_request(self.change_request, {'description': 'Second'})
+        self.handler._flush_later()
+
+        self.assertEqual(self.server.requests, {'PATCH': 1})
+        self.assertEqual(self.server.change_requests[self.change_request.sys_id.hex]['description'], 'Second')
+        self.assertEqual(list(self.handler._pending), [other.sys_id])
+        # The timer is started again, for the deadline of the other change request
+        self.assertIsNotNone(self.handler._timer)
+
+
+class TestChangeRequestArchiver(TestCase):
+
+    def setUp(self):
+        self.old = timezone.now() - timedelta(days=100)
+
+    def create(self, number, state=ChangeRequest.TICKET_STATE_COMPLETE, closed_time=None):
+        return ChangeRequest.objects.create(
+            sys_id=uuid.uuid4(), number=number, title='Title', description='Description',
+            assignment_group_guid=uuid.uuid4(), state=state, closed_time=closed_time or self.old
+        )
+
+    @mock.patch('django_snow.helpers.archive.time.sleep')
+    def test_archive(self, mock_sleep):
+        # Closed at the same time, so that the chunks are split on the sys_id
+        archived = [self.create('CHG%07d' % index) for index in range(5)]
+        recent = self.create('CHG0000010', closed_time=timezone.now() - timedelta(days=10))
+        reopened = self.create('CHG0000011', state=ChangeRequest.TICKET_STATE_IN_PROGRESS)
+        queued = self.create('CHG0000012')
+        ChangeRequestOperation.objects.create(change_request=queued, operation=ChangeRequestOperation.OPERATION_UPDATE)
+        done = self.create('CHG0000013', state=ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS)
+        ChangeRequestOperation.objects.create(
+            change_request=done, operation=ChangeRequestOperation.OPERATION_CLOSE,
+            status=ChangeRequestOperation.STATUS_DONE
+        )
+        archived.append(done)
+
+        # Per chunk, within a transaction: the selection, the insert, then the collection and the delete of the
+        # operations and of the change requests. Then the empty selection ending the walk.
+        with self.assertNumQueries(3 * 7 + 3):
+            count = ChangeRequestArchiver(days=90, chunk_size=2, pause=0.5).archive()
+
+        self.assertEqual(count, 6)
+        self.assertEqual(mock_sleep.call_count, 3)
+        self.assertEqual(
+            set(ChangeRequest.objects.values_list('pk', flat=True)), {recent.pk, reopened.pk, queued.pk}
+        )
+        self.assertEqual(
+            set(ArchivedChangeRequest.objects.values_list('pk', flat=True)),
+            {change_request.pk for change_request in archived}
+        )
+        archived_change_request = ArchivedChangeRequest.objects.get(pk=done.pk)
+        self.assertEqual(archived_change_request.number, 'CHG0000013')
+        self.assertEqual(archived_change_request.state, ChangeRequest.TICKET_STATE_COMPLETE_WITH_ERRORS)
+        self.assertEqual(archived_change_request.closed_time, done.closed_time)
+        self.assertEqual(archived_change_request.created_time, done.created_time)
+        self.assertIsNotNone(archived_change_request.archived_time)
+        self.assertFalse(ChangeRequestOperation.objects.filter(change_request_id=done.pk).exists())
+
+        self.assertEqual(ChangeRequestArchiver(days=90).archive(), 0)
+
+    def test_delete(self):
+        self.create('CHG0000001')
+        recent = self.create('CHG0000002', closed_time=timezone.now())
+
+        out = six.StringIO()
+        call_command('snow_archive', days=30, delete=True, stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Deleted 1 change requests.')
+        self.assertEqual(list(ChangeRequest.objects.all()), [recent])
+        self.assertFalse(ArchivedChangeRequest.objects.exists())
+
+    def test_snow_archive_command(self):
+        self.create('CHG0000001')
+
+        out = six.StringIO()
+        call_command('snow_archive', stdout=out)
+
+        self.assertEqual(out.getvalue().strip(), 'Archived 1 change requests.')
+        self.assertEqual(ArchivedChangeRequest.objects.get().number, 'CHG0000001')
+
+
+class TestChangeRequestAdmin(TestCase):
+
+    def setUp(self):
+        self.group_guid = uuid.uuid4()
+        self.change_requests = [
+            ChangeRequest.objects.create(
+                sys_id=uuid.uuid4(), number=number, title='Title', description='Description',
+                assignment_group_guid=group_guid, state=state
+            )
+            for number, group_guid, state in [
+                ('CHG0000001', self.group_guid, ChangeRequest.TICKET_STATE_OPEN),
+                ('CHG0000002', self.group_guid, ChangeRequest.TICKET_STATE_COMPLETE),
+                ('CHG0000010', uuid.uuid4(), ChangeRequest.TICKET_STATE_IN_PROGRESS),
+            ]
+        ]
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.url = reverse('admin:django_snow_changerequest_changelist')
+
+    def get_results(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(change_request.number for change_request in response.context['cl'].result_list)
+
+    def test_paginator(self):
+        queryset = ChangeRequest.objects.order_by('number')
+        paginator = EstimatedCountPaginator(queryset, 1)
+        paginator.max_count = 2
+        self.assertEqual(paginator.count, 2)
+
+        with mock.patch.object(EstimatedCountPaginator, '_estimate_count', return_value=1000000) as mock_estimate:
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 1000000)
+            self.assertEqual(EstimatedCountPaginator(queryset.open(), 100).count, 2)
+        mock_estimate.assert_called_once_with(queryset)
+
+        # SQLite does not estimate the tables
+        self.assertIsNone(EstimatedCountPaginator._estimate_count(queryset))
+
+    def test_changelist(self):
+        self.assertEqual(self.get_results(), ['CHG0000001', 'CHG0000002', 'CHG0000010'])
+        self.assertEqual(self.get_results(q='chg000000'), ['CHG0000001', 'CHG0000002'])
+        self.assertEqual(self.get_results(q='CHG0000002'), ['CHG0000002'])
+        self.assertEqual(self.get_results(q=str(self.group_guid)), ['CHG0000001', 'CHG0000002'])
+        self.assertEqual(self.get_results(q=self.change_requests[2].sys_id.hex), ['CHG0000010'])
+        self.assertEqual(self.get_results(state=ChangeRequest.TICKET_STATE_COMPLETE), ['CHG0000002'])
+        self.assertEqual(self.get_results(assignment_group_guid=self.group_guid.hex), ['CHG0000001', 'CHG0000002'])
+        self.assertEqual(self.get_results(assignment_group_guid='invalid'), [])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        # The change requests are only counted up to the cap of the paginator
+        counts = [query['sql'] for query in queries if 'COUNT(' in query['sql']]
+        self.assertEqual(len(counts), 1)
+        self.assertIn('LIMIT 10000', counts[0])
+        self.assertNotContains(response, 'Add service-now change request')
+        changelist = response.context['cl']
+        groups = [choice['display'] for choice in changelist.filter_specs[1].choices(changelist)]
+        self.assertEqual(
+            sorted(groups[1:]), sorted([str(self.group_guid), str(self.change_requests[2].assignment_group_guid)])
+        )
+
+    def test_changelist_filters_are_indexed(self):
+        for params, index in [
+            ({'state': ChangeRequest.TICKET_STATE_COMPLETE}, 'django_snow_cr_state_idx'),
+            ({'assignment_group_guid': self.group_guid.hex}, 'django_snow_cr_group_state_idx'),
+        ]:
+            response = self.client.get(self.url, params)
+            self.assertIn('USING INDEX %s' % index, response.context['cl'].queryset.explain())
+
+    @mock.patch.object(ChangeRequestAdmin, 'get_handler')
+    def test_close_in_snow(self, mock_get_handler):
+        mock_get_handler.return_value.close_change_requests.side_effect = lambda change_requests: [
+            ChangeRequestResult(change_request, change_request, None) for change_request in change_requests[:1]
+        ] + [
+            ChangeRequestResult(change_request, None, ChangeRequestException('Failed'))
+            for change_request in change_requests[1:]
+        ]
+
+        response = self.client.post(self.url, {
+            'action': 'close_in_snow',
+            '_selected_action': [change_request.pk for change_request in self.change_requests],
+        }, follow=True)
+
+        change_requests = mock_get_handler.return_value.close_change_requests.call_args[0][0]
+        # The closed change request is left out
+        self.assertEqual(
+            sorted(change_request.number for change_request in change_requests), ['CHG0000001', 'CHG0000010']
+        )
+        messages = [str(message) for message in response.context['messages']]
+        self.assertEqual(len(messages), 2)
+        self.assertIn('Closed 1 change requests in SNow.', messages)
+
+    @mock.patch.object(ChangeRequestAdmin, 'get_handler')
+    def test_refresh_from_snow(self, mock_get_handler):
+        mock_get_handler.return_value.get_change_requests.return_value = {
+            self.change_requests[0].sys_id: self.change_requests[0]
+        }
+
+        response = self.client.post(self.url, {
+            'action': 'refresh_from_snow',
+            '_selected_action': [self.change_requests[0].pk, self.change_requests[1].pk],
+        }, follow=True)
+
+        mock_get_handler.return_value.get_change_requests.assert_called_once_with(
+            mock.ANY, max_age=0
+        )
+        self.assertEqual(
+            set(mock_get_handler.return_value.get_change_requests.call_args[0][0]),
+            {self.change_requests[0].sys_id, self.change_requests[1].sys_id}
+        )
+        messages = [str(message) for message in response.context['messages']]
+        self.assertEqual(
+            messages, ['Refreshed 1 change requests from SNow.', '1 change requests are not in SNow.']
+        )
+
+    @mock.patch.object(ChangeRequestAdmin, 'get_handler')
+    @mock.patch.object(ChangeRequestAdmin, 'max_action_size', 2)
+    def test_max_action_size(self, mock_get_handler):
+        response = self.client.post(self.url, {
+            'action': 'refresh_from_snow',
+            '_selected_action': [change_request.pk for change_request in self.change_requests],
+        }, follow=True)
+
+        self.assertFalse(mock_get_handler.called)
+        messages = [str(message) for message in response.context['messages']]
+        self.assertEqual(messages, ['Select at most 2 change requests at once.'])